@@ -0,0 +1,314 @@
+#
+# aggregates.py
+# Maintains per-movie rating aggregates so that the object tier
+# does not have to scan the Ratings table to rank movies or to
+# report the number of reviews / average rating of a movie.
+#
+# The aggregates live in the Movie_Rating_Stats table (one row per
+# movie that has at least one rating):
+#
+#   Movie_ID     INTEGER PRIMARY KEY
+#   Num_Reviews  number of ratings
+#   Sum_Rating   sum of the ratings
+#   Sum_Squares  sum of the squared ratings (for variance / std dev)
+#   Avg_Rating   Sum_Rating / Num_Reviews
+#
+# Triggers on Ratings keep the table up to date inside the same
+# transaction as the insert / update / delete that changed the
+# ratings, so add_review (and any other writer) never leaves the
+# aggregates behind.
+#
+# Functions:
+# - install_rating_stats(dbConn): creates the table, index and triggers and backfills it.
+# - rebuild_rating_stats(dbConn, workers): recomputes every aggregate from the Ratings table.
+# - has_rating_stats(dbConn): True if the aggregates are installed in the database.
+#
+# Usage (one-time backfill, or a rebuild after bulk changes):
+#   python aggregates.py movielens.db
+#   python aggregates.py movielens.db --rebuild
+#   python aggregates.py movielens.db --rebuild --workers 8
+#
+import argparse
+import sqlite3
+import sys
+
+import datatier
+import parallel
+
+
+TABLE_NAME = "Movie_Rating_Stats"
+
+_create_table = """
+CREATE TABLE IF NOT EXISTS Movie_Rating_Stats (
+    Movie_ID     INTEGER PRIMARY KEY,
+    Num_Reviews  INTEGER NOT NULL,
+    Sum_Rating   NUMERIC NOT NULL,
+    Sum_Squares  NUMERIC NOT NULL,
+    Avg_Rating   REAL NOT NULL
+)
+"""
+
+# top-N walks this index from the highest average down, so the
+# ranking query never has to sort; ties are broken by Movie_ID
+# (ascending), as in the ranking query that aggregates the Ratings
+# table
+_create_index = """
+CREATE INDEX IF NOT EXISTS Movie_Rating_Stats_By_Rank
+    ON Movie_Rating_Stats (Avg_Rating DESC, Movie_ID ASC)
+"""
+
+# the earlier ranking index, which broke ties the other way
+_drop_old_index = "DROP INDEX IF EXISTS Movie_Rating_Stats_By_Avg"
+
+_create_insert_trigger = """
+CREATE TRIGGER IF NOT EXISTS Ratings_Stats_Insert
+AFTER INSERT ON Ratings
+WHEN NEW.Rating IS NOT NULL
+BEGIN
+    INSERT INTO Movie_Rating_Stats
+        (Movie_ID, Num_Reviews, Sum_Rating, Sum_Squares, Avg_Rating)
+    VALUES
+        (NEW.Movie_ID, 1, NEW.Rating, NEW.Rating * NEW.Rating, CAST(NEW.Rating AS REAL))
+    ON CONFLICT (Movie_ID) DO UPDATE SET
+        Num_Reviews = Num_Reviews + 1,
+        Sum_Rating  = Sum_Rating + excluded.Sum_Rating,
+        Sum_Squares = Sum_Squares + excluded.Sum_Squares,
+        Avg_Rating  = CAST(Sum_Rating + excluded.Sum_Rating AS REAL) / (Num_Reviews + 1);
+END
+"""
+
+_create_delete_trigger = """
+CREATE TRIGGER IF NOT EXISTS Ratings_Stats_Delete
+AFTER DELETE ON Ratings
+WHEN OLD.Rating IS NOT NULL
+BEGIN
+    UPDATE Movie_Rating_Stats SET
+        Num_Reviews = Num_Reviews - 1,
+        Sum_Rating  = Sum_Rating - OLD.Rating,
+        Sum_Squares = Sum_Squares - OLD.Rating * OLD.Rating,
+        Avg_Rating  = CASE WHEN Num_Reviews > 1
+                           THEN CAST(Sum_Rating - OLD.Rating AS REAL) / (Num_Reviews - 1)
+                           ELSE 0 END
+    WHERE Movie_ID = OLD.Movie_ID;
+    DELETE FROM Movie_Rating_Stats
+    WHERE Movie_ID = OLD.Movie_ID AND Num_Reviews <= 0;
+END
+"""
+
+# an update is treated as "delete the old rating, insert the new one"
+_create_update_trigger = """
+CREATE TRIGGER IF NOT EXISTS Ratings_Stats_Update
+AFTER UPDATE OF Movie_ID, Rating ON Ratings
+BEGIN
+    UPDATE Movie_Rating_Stats SET
+        Num_Reviews = Num_Reviews - 1,
+        Sum_Rating  = Sum_Rating - OLD.Rating,
+        Sum_Squares = Sum_Squares - OLD.Rating * OLD.Rating,
+        Avg_Rating  = CASE WHEN Num_Reviews > 1
+                           THEN CAST(Sum_Rating - OLD.Rating AS REAL) / (Num_Reviews - 1)
+                           ELSE 0 END
+    WHERE Movie_ID = OLD.Movie_ID AND OLD.Rating IS NOT NULL;
+    DELETE FROM Movie_Rating_Stats
+    WHERE Movie_ID = OLD.Movie_ID AND Num_Reviews <= 0;
+    INSERT INTO Movie_Rating_Stats
+        (Movie_ID, Num_Reviews, Sum_Rating, Sum_Squares, Avg_Rating)
+    SELECT NEW.Movie_ID, 1, NEW.Rating, NEW.Rating * NEW.Rating, CAST(NEW.Rating AS REAL)
+    WHERE NEW.Rating IS NOT NULL
+    ON CONFLICT (Movie_ID) DO UPDATE SET
+        Num_Reviews = Num_Reviews + 1,
+        Sum_Rating  = Sum_Rating + excluded.Sum_Rating,
+        Sum_Squares = Sum_Squares + excluded.Sum_Squares,
+        Avg_Rating  = CAST(Sum_Rating + excluded.Sum_Rating AS REAL) / (Num_Reviews + 1);
+END
+"""
+
+_clear_stats = """
+DELETE FROM Movie_Rating_Stats
+"""
+
+_backfill_stats = """
+INSERT INTO Movie_Rating_Stats
+    (Movie_ID, Num_Reviews, Sum_Rating, Sum_Squares, Avg_Rating)
+SELECT
+    Movie_ID, COUNT(Rating), SUM(Rating), SUM(Rating * Rating), AVG(Rating)
+FROM
+    Ratings
+WHERE
+    Rating IS NOT NULL
+GROUP BY
+    Movie_ID
+"""
+
+# deletes nothing, but takes the write lock (without writing a page)
+_take_write_lock = """
+DELETE FROM Movie_Rating_Stats WHERE 0
+"""
+
+# one movie's aggregates, computed elsewhere (see parallel.py)
+_insert_stats = """
+INSERT INTO Movie_Rating_Stats
+    (Movie_ID, Num_Reviews, Sum_Rating, Sum_Squares, Avg_Rating)
+VALUES
+    (?1, ?2, ?3, ?4, CAST(?3 AS REAL) / ?2)
+"""
+
+
+##################################################################
+#
+# has_rating_stats:
+#
+# Returns True if the Movie_Rating_Stats table has been installed
+# in the database behind the given connection, False if not.
+# The answer is remembered per connection, so only the first call
+# touches the database.
+#
+def has_rating_stats(dbConn):
+    info = datatier.connection_info(dbConn)
+    if "rating_stats" not in info:
+        info["rating_stats"] = datatier.table_exists(dbConn, TABLE_NAME)
+    return info["rating_stats"]
+
+
+##################################################################
+#
+# install_rating_stats:
+#
+# Creates the aggregate table, its ranking index and the triggers
+# that maintain it, then backfills it from the Ratings table. All
+# of this happens in one transaction. Calling it on a database
+# that already has the aggregates recomputes them.
+#
+# Returns: the number of movies with aggregates, or
+#          -1 if an error occurs (with a message printed).
+#
+def install_rating_stats(dbConn):
+    rows = datatier.perform_actions(dbConn, [
+        (_create_table, None),
+        (_drop_old_index, None),
+        (_create_index, None),
+        (_create_insert_trigger, None),
+        (_create_delete_trigger, None),
+        (_create_update_trigger, None),
+        (_clear_stats, None),
+        (_backfill_stats, None),
+    ])
+    if rows == -1:
+        return -1
+
+    datatier.connection_info(dbConn)["rating_stats"] = True
+    return _count_stats(dbConn)
+
+
+##################################################################
+#
+# rebuild_rating_stats:
+#
+# Throws away the stored aggregates and recomputes them from the
+# Ratings table in a single transaction (e.g. after the Ratings
+# table was loaded with the triggers missing).
+#
+# With workers other than 1 (None: one per CPU) the Ratings table
+# is aggregated by that many processes with parallel.py instead of
+# one GROUP BY query. This needs a database file the workers can
+# open; for an in-memory database, or a connection with uncommitted
+# writes, the rebuild runs in one query.
+#
+# Returns: the number of movies with aggregates, or
+#          -1 if an error occurs (with a message printed).
+#
+def rebuild_rating_stats(dbConn, workers = 1):
+    if not has_rating_stats(dbConn):
+        return install_rating_stats(dbConn)
+
+    # the workers cannot see writes this connection has not committed
+    dbName = datatier.database_file(dbConn) if workers != 1 else None
+    if dbName is not None and not getattr(dbConn, "in_transaction", False):
+        return _rebuild_in_parallel(dbConn, dbName, workers)
+
+    rows = datatier.perform_actions(dbConn, [
+        (_clear_stats, None),
+        (_backfill_stats, None),
+    ])
+    if rows == -1:
+        return -1
+
+    return _count_stats(dbConn)
+
+
+# the workers aggregate before anything is written, so they are not
+# held up by a write lock (with a rollback journal, the lock taken
+# by clearing a large table blocks their reads). Then this
+# connection takes the write lock, and a separate connection checks
+# whether anything was committed since the workers started: if not,
+# the aggregates are current; otherwise they are recomputed with one
+# query under the lock.
+def _rebuild_in_parallel(dbConn, dbName, workers):
+    try:
+        witness = datatier.connect(dbName, read_only = True)
+        try:
+            version = _data_version(witness)
+            stats = parallel.aggregate_ratings(dbName, workers)
+            if stats is None:
+                raise RuntimeError("aggregating the ratings failed")
+            with datatier.transaction(dbConn):
+                # nothing can be committed once this holds the write lock
+                if datatier.perform_action(dbConn, _take_write_lock) == -1:
+                    raise RuntimeError("locking the database failed")
+                current = _data_version(witness) == version
+                if datatier.perform_action(dbConn, _clear_stats) == -1:
+                    raise RuntimeError("clearing the aggregates failed")
+                if current:
+                    inserted = datatier.perform_many(dbConn, _insert_stats, [stats])
+                else:
+                    inserted = datatier.perform_action(dbConn, _backfill_stats)
+                if inserted == -1:
+                    raise RuntimeError("storing the aggregates failed")
+        finally:
+            datatier.forget_connection(witness)
+            witness.close()
+    except Exception as err:
+        print("rebuild_rating_stats failed:", err)
+        return -1
+
+    return _count_stats(dbConn)
+
+
+# changes whenever another connection commits to the database
+def _data_version(dbConn):
+    row = datatier.select_one_row(dbConn, "PRAGMA data_version")
+    if not row:
+        raise RuntimeError("reading the data version failed")
+    return row[0]
+
+
+def _count_stats(dbConn):
+    row = datatier.select_one_row(dbConn, "SELECT COUNT(*) FROM Movie_Rating_Stats")
+    if not row:
+        return -1
+    return row[0]
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Install (and backfill) or rebuild the per-movie rating aggregates.")
+    parser.add_argument("database", help="path to the MovieLens sqlite database")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="recompute the aggregates of an existing installation")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes that aggregate the ratings for --rebuild (default 1)")
+    args = parser.parse_args()
+
+    dbConn = sqlite3.connect(args.database)
+    if args.rebuild:
+        count = rebuild_rating_stats(dbConn, args.workers)
+    else:
+        count = install_rating_stats(dbConn)
+    dbConn.close()
+
+    if count == -1:
+        sys.exit(1)
+    print(f"Rating aggregates ready for {count:,} movies.")
@@ -0,0 +1,338 @@
+#
+# analytics.py
+# Rating statistics for the whole catalog at once, computed with
+# NumPy: per-movie rating histograms (0-10), averages, standard
+# deviations, percentiles and Bayesian averages, and a top-N
+# ranking by Bayesian average as an alternative to
+# objecttier.get_top_N_movies.
+#
+# The Ratings table is read once, as one (Movie_ID, Rating, count)
+# row per movie and rating value -- sqlite groups the rows while it
+# walks the Ratings_By_Movie index (see schema.py), so at most 11
+# rows per movie reach Python -- fetched in chunks straight into
+# a preallocated NumPy array. Everything after that is array arithmetic.
+#
+# The Bayesian average of a movie with n reviews averaging R is
+#   (n * R + m * C) / (n + m)
+# where C is the average of all ratings and m (prior_weight) is how
+# many reviews' worth of weight the catalog average gets: movies
+# with few reviews are pulled towards C, so a single 10/10 review
+# does not put a movie at the top of the ranking.
+#
+# NumPy is optional for the rest of the application; the functions
+# here print a message and return None if it is not installed.
+#
+# Classes:
+# - RatingAnalytics: the per-movie statistics.
+#
+# Functions:
+# - load_rating_analytics(dbConn, chunk_size): reads the ratings and computes the statistics.
+# - top_N_bayesian(dbConn, N, min_num_reviews, prior_weight, analytics): top N by Bayesian average.
+#
+# Usage:
+#   python analytics.py movielens.db --top 10 --min-reviews 10
+#   python analytics.py movielens.db --movie 862
+#
+import argparse
+import json
+import sqlite3
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import datatier
+import objecttier
+
+
+# ratings are whole numbers from 0 to 10
+NUM_RATING_VALUES = 11
+
+# how many reviews of each rating value every movie has
+_histogram_rows_sql = datatier.prepare("analytics.histograms", """
+    SELECT
+        Movie_ID, Rating, COUNT(*)
+    FROM
+        Ratings
+    WHERE
+        Rating IS NOT NULL
+    GROUP BY
+        Movie_ID, Rating
+""")
+
+# titles of the movies in a JSON array of IDs
+_movies_by_id_sql = datatier.prepare("analytics.movies", """
+    SELECT
+        Movie_ID, Title, strftime('%Y', Release_Date)
+    FROM
+        Movies
+    WHERE
+        Movie_ID IN (SELECT value FROM json_each(?))
+""")
+
+
+##################################################################
+#
+# RatingAnalytics class:
+# - Rating statistics of every movie with at least one review, as
+#   NumPy arrays with one entry (row) per movie, in Movie_ID order:
+#    + Constructor(movie_ids, histograms)
+#    + index_of(movie_id): the movie's row, or -1 if it has no reviews
+#    + bayesian_averages(prior_weight, prior_mean): array of floats;
+#      prior_weight defaults to the median number of reviews per
+#      movie and prior_mean to global_mean
+#    + percentiles(q): array of the q-th percentile rating of each
+#      movie (nearest rank: the lowest rating at least q percent of
+#      its reviews are at or below)
+#    + summary(movie_id): a dictionary of one movie's statistics, or
+#      None if it has no reviews
+#    + Properties:
+#      > movie_ids: int array
+#      > histograms: int array, shape (movies, 11): reviews per rating
+#      > num_reviews: int array
+#      > averages: float array
+#      > std_devs: float array (population standard deviation)
+#      > global_mean: float, the average of every rating
+#      > num_skipped: int, reviews ignored because their rating was
+#                    not a whole number from 0 to 10
+#
+class RatingAnalytics:
+    # Constructor
+    def __init__(self, movie_ids, histograms, num_skipped = 0):
+        self._movie_ids = movie_ids
+        self._histograms = histograms
+        self._num_skipped = num_skipped
+
+        values = numpy.arange(NUM_RATING_VALUES, dtype = numpy.float64)
+        self._num_reviews = histograms.sum(axis = 1)
+        sums = histograms @ values
+        squares = histograms @ (values * values)
+        with numpy.errstate(invalid = "ignore", divide = "ignore"):
+            self._averages = sums / self._num_reviews
+            variances = squares / self._num_reviews - self._averages * self._averages
+        # rounding can make a variance of 0 slightly negative
+        self._std_devs = numpy.sqrt(numpy.clip(variances, 0.0, None))
+        total = self._num_reviews.sum()
+        self._global_mean = float(sums.sum() / total) if total else 0.0
+
+    #read only properties
+
+    # movie_ids : int array
+    @property
+    def movie_ids(self):
+        return self._movie_ids
+
+    # histograms : int array (movies x 11)
+    @property
+    def histograms(self):
+        return self._histograms
+
+    # num_reviews : int array
+    @property
+    def num_reviews(self):
+        return self._num_reviews
+
+    # averages : float array
+    @property
+    def averages(self):
+        return self._averages
+
+    # std_devs : float array
+    @property
+    def std_devs(self):
+        return self._std_devs
+
+    # global_mean : float
+    @property
+    def global_mean(self):
+        return self._global_mean
+
+    # num_skipped : int
+    @property
+    def num_skipped(self):
+        return self._num_skipped
+
+    def index_of(self, movie_id):
+        i = int(numpy.searchsorted(self._movie_ids, movie_id))
+        if i < len(self._movie_ids) and self._movie_ids[i] == movie_id:
+            return i
+        return -1
+
+    def bayesian_averages(self, prior_weight = None, prior_mean = None):
+        if prior_weight is None:
+            prior_weight = float(numpy.median(self._num_reviews)) if len(self._num_reviews) else 0.0
+        if prior_mean is None:
+            prior_mean = self._global_mean
+        n = self._num_reviews
+        return (n * self._averages + prior_weight * prior_mean) / (n + prior_weight)
+
+    def percentiles(self, q):
+        if not 0 <= q <= 100:
+            raise ValueError("q must be between 0 and 100")
+        cumulative = numpy.cumsum(self._histograms, axis = 1)
+        # the rank of the review at the q-th percentile (at least the first)
+        rank = numpy.maximum(numpy.ceil(self._num_reviews * (q / 100.0)), 1)
+        return (cumulative < rank[:, None]).sum(axis = 1)
+
+    def summary(self, movie_id):
+        i = self.index_of(movie_id)
+        if i == -1:
+            return None
+        return {
+            "movie_id": int(self._movie_ids[i]),
+            "num_reviews": int(self._num_reviews[i]),
+            "average": float(self._averages[i]),
+            "std_dev": float(self._std_devs[i]),
+            "bayesian_average": float(self.bayesian_averages()[i]),
+            "median": int(self.percentiles(50)[i]),
+            "p10": int(self.percentiles(10)[i]),
+            "p90": int(self.percentiles(90)[i]),
+            "histogram": [int(count) for count in self._histograms[i]],
+        }
+
+
+##################################################################
+#
+# load_rating_analytics:
+#
+# Reads the rating counts of every movie from the database,
+# chunk_size rows at a time, and computes their statistics.
+#
+# Returns: a RatingAnalytics object, or
+#          None if NumPy is not installed or an error occurs
+#          (with a message printed).
+#
+def load_rating_analytics(dbConn, chunk_size = 100000):
+    if numpy is None:
+        print("load_rating_analytics failed: numpy is not installed")
+        return None
+    try:
+        # the batches fetchmany returns are copied straight into one
+        # preallocated (rows x 3) array, doubled when it fills up
+        table = numpy.empty((chunk_size, 3), dtype = numpy.float64)
+        used = 0
+        for rows in datatier.iter_batches(dbConn, _histogram_rows_sql, None, chunk_size, raise_errors = True):
+            if used + len(rows) > len(table):
+                table = numpy.resize(table, (max(2 * len(table), used + len(rows)), 3))
+            table[used:used + len(rows)] = rows
+            used += len(rows)
+        if used == 0:
+            empty = numpy.zeros((0, NUM_RATING_VALUES), dtype = numpy.int64)
+            return RatingAnalytics(numpy.zeros(0, dtype = numpy.int64), empty)
+
+        table = table[:used]
+        (ids, ratings, counts) = (table[:, 0], table[:, 1], table[:, 2].astype(numpy.int64))
+        valid = (ratings >= 0) & (ratings <= NUM_RATING_VALUES - 1) & (ratings == numpy.floor(ratings))
+        num_skipped = int(counts[~valid].sum())
+        (ids, ratings, counts) = (ids[valid].astype(numpy.int64), ratings[valid].astype(numpy.int64), counts[valid])
+
+        (movie_ids, rows_of) = numpy.unique(ids, return_inverse = True)
+        histograms = numpy.zeros((len(movie_ids), NUM_RATING_VALUES), dtype = numpy.int64)
+        numpy.add.at(histograms, (rows_of, ratings), counts)
+        return RatingAnalytics(movie_ids, histograms, num_skipped)
+    except Exception as err:
+        print("load_rating_analytics failed:", err)
+        return None
+
+
+##################################################################
+#
+# top_N_bayesian:
+#
+# Like objecttier.get_top_N_movies, but ranks the movies with at
+# least min_num_reviews reviews by their Bayesian average (see the
+# top of this file) instead of their plain average; ties are broken
+# by Movie_ID, lowest first. Pass analytics (from
+# load_rating_analytics) to rank without reading the ratings again.
+#
+# Returns: a list of objecttier.MovieRating objects (Avg_Rating is
+#          the movie's plain average), best first, or
+#          None if NumPy is not installed or an error occurs
+#          (with a message printed).
+#
+def top_N_bayesian(dbConn, N, min_num_reviews = 1, prior_weight = None, analytics = None):
+    if analytics is None:
+        analytics = load_rating_analytics(dbConn)
+        if analytics is None:
+            return None
+    try:
+        scores = analytics.bayesian_averages(prior_weight)
+        eligible = numpy.nonzero(analytics.num_reviews >= min_num_reviews)[0]
+        # best score first, then lowest Movie_ID (lexsort's last key is the primary one)
+        order = eligible[numpy.lexsort((analytics.movie_ids[eligible], -scores[eligible]))]
+
+        # ratings of movies that are not in Movies are skipped, as the
+        # JOIN in get_top_N_movies does
+        top_movies = []
+        start = 0
+        batch = max(2 * N, 100)
+        while len(top_movies) < N and start < len(order):
+            rows_of = order[start:start + batch]
+            start += batch
+            ids = [int(movie_id) for movie_id in analytics.movie_ids[rows_of]]
+            found = datatier.select_n_rows(dbConn, _movies_by_id_sql, [json.dumps(ids)])
+            if found is None:
+                return None
+            titles = {row[0]: row for row in found}
+            for (i, movie_id) in zip(rows_of, ids):
+                row = titles.get(movie_id)
+                if row is None:
+                    continue
+                top_movies.append(objecttier.MovieRating(movie_id, row[1], row[2],
+                                                         int(analytics.num_reviews[i]), float(analytics.averages[i])))
+                if len(top_movies) == N:
+                    break
+        return top_movies
+    except Exception as err:
+        print("top_N_bayesian failed:", err)
+        return None
+
+
+# the report the command line asks for; returns the exit status
+def _report(dbConn, args):
+    analytics = load_rating_analytics(dbConn)
+    if analytics is None:
+        return 1
+
+    if args.movie is not None:
+        summary = analytics.summary(args.movie)
+        if summary is None:
+            print("No reviews for that movie.")
+            return 1
+        print(json.dumps(summary, indent = 2))
+        return 0
+
+    print(f"{len(analytics.movie_ids):,} movies with reviews, {int(analytics.num_reviews.sum()):,} reviews, "
+          f"average {analytics.global_mean:.2f}")
+    top_movies = top_N_bayesian(dbConn, args.top, args.min_reviews, args.prior_weight, analytics)
+    if top_movies is None:
+        return 1
+    print()
+    for movie in top_movies:
+        print(f"{movie.Movie_ID} : {movie.Title} ({movie.Release_Year}), "
+              f"Average rating = {movie.Avg_Rating:.2f} ({movie.Num_Reviews} reviews)")
+    return 0
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rating statistics and Bayesian top-N for the whole catalog.")
+    parser.add_argument("database", help="path to the MovieLens sqlite database")
+    parser.add_argument("--top", type=int, default=10, help="movies in the Bayesian ranking (default 10)")
+    parser.add_argument("--min-reviews", type=int, default=1, help="minimum number of reviews to be ranked")
+    parser.add_argument("--prior-weight", type=float, help="reviews' worth of weight for the catalog average "
+                                                           "(default: median reviews per movie)")
+    parser.add_argument("--movie", type=int, help="print the statistics of this movie instead")
+    args = parser.parse_args()
+
+    dbConn = sqlite3.connect(args.database)
+    try:
+        sys.exit(_report(dbConn, args))
+    finally:
+        datatier.forget_connection(dbConn)
+        dbConn.close()
@@ -0,0 +1,115 @@
+#
+# bench_async.py
+# Throughput of objecttier_async as the number of concurrent
+# requests grows: the same batch of lookups is started at once with
+# asyncio.gather against AsyncObjectTier instances with 1, 2, 4, ...
+# worker threads, and compared with plain sequential objecttier calls.
+#
+# Usage:
+#   python bench_async.py                       (generates a temporary database)
+#   python bench_async.py movielens.db --requests 20000 --workers 1 2 4 8 16
+#
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import gen_moviedb
+import objecttier
+import objecttier_async
+
+
+# the calls a request makes: mostly detail lookups, some leaderboards
+def _make_requests(rand, count, low, high):
+    requests = []
+    for _ in range(count):
+        if rand.random() < 0.9:
+            requests.append(("get_movie_details", (rand.randint(low, high),)))
+        else:
+            requests.append(("get_top_N_movies", (10, rand.choice([1, 10, 100]))))
+    return requests
+
+
+##################################################################
+#
+# run_sequential:
+#
+# Makes the requests one after the other with objecttier on one
+# connection (no asyncio), as the baseline.
+#
+# Returns: requests per second.
+#
+def run_sequential(dbName, requests):
+    dbConn = sqlite3.connect(dbName)
+    start = time.perf_counter()
+    for (name, args) in requests:
+        getattr(objecttier, name)(dbConn, *args)
+    elapsed = time.perf_counter() - start
+    dbConn.close()
+    return len(requests) / elapsed
+
+
+##################################################################
+#
+# run_concurrent:
+#
+# Starts all the requests at once with asyncio.gather on an
+# AsyncObjectTier with the given number of workers.
+#
+# Returns: requests per second.
+#
+def run_concurrent(dbName, requests, workers):
+    async def main():
+        async with objecttier_async.AsyncObjectTier(dbName, max_workers = workers) as db:
+            # one request per worker first, so every read connection is open
+            await asyncio.gather(*(getattr(db, name)(*args) for (name, args) in requests[:workers]))
+            start = time.perf_counter()
+            await asyncio.gather(*(getattr(db, name)(*args) for (name, args) in requests))
+            return time.perf_counter() - start
+
+    elapsed = asyncio.run(main())
+    return len(requests) / elapsed
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure objecttier_async throughput by concurrency.")
+    parser.add_argument("database", nargs="?", help="sqlite database to use (default: a generated one)")
+    parser.add_argument("--requests", type=int, default=5000, help="requests per run (default 5000)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="worker counts to try")
+    parser.add_argument("--seed", type=int, default=341, help="random seed for the requests")
+    args = parser.parse_args()
+
+    tempdir = None
+    dbName = args.database
+    if dbName is None:
+        tempdir = tempfile.TemporaryDirectory()
+        dbName = os.path.join(tempdir.name, "bench.db")
+        dbConn = sqlite3.connect(dbName)
+        gen_moviedb.create_schema(dbConn)
+        gen_moviedb.generate(dbConn, 20000, 400000, rand = random.Random(args.seed))
+        gen_moviedb.schema.ensure_indexes(dbConn)
+        dbConn.close()
+
+    dbConn = sqlite3.connect(dbName)
+    (low, high) = dbConn.execute("SELECT MIN(Movie_ID), MAX(Movie_ID) FROM Movies").fetchone()
+    dbConn.close()
+    requests = _make_requests(random.Random(args.seed), args.requests, low or 1, high or 1)
+
+    baseline = run_sequential(dbName, requests)
+    # the workers can only run queries in parallel on as many cores as there are
+    print(f"{os.cpu_count()} CPUs, {len(requests):,} requests")
+    print(f"{'workers':>8} {'requests/s':>12} {'vs sequential':>14}")
+    print(f"{'seq':>8} {baseline:12.0f} {1.0:13.2f}x")
+    for workers in args.workers:
+        rate = run_concurrent(dbName, requests, workers)
+        print(f"{workers:8} {rate:12.0f} {rate / baseline:13.2f}x")
+
+    if tempdir is not None:
+        tempdir.cleanup()
@@ -0,0 +1,152 @@
+#
+# bench_objects.py
+# Measures construction time, attribute access time and memory per
+# instance of the objecttier record classes (Movie, MovieRating,
+# MovieDetails), comparing the original __dict__-based versions
+# with the current __slots__ versions.
+#
+# Usage:
+#   python bench_objects.py
+#   python bench_objects.py --count 500000
+#
+import argparse
+import gc
+import time
+import tracemalloc
+
+import objecttier
+
+
+##################################################################
+#
+# The original classes: the same constructors and read-only
+# properties, but every instance carries a __dict__.
+#
+class OldMovie:
+    def __init__(self, Movie_ID, Title, Release_Year):
+        self._Movie_ID = Movie_ID
+        self._Title = Title
+        self._Release_Year = Release_Year
+
+    @property
+    def Movie_ID(self):
+        return self._Movie_ID
+
+    @property
+    def Title(self):
+        return self._Title
+
+    @property
+    def Release_Year(self):
+        return self._Release_Year
+
+
+class OldMovieRating:
+    def __init__(self, Movie_ID, Title, Release_Year, Num_Reviews, Avg_Rating):
+        self._Movie_ID = Movie_ID
+        self._Title = Title
+        self._Release_Year = Release_Year
+        self._Num_Reviews = Num_Reviews
+        self._Avg_Rating = Avg_Rating
+
+    @property
+    def Movie_ID(self):
+        return self._Movie_ID
+
+    @property
+    def Avg_Rating(self):
+        return self._Avg_Rating
+
+
+class OldMovieDetails:
+    def __init__(self, Movie_ID, Title, Release_Date, Runtime, Original_Language, Budget, Revenue, Num_Reviews, Avg_Rating, Tagline, Genres, Production_Companies):
+        self._Movie_ID = Movie_ID
+        self._Title = Title
+        self._Release_Date = Release_Date
+        self._Runtime = Runtime
+        self._Original_Language = Original_Language
+        self._Budget = Budget
+        self._Revenue = Revenue
+        self._Num_Reviews = Num_Reviews
+        self._Avg_Rating = Avg_Rating
+        self._Tagline = Tagline
+        self._Genres = Genres
+        self._Production_Companies = Production_Companies
+
+    @property
+    def Movie_ID(self):
+        return self._Movie_ID
+
+    @property
+    def Avg_Rating(self):
+        return self._Avg_Rating
+
+
+# constructor arguments for each class; the values are shared by
+# every instance so only the instances themselves are measured
+_movie_args = (862, "Toy Story", "1995")
+_rating_args = (862, "Toy Story", "1995", 1234, 7.5)
+_details_args = (862, "Toy Story", "1995-10-30", 81, "en", 30000000, 373554033,
+                 1234, 7.5, "The adventure takes off!", ["Animation"], ["Pixar"])
+
+
+# (seconds to build count instances, bytes per instance)
+def _measure(cls, args, count):
+    gc.collect()
+    start = time.perf_counter()
+    objs = [cls(*args) for _ in range(count)]
+    build = time.perf_counter() - start
+    del objs
+
+    gc.collect()
+    tracemalloc.start()
+    objs = [cls(*args) for _ in range(count)]
+    (used, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # the list holding them costs one pointer per instance
+    per_instance = (used - 8 * count) / count
+    del objs
+    return (build, per_instance)
+
+
+# seconds to read Movie_ID and Avg_Rating / Title count times
+def _access(obj, count):
+    second = "Title" if isinstance(obj, (OldMovie, objecttier.Movie)) else "Avg_Rating"
+    start = time.perf_counter()
+    for _ in range(count):
+        obj.Movie_ID
+        getattr(obj, second)
+    return time.perf_counter() - start
+
+
+##################################################################
+#
+# run:
+#
+# Prints, for each class, the old and new construction time (ns per
+# instance), attribute access time (ns per two reads) and memory
+# (bytes per instance).
+#
+def run(count):
+    cases = [
+        ("Movie", OldMovie, objecttier.Movie, _movie_args),
+        ("MovieRating", OldMovieRating, objecttier.MovieRating, _rating_args),
+        ("MovieDetails", OldMovieDetails, objecttier.MovieDetails, _details_args),
+    ]
+    print(f"{'class':14} {'version':8} {'build ns':>10} {'access ns':>10} {'bytes':>8}")
+    for (name, old, new, args) in cases:
+        for (version, cls) in (("old", old), ("new", new)):
+            (build, size) = _measure(cls, args, count)
+            access = _access(cls(*args), count)
+            print(f"{name:14} {version:8} {build / count * 1e9:10.1f} {access / count * 1e9:10.1f} {size:8.0f}")
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure objecttier record class cost.")
+    parser.add_argument("--count", type=int, default=200000, help="instances per measurement")
+    args = parser.parse_args()
+    run(args.count)
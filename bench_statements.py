@@ -0,0 +1,120 @@
+#
+# bench_statements.py
+# Micro-benchmark for the per-call overhead of the data tier:
+# a fresh cursor per call (the original behaviour) versus the
+# long-lived cursors and prepared statements in datatier.py.
+#
+# Usage:
+#   python bench_statements.py                 (small in-memory database)
+#   python bench_statements.py movielens.db    (an existing database)
+#   python bench_statements.py --calls 50000
+#
+import argparse
+import random
+import sqlite3
+import time
+
+import datatier
+import objecttier
+
+
+##################################################################
+#
+# build_demo_db:
+#
+# Creates an in-memory database with the tables objecttier uses and
+# num_movies movies (with a few ratings, genres and companies each).
+#
+def build_demo_db(num_movies):
+    dbConn = sqlite3.connect(":memory:")
+    dbConn.executescript("""
+    CREATE TABLE Movies (Movie_ID INTEGER PRIMARY KEY, Title TEXT, Release_Date TEXT,
+                         Runtime INTEGER, Original_Language TEXT, Budget INTEGER, Revenue INTEGER);
+    CREATE TABLE Ratings (Movie_ID INTEGER, Rating INTEGER);
+    CREATE INDEX Ratings_Movie ON Ratings (Movie_ID);
+    CREATE TABLE Genres (Genre_ID INTEGER PRIMARY KEY, Genre_Name TEXT);
+    CREATE TABLE Movie_Genres (Movie_ID INTEGER, Genre_ID INTEGER);
+    CREATE INDEX Movie_Genres_Movie ON Movie_Genres (Movie_ID);
+    CREATE TABLE Companies (Company_ID INTEGER PRIMARY KEY, Company_Name TEXT);
+    CREATE TABLE Movie_Production_Companies (Movie_ID INTEGER, Company_ID INTEGER);
+    CREATE INDEX Movie_Companies_Movie ON Movie_Production_Companies (Movie_ID);
+    CREATE TABLE Movie_Taglines (Movie_ID INTEGER PRIMARY KEY, Tagline TEXT);
+    """)
+    rand = random.Random(341)
+    dbConn.executemany("INSERT INTO Movies VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(i, "Movie %d" % i, "2000-01-01", 100, "en", 1000, 2000) for i in range(1, num_movies + 1)])
+    dbConn.executemany("INSERT INTO Ratings VALUES (?, ?)",
+        [(rand.randint(1, num_movies), rand.randint(0, 10)) for _ in range(num_movies * 5)])
+    dbConn.executemany("INSERT INTO Genres VALUES (?, ?)", [(i, "Genre %d" % i) for i in range(1, 21)])
+    dbConn.executemany("INSERT INTO Movie_Genres VALUES (?, ?)",
+        [(i, rand.randint(1, 20)) for i in range(1, num_movies + 1)])
+    dbConn.executemany("INSERT INTO Companies VALUES (?, ?)", [(i, "Company %d" % i) for i in range(1, 51)])
+    dbConn.executemany("INSERT INTO Movie_Production_Companies VALUES (?, ?)",
+        [(i, rand.randint(1, 50)) for i in range(1, num_movies + 1)])
+    dbConn.executemany("INSERT INTO Movie_Taglines VALUES (?, ?)",
+        [(i, "Tagline %d" % i) for i in range(1, num_movies + 1, 2)])
+    dbConn.commit()
+    return dbConn
+
+
+# microseconds per call of fn(i) over calls calls
+def _time_per_call(fn, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+##################################################################
+#
+# run:
+#
+# Times each case with cursor reuse off ("before") and on ("after")
+# and prints microseconds per call. The two modes are alternated
+# for several rounds and the best round of each is reported, which
+# keeps background noise out of the comparison.
+#
+def run(dbConn, calls, rounds = 5):
+    row = datatier.select_one_row(dbConn, "SELECT MAX(Movie_ID) FROM Movies")
+    max_id = row[0] if row and row[0] else 1
+    ids = [random.randint(1, max_id) for _ in range(1024)]
+
+    lookup = datatier.prepare("bench.movie_title", "SELECT Title FROM Movies WHERE Movie_ID = ?")
+    cases = [
+        ("select_one_row (PK lookup)", lambda i: datatier.select_one_row(dbConn, lookup, [ids[i & 1023]])),
+        ("select_n_rows (genres)", lambda i: datatier.select_n_rows(dbConn,
+            "SELECT Genre_ID FROM Movie_Genres WHERE Movie_ID = ?", [ids[i & 1023]])),
+        ("objecttier.num_movies", lambda i: objecttier.num_movies(dbConn)),
+        ("objecttier.get_movie_details", lambda i: objecttier.get_movie_details(dbConn, ids[i & 1023])),
+    ]
+
+    print(f"{'case':32} {'before (us)':>12} {'after (us)':>12} {'change':>8}")
+    for (name, fn) in cases:
+        # warm up sqlite's page cache and statement cache first
+        _time_per_call(fn, min(calls, 1000))
+        before = after = float("inf")
+        for _ in range(rounds):
+            datatier.REUSE_CURSORS = False
+            before = min(before, _time_per_call(fn, calls))
+            datatier.REUSE_CURSORS = True
+            after = min(after, _time_per_call(fn, calls))
+        print(f"{name:32} {before:12.2f} {after:12.2f} {(after - before) / before:+8.1%}")
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure per-call data tier overhead.")
+    parser.add_argument("database", nargs="?", help="sqlite database to use (default: in-memory demo)")
+    parser.add_argument("--calls", type=int, default=20000, help="calls per case (default 20000)")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds per case (best is reported)")
+    parser.add_argument("--movies", type=int, default=10000, help="movies in the demo database")
+    args = parser.parse_args()
+
+    if args.database:
+        dbConn = sqlite3.connect(args.database)
+    else:
+        dbConn = build_demo_db(args.movies)
+    run(dbConn, args.calls, args.rounds)
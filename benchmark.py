@@ -0,0 +1,195 @@
+#
+# benchmark.py
+# Times every objecttier function against a database and reports
+# latency percentiles as JSON, so runs can be compared over time.
+#
+# Functions:
+# - run_benchmark(dbConn, iterations, ...): times the functions and returns the results.
+# - compare(old, new): prints the change between two result files.
+#
+# Usage:
+#   python gen_moviedb.py bench.db --movies 100000 --ratings 5000000
+#   python benchmark.py bench.db -o before.json
+#   ... change something ...
+#   python benchmark.py bench.db -o after.json
+#   python benchmark.py --compare before.json after.json
+#
+# add_review and set_tagline write to the database; pass --no-writes
+# to leave it untouched (or point the benchmark at a copy).
+# --read-only / --immutable open the database the way read replicas
+# do (see datatier.connect) and imply --no-writes.
+#
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import time
+
+import datatier
+import objecttier
+from querystats import percentiles
+
+
+# every function that can be timed, in report order
+FUNCTIONS = [
+    "num_movies",
+    "num_reviews",
+    "get_movies",
+    "get_movie_details",
+    "get_top_N_movies",
+    "add_review",
+    "set_tagline",
+]
+
+WRITE_FUNCTIONS = {"add_review", "set_tagline"}
+
+# title patterns for get_movies: a prefix, a word anywhere, and a
+# single-character wildcard, as a user would type them
+_patterns = ["star%", "%night%", "%love%", "the %", "%war_", "%blue%"]
+
+# the (N, min_num_reviews) leaderboards command 4 is asked for
+_leaderboards = [(10, 10), (50, 100), (100, 1000), (10, 1)]
+
+
+##################################################################
+#
+# run_benchmark:
+#
+# Calls each of the given objecttier functions iterations times with
+# varied arguments (random movie IDs, patterns, leaderboards) and
+# measures every call.
+#
+# Returns: a dictionary of function name -> percentiles(...).
+#
+def run_benchmark(dbConn, iterations, functions = None, seed = 341, warmup = 10):
+    rand = random.Random(seed)
+    if functions is None:
+        functions = FUNCTIONS
+
+    row = dbConn.execute("SELECT MIN(Movie_ID), MAX(Movie_ID) FROM Movies").fetchone()
+    (low, high) = (row[0] or 1, row[1] or 1)
+
+    calls = {
+        "num_movies": lambda: objecttier.num_movies(dbConn),
+        "num_reviews": lambda: objecttier.num_reviews(dbConn),
+        "get_movies": lambda: objecttier.get_movies(dbConn, rand.choice(_patterns)),
+        "get_movie_details": lambda: objecttier.get_movie_details(dbConn, rand.randint(low, high)),
+        "get_top_N_movies": lambda: objecttier.get_top_N_movies(dbConn, *rand.choice(_leaderboards)),
+        "add_review": lambda: objecttier.add_review(dbConn, rand.randint(low, high), rand.randint(0, 10)),
+        "set_tagline": lambda: objecttier.set_tagline(dbConn, rand.randint(low, high),
+                                                      "Benchmark tagline %d" % rand.randint(0, 10**6)),
+    }
+
+    results = {}
+    for name in functions:
+        call = calls[name]
+        for _ in range(warmup):
+            call()
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            call()
+            samples.append(time.perf_counter() - start)
+        results[name] = percentiles(samples)
+    return results
+
+
+##################################################################
+#
+# describe_database:
+#
+# Returns: a dictionary describing what was measured: the file,
+#          its size, row counts, and the sqlite / python versions.
+#
+def describe_database(dbConn, path):
+    counts = {}
+    for table in ("Movies", "Ratings", "Movie_Genres", "Movie_Production_Companies", "Movie_Taglines"):
+        counts[table] = dbConn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return {
+        "database": os.path.abspath(path),
+        "size_bytes": os.path.getsize(path),
+        "rows": counts,
+        "sqlite_version": sqlite3.sqlite_version,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+
+##################################################################
+#
+# compare:
+#
+# Prints, for every function in both result files, the p50 and p99
+# latencies of each run and the relative change.
+#
+def compare(old, new):
+    print(f"{'function':20} {'p50 old':>10} {'p50 new':>10} {'change':>8} {'p99 old':>10} {'p99 new':>10} {'change':>8}")
+    for name in FUNCTIONS:
+        if name not in old["results"] or name not in new["results"]:
+            continue
+        (a, b) = (old["results"][name], new["results"][name])
+        print(f"{name:20} {a['p50_ms']:10.3f} {b['p50_ms']:10.3f} {_change(a['p50_ms'], b['p50_ms']):>8} "
+              f"{a['p99_ms']:10.3f} {b['p99_ms']:10.3f} {_change(a['p99_ms'], b['p99_ms']):>8}")
+
+
+def _change(before, after):
+    if before <= 0:
+        return "n/a"
+    return f"{(after - before) / before:+.1%}"
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the objecttier functions and report percentiles.")
+    parser.add_argument("database", nargs="?", help="sqlite database to benchmark")
+    parser.add_argument("-n", "--iterations", type=int, default=200, help="timed calls per function (default 200)")
+    parser.add_argument("-f", "--functions", nargs="+", choices=FUNCTIONS, help="only time these functions")
+    parser.add_argument("--no-writes", action="store_true", help="skip add_review and set_tagline")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--read-only", action="store_true", help="open the database read-only and memory-mapped")
+    mode.add_argument("--immutable", action="store_true", help="like --read-only, without any file locking")
+    parser.add_argument("--seed", type=int, default=341, help="random seed for the arguments")
+    parser.add_argument("-o", "--output", help="write the JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as infile:
+            old = json.load(infile)
+        with open(args.compare[1]) as infile:
+            new = json.load(infile)
+        compare(old, new)
+        sys.exit(0)
+
+    if not args.database:
+        parser.error("a database is required (or --compare OLD NEW)")
+
+    functions = args.functions or FUNCTIONS
+    read_only = args.read_only or args.immutable
+    if args.no_writes or read_only:
+        functions = [name for name in functions if name not in WRITE_FUNCTIONS]
+
+    dbConn = datatier.connect(args.database, read_only = read_only, immutable = args.immutable)
+    report = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "open_mode": "immutable" if args.immutable else "read-only" if read_only else "read-write",
+        "iterations": args.iterations,
+        "seed": args.seed,
+        "environment": describe_database(dbConn, args.database),
+        "results": run_benchmark(dbConn, args.iterations, functions, args.seed),
+    }
+    dbConn.close()
+
+    text = json.dumps(report, indent = 2)
+    if args.output:
+        with open(args.output, "w") as outfile:
+            outfile.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,158 @@
+#
+# cache.py
+# A small thread-safe in-process cache with least-recently-used
+# eviction, an optional time-to-live, and hit / miss / eviction
+# counters. objecttier.py uses it to cache MovieDetails objects.
+#
+# Classes:
+# - LRUCache: the cache itself
+#
+import collections
+import threading
+import time
+
+
+# returned by get() when the key is not cached (None is a valid value)
+MISSING = object()
+
+
+##################################################################
+#
+# LRUCache class:
+# - Maps keys to values, keeping at most max_size entries:
+#    + Constructor(max_size, ttl, clock)
+#      > max_size: int, the least recently used entry is evicted
+#                  when a new one would exceed it
+#      > ttl: seconds an entry stays valid, or None for no limit
+#      > clock: function returning the current time in seconds
+#               (default time.monotonic)
+#    + get(key): the cached value, or MISSING
+#    + token(): call before loading a value, pass to put()
+#    + put(key, value, token): caches the value, unless something
+#      was invalidated since token was taken (the value loaded may
+#      already be out of date in that case)
+#    + invalidate(key), clear()
+#    + stats(): the properties below as a dictionary
+#    + Properties:
+#      > max_size: int
+#      > ttl: float or None
+#      > size: int (entries currently cached)
+#      > hits, misses, evictions, expirations, invalidations: int
+#
+class LRUCache:
+    # Constructor
+    def __init__(self, max_size = 1024, ttl = None, clock = time.monotonic):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be positive (or None)")
+        self._max_size = max_size
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = collections.OrderedDict()   # key -> (value, expires)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    #read only properties
+
+    # max_size : int
+    @property
+    def max_size(self):
+        return self._max_size
+
+    # ttl : float or None
+    @property
+    def ttl(self):
+        return self._ttl
+
+    # size : int
+    @property
+    def size(self):
+        return len(self._entries)
+
+    # hits : int
+    @property
+    def hits(self):
+        return self._hits
+
+    # misses : int
+    @property
+    def misses(self):
+        return self._misses
+
+    # evictions : int (entries dropped to make room)
+    @property
+    def evictions(self):
+        return self._evictions
+
+    # expirations : int (entries dropped because their ttl ran out)
+    @property
+    def expirations(self):
+        return self._expirations
+
+    # invalidations : int (entries dropped by invalidate / clear)
+    @property
+    def invalidations(self):
+        return self._invalidations
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return MISSING
+            (value, expires) = entry
+            if expires is not None and self._clock() >= expires:
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def token(self):
+        return self._generation
+
+    def put(self, key, value, token = None):
+        with self._lock:
+            if token is not None and token != self._generation:
+                return
+            if self._ttl is None:
+                expires = None
+            else:
+                expires = self._clock() + self._ttl
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last = False)
+                self._evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(key, None) is not None:
+                self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "ttl": self._ttl,
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "expirations": self._expirations,
+            "invalidations": self._invalidations,
+        }
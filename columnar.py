@@ -0,0 +1,506 @@
+#
+# columnar.py
+# Exports the catalog -- every movie's details, rating count and
+# average, tagline, genres and companies -- to one compact columnar
+# file, and loads such a file as a read-only, in-memory catalog that
+# the objecttier read functions can be given in place of a database
+# connection (see objecttier.MovieCatalog). A new replica can then
+# answer get_movies, get_movie_details and get_top_N_movies as soon
+# as the file is opened, without copying or warming a database.
+#
+# The file holds each column as a packed array (8-byte integers or
+# doubles, see the array module) in Movie_ID order. Strings are
+# stored once each in a dictionary (their UTF-8 bytes one after the
+# other, plus an array of offsets), and a string column is an array
+# of 4-byte dictionary codes (-1 for NULL); the genres and companies
+# of the movies are one array of codes plus an array of where each
+# movie's codes start. The ranking for get_top_N_movies is computed
+# at export time and stored as an array of row numbers.
+#
+# load_catalog maps the file into memory (mmap) and uses the arrays
+# where they lie (memoryview.cast), without reading or converting
+# them, so opening a catalog takes about as long as reading its
+# small header; pages are read from disk as queries touch them.
+# Strings are decoded when first used.
+#
+# File layout: b"MOVIECOL", a 4-byte format version and a 4-byte
+# header length, the header (JSON: counts, byte order, and for every
+# column its kind and the offset, length and type code of each of
+# its arrays), then the arrays, each starting at a multiple of 8
+# bytes.
+#
+# Classes:
+# - ColumnarCatalog: a loaded catalog (an objecttier.MovieCatalog).
+#
+# Functions:
+# - export_catalog(dbConn, filename): writes the catalog of a database to a file.
+# - load_catalog(filename): maps a catalog file into memory.
+# - like_pattern(pattern): a LIKE pattern as a regular expression.
+#
+# Usage:
+#   python columnar.py export movielens.db movielens.mcol
+#   python columnar.py info movielens.mcol
+#
+import argparse
+import array
+import bisect
+import json
+import mmap
+import re
+import struct
+import sys
+import time
+
+import datatier
+import aggregates
+import objecttier
+import snapshot
+
+
+MAGIC = b"MOVIECOL"
+VERSION = 1
+
+_prefix = struct.Struct("<8sII")
+
+
+##################################################################
+#
+# Writing
+#
+
+# a column of Python values, encoded by the kinds of values it holds
+def _encode_values(values):
+    kinds = {type(value) for value in values}
+    nulls = array.array("B", (value is None for value in values)) if type(None) in kinds else None
+    kinds.discard(type(None))
+    if kinds <= {int}:
+        return ("int", {"values": array.array("q", (value or 0 for value in values)), "nulls": nulls})
+    if kinds <= {float}:
+        return ("float", {"values": array.array("d", (value or 0.0 for value in values)), "nulls": nulls})
+    if kinds <= {int, float}:
+        # keeps integers integers: 0 and 0.0 are different answers
+        return ("number", {
+            "types": array.array("B", (0 if value is None else 1 if isinstance(value, int) else 2 for value in values)),
+            "ints": array.array("q", (value if isinstance(value, int) else 0 for value in values)),
+            "floats": array.array("d", (value if isinstance(value, float) else 0.0 for value in values)),
+        })
+    if kinds <= {str}:
+        return ("str", _encode_strings(values))
+    # anything else sqlite can hold, as JSON text
+    return ("json", _encode_strings([None if value is None else json.dumps(value) for value in values]))
+
+
+# a dictionary of the distinct strings plus one code per value
+def _encode_strings(values):
+    codes = array.array("i")
+    index = {}
+    for value in values:
+        if value is None:
+            codes.append(-1)
+            continue
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(index)
+        codes.append(code)
+    blocks = {"codes": codes}
+    blocks.update(_encode_dictionary(index))
+    return blocks
+
+
+# the strings of a value -> code dictionary, in code order
+def _encode_dictionary(index):
+    data = bytearray()
+    offsets = array.array("q", [0])
+    for value in index:
+        data += value.encode("utf-8")
+        offsets.append(len(data))
+    return {"dictionary": bytes(data), "dictionary_offsets": offsets}
+
+
+# a list of names per row, from the char(31)-separated strings of
+# the details query
+def _encode_lists(values):
+    starts = array.array("q", [0])
+    codes = array.array("i")
+    index = {}
+    for value in values:
+        for name in (value.split("\x1f") if value else ()):
+            code = index.get(name)
+            if code is None:
+                code = index[name] = len(index)
+            codes.append(code)
+        starts.append(len(codes))
+    blocks = {"starts": starts, "codes": codes}
+    blocks.update(_encode_dictionary(index))
+    return blocks
+
+
+# the details query's columns, by position
+_DETAIL_COLUMNS = ("Movie_ID", "Title", "Release_Date", "Runtime", "Original_Language",
+                   "Budget", "Revenue", "Num_Reviews", "Avg_Rating", "Tagline")
+
+
+##################################################################
+#
+# export_catalog:
+#
+# Writes the details of every movie in the database behind dbConn
+# (read with the details query, see snapshot.details_query, so the
+# values are exactly what get_movie_details returns) and the total
+# number of reviews to filename, in the format described above.
+#
+# Returns: the number of movies written, or
+#          -1 if an error occurs (with a message printed).
+#
+def export_catalog(dbConn, filename):
+    try:
+        sql = snapshot.details_query("IS NOT NULL", aggregates.has_rating_stats(dbConn)) + "ORDER BY m.Movie_ID"
+        columns = [[] for _ in range(len(_DETAIL_COLUMNS) + 2)]
+        for row in datatier.iter_rows(dbConn, sql, None, 5000, raise_errors = True):
+            for (column, value) in zip(columns, row):
+                column.append(value)
+        num_reviews = objecttier.num_reviews(dbConn)
+        if num_reviews == -1:
+            raise RuntimeError("counting the reviews failed")
+
+        ids = columns[0]
+        if any(not isinstance(movie_id, int) for movie_id in ids):
+            raise ValueError("every Movie_ID must be an integer")
+
+        encoded = {}
+        for (name, values) in zip(_DETAIL_COLUMNS, columns):
+            encoded[name] = _encode_values(values)
+        encoded["Genres"] = ("list", _encode_lists(columns[10]))
+        encoded["Companies"] = ("list", _encode_lists(columns[11]))
+
+        # the ranking of get_top_N_movies: average rating, highest first,
+        # ties by Movie_ID, lowest first; movies without reviews are not ranked
+        (reviews, averages) = (columns[7], columns[8])
+        ranked = sorted((row for row in range(len(ids)) if reviews[row] > 0),
+                        key = lambda row: (-averages[row], ids[row]))
+        encoded["Top_Order"] = ("int", {"values": array.array("q", ranked), "nulls": None})
+
+        _write(filename, encoded, {"num_movies": len(ids), "num_reviews": num_reviews})
+        return len(ids)
+    except Exception as err:
+        print("export_catalog failed:", err)
+        return -1
+
+
+# lays the header and arrays out in the file
+def _write(filename, encoded, counts):
+    header = dict(counts, byteorder = sys.byteorder, columns = {})
+    blocks = []
+    offset = 0
+    for (name, (kind, arrays)) in encoded.items():
+        entry = header["columns"][name] = {"kind": kind, "blocks": {}}
+        for (block, data) in arrays.items():
+            if data is None:
+                continue
+            typecode = data.typecode if isinstance(data, array.array) else "B"
+            raw = data.tobytes() if isinstance(data, array.array) else data
+            entry["blocks"][block] = [offset, len(raw), typecode]
+            blocks.append(raw)
+            offset += len(raw) + (-len(raw) % 8)
+
+    text = json.dumps(header).encode("utf-8")
+    text += b" " * (-(_prefix.size + len(text)) % 8)
+    with open(filename, "wb") as outfile:
+        outfile.write(_prefix.pack(MAGIC, VERSION, len(text)))
+        outfile.write(text)
+        for raw in blocks:
+            outfile.write(raw)
+            outfile.write(b"\0" * (-len(raw) % 8))
+
+
+##################################################################
+#
+# Reading
+#
+
+# the columns of a loaded file; row is a movie's position in Movie_ID order
+
+class _Numbers:
+    def __init__(self, values, nulls):
+        self._values = values
+        self._nulls = nulls
+
+    def get(self, row):
+        if self._nulls is not None and self._nulls[row]:
+            return None
+        return self._values[row]
+
+
+class _MixedNumbers:
+    def __init__(self, types, ints, floats):
+        self._types = types
+        self._ints = ints
+        self._floats = floats
+
+    def get(self, row):
+        kind = self._types[row]
+        if kind == 0:
+            return None
+        return self._ints[row] if kind == 1 else self._floats[row]
+
+
+# the strings of a dictionary, decoded the first time they are used
+class _Dictionary:
+    def __init__(self, data, offsets):
+        self._data = data
+        self._offsets = offsets
+        self._decoded = [None] * (len(offsets) - 1)
+
+    def get(self, code):
+        value = self._decoded[code]
+        if value is None:
+            value = self._decoded[code] = str(self._data[self._offsets[code]:self._offsets[code + 1]], "utf-8")
+        return value
+
+    def all(self):
+        return [self.get(code) for code in range(len(self._decoded))]
+
+
+class _Strings:
+    def __init__(self, codes, dictionary, decode = None):
+        self._codes = codes
+        self._dictionary = dictionary
+        self._decode = decode
+
+    def get(self, row):
+        code = self._codes[row]
+        if code < 0:
+            return None
+        value = self._dictionary.get(code)
+        return value if self._decode is None else self._decode(value)
+
+    # every value, in row order (None for NULL)
+    def all(self):
+        values = self._dictionary.all()
+        if self._decode is not None:
+            values = [self._decode(value) for value in values]
+        return [None if code < 0 else values[code] for code in self._codes]
+
+
+class _Lists:
+    def __init__(self, starts, codes, dictionary):
+        self._starts = starts
+        self._codes = codes
+        self._dictionary = dictionary
+
+    def get(self, row):
+        return [self._dictionary.get(code) for code in self._codes[self._starts[row]:self._starts[row + 1]]]
+
+
+##################################################################
+#
+# ColumnarCatalog class:
+# - A catalog file mapped into memory (see load_catalog). Pass it to
+#   the objecttier read functions in place of dbConn, or call their
+#   methods on it directly (see objecttier.MovieCatalog):
+#    + num_movies(), num_reviews(), get_movies(pattern),
+#      get_movie_details(movie_id), get_top_N_movies(N, min_num_reviews), ...
+#    + close(): unmaps the file
+#    + Properties:
+#      > filename: string
+#
+class ColumnarCatalog(objecttier.MovieCatalog):
+    # Constructor: use load_catalog
+    def __init__(self, filename, mapped, header, data_start):
+        self._filename = filename
+        self._mapped = mapped
+        self._views = []
+        self._num_movies = header["num_movies"]
+        self._num_reviews = header["num_reviews"]
+
+        columns = {}
+        for (name, entry) in header["columns"].items():
+            blocks = {block: self._view(data_start + offset, length, typecode)
+                      for (block, (offset, length, typecode)) in entry["blocks"].items()}
+            kind = entry["kind"]
+            if kind in ("int", "float"):
+                columns[name] = _Numbers(blocks["values"], blocks.get("nulls"))
+            elif kind == "number":
+                columns[name] = _MixedNumbers(blocks["types"], blocks["ints"], blocks["floats"])
+            elif kind in ("str", "json"):
+                dictionary = _Dictionary(blocks["dictionary"], blocks["dictionary_offsets"])
+                columns[name] = _Strings(blocks["codes"], dictionary, json.loads if kind == "json" else None)
+            elif kind == "list":
+                dictionary = _Dictionary(blocks["dictionary"], blocks["dictionary_offsets"])
+                columns[name] = _Lists(blocks["starts"], blocks["codes"], dictionary)
+            else:
+                raise ValueError("unknown column kind: %s" % kind)
+        self._columns = columns
+        # Movie_ID has no NULLs: its array is searched directly
+        self._ids = columns["Movie_ID"]._values
+        self._top_order = columns["Top_Order"]._values
+        self._titles = None
+
+    #read only properties
+
+    # filename : string
+    @property
+    def filename(self):
+        return self._filename
+
+    # an array of the file, where it lies in the mapping
+    def _view(self, start, length, typecode):
+        view = memoryview(self._mapped)[start:start + length]
+        self._views.append(view)
+        if typecode != "B":
+            view = view.cast(typecode)
+            self._views.append(view)
+        return view
+
+    def _row_of(self, movie_id):
+        movie_id = objecttier._normalize_movie_id(movie_id)
+        if not isinstance(movie_id, int):
+            return -1
+        row = bisect.bisect_left(self._ids, movie_id)
+        if row < self._num_movies and self._ids[row] == movie_id:
+            return row
+        return -1
+
+    # strftime('%Y', Release_Date), from the DATE() the file holds
+    def _release_year(self, row):
+        date = self._columns["Release_Date"].get(row)
+        return date[:4] if isinstance(date, str) else None
+
+    def num_movies(self):
+        return self._num_movies
+
+    def num_reviews(self):
+        return self._num_reviews
+
+    def get_movies(self, pattern):
+        try:
+            like = like_pattern(pattern)
+            if self._titles is None:
+                self._titles = self._columns["Title"].all()
+            return [objecttier.Movie(self._ids[row], title, self._release_year(row))
+                    for (row, title) in enumerate(self._titles)
+                    if isinstance(title, str) and like.fullmatch(title)]
+        except Exception as err:
+            print("get_movies failed:", err)
+            return []
+
+    def get_movie_details(self, movie_id):
+        row = self._row_of(movie_id)
+        if row == -1:
+            return None
+        (movie_id, title, release_date, runtime, language, budget, revenue, num_reviews, avg_rating, tagline) = (
+            self._columns[name].get(row) for name in _DETAIL_COLUMNS)
+        return objecttier.MovieDetails(
+            movie_id, title, release_date, runtime, language, budget, revenue,
+            num_reviews, avg_rating, "" if tagline is None else tagline,
+            sorted(self._columns["Genres"].get(row)), sorted(self._columns["Companies"].get(row)))
+
+    def get_top_N_movies(self, N, min_num_reviews):
+        (titles, reviews, averages) = (self._columns["Title"], self._columns["Num_Reviews"], self._columns["Avg_Rating"])
+        top_movies = []
+        for row in self._top_order:
+            if len(top_movies) >= N:
+                break
+            num_reviews = reviews.get(row)
+            if num_reviews >= min_num_reviews:
+                top_movies.append(objecttier.MovieRating(
+                    self._ids[row], titles.get(row), self._release_year(row), num_reviews, float(averages.get(row))))
+        return top_movies
+
+    def close(self):
+        self._columns = {}
+        self._ids = self._top_order = None
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mapped.close()
+
+
+##################################################################
+#
+# like_pattern:
+#
+# Translates a pattern for sqlite's LIKE (as get_movies takes it) into
+# a regular expression: % is any run of characters, _ any one
+# character, and only ASCII letters ignore case. Match titles with
+# the fullmatch method of the result. Used by the in-memory catalogs
+# (this file and memcatalog.py).
+#
+# Returns: a compiled regular expression.
+#
+def like_pattern(pattern):
+    parts = []
+    for char in str(pattern):
+        if char == "%":
+            parts.append(".*")
+        elif char == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(char))
+    return re.compile("".join(parts), re.ASCII | re.IGNORECASE | re.DOTALL)
+
+
+##################################################################
+#
+# load_catalog:
+#
+# Maps a file written by export_catalog into memory.
+#
+# Returns: a ColumnarCatalog object, or
+#          None if the file cannot be read (with a message printed).
+#
+def load_catalog(filename):
+    try:
+        with open(filename, "rb") as infile:
+            mapped = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            (magic, version, header_length) = _prefix.unpack_from(mapped, 0)
+            if magic != MAGIC:
+                raise ValueError("not a catalog file")
+            if version != VERSION:
+                raise ValueError("unsupported catalog version %d" % version)
+            header = json.loads(mapped[_prefix.size:_prefix.size + header_length])
+            if header["byteorder"] != sys.byteorder:
+                raise ValueError("the catalog was written on a %s-endian machine" % header["byteorder"])
+            return ColumnarCatalog(filename, mapped, header, _prefix.size + header_length)
+        except BaseException:
+            mapped.close()
+            raise
+    except Exception as err:
+        print("load_catalog failed:", err)
+        return None
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the catalog to a columnar file, or describe one.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write the catalog of a database to a file")
+    export.add_argument("database", help="path to the MovieLens sqlite database")
+    export.add_argument("catalog", help="file to write")
+    info = commands.add_parser("info", help="load a catalog file and print its contents")
+    info.add_argument("catalog", help="file to read")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        dbConn = datatier.connect(args.database, read_only = True)
+        start = time.perf_counter()
+        count = export_catalog(dbConn, args.catalog)
+        dbConn.close()
+        if count == -1:
+            sys.exit(1)
+        print(f"Exported {count:,} movies in {time.perf_counter() - start:.2f}s.")
+    else:
+        start = time.perf_counter()
+        catalog = load_catalog(args.catalog)
+        if catalog is None:
+            sys.exit(1)
+        loaded = time.perf_counter() - start
+        print(f"{catalog.num_movies():,} movies, {catalog.num_reviews():,} reviews, loaded in {loaded * 1000:.1f} ms")
+        for movie in catalog.get_top_N_movies(5, 1):
+            print(f"{movie.Movie_ID} : {movie.Title} ({movie.Release_Year}), "
+                  f"Average rating = {movie.Avg_Rating:.2f} ({movie.Num_Reviews} reviews)")
+        catalog.close()
@@ -0,0 +1,221 @@
+#
+# counters.py
+# Keeps the number of rows of the Movies and Ratings tables, so that
+# the object tier's num_movies / num_reviews do not have to count a
+# whole table (a walk over every row of Ratings) to print a number.
+#
+# The counts live in the Table_Row_Counts table:
+#
+#   Table_Name  TEXT PRIMARY KEY   ("Movies" or "Ratings")
+#   Row_Count   INTEGER            rows in that table
+#
+# Triggers on the counted tables keep the counts exact inside the
+# same transaction as the insert / delete that changed the table,
+# whether the write comes from objecttier or from any other program.
+#
+# Databases without the counters (e.g. opened read-only) can still
+# get a quick estimate with approximate_count, from the statistics
+# ANALYZE stores in sqlite_stat1 or, failing that, from the largest
+# rowid of the table.
+#
+# Functions:
+# - install_counters(dbConn): creates the table and triggers and fills in the counts.
+# - rebuild_counters(dbConn): counts the tables again.
+# - has_counters(dbConn): True if the counters are installed in the database.
+# - exact_count(dbConn, table): a counted table's row count, from the counters.
+# - approximate_count(dbConn, table): an estimate of any table's row count.
+#
+# Usage:
+#   python counters.py movielens.db
+#   python counters.py movielens.db --rebuild
+#
+import argparse
+import re
+import sqlite3
+import sys
+
+import datatier
+
+
+TABLE_NAME = "Table_Row_Counts"
+
+# the tables whose rows are counted
+COUNTED_TABLES = ("Movies", "Ratings")
+
+_table_name = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+_create_table = """
+CREATE TABLE IF NOT EXISTS Table_Row_Counts (
+    Table_Name  TEXT PRIMARY KEY,
+    Row_Count   INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+
+_create_insert_trigger = """
+CREATE TRIGGER IF NOT EXISTS {table}_Count_Insert
+AFTER INSERT ON {table}
+BEGIN
+    UPDATE Table_Row_Counts SET Row_Count = Row_Count + 1
+    WHERE Table_Name = '{table}';
+END
+"""
+
+_create_delete_trigger = """
+CREATE TRIGGER IF NOT EXISTS {table}_Count_Delete
+AFTER DELETE ON {table}
+BEGIN
+    UPDATE Table_Row_Counts SET Row_Count = Row_Count - 1
+    WHERE Table_Name = '{table}';
+END
+"""
+
+_store_count = """
+INSERT OR REPLACE INTO Table_Row_Counts (Table_Name, Row_Count)
+SELECT '{table}', COUNT(*) FROM {table}
+"""
+
+_count_sql = datatier.prepare("counters.count", """
+    SELECT
+        Row_Count
+    FROM
+        Table_Row_Counts
+    WHERE
+        Table_Name = ?
+""")
+
+
+##################################################################
+#
+# has_counters:
+#
+# Returns True if the Table_Row_Counts table has been installed in
+# the database behind the given connection, False if not. The
+# answer is remembered per connection, so only the first call
+# touches the database.
+#
+def has_counters(dbConn):
+    info = datatier.connection_info(dbConn)
+    if "row_counters" not in info:
+        info["row_counters"] = datatier.table_exists(dbConn, TABLE_NAME)
+    return info["row_counters"]
+
+
+##################################################################
+#
+# install_counters:
+#
+# Creates the counts table and the triggers that maintain it, then
+# counts the rows of every counted table, all in one transaction.
+# Calling it on a database that already has the counters counts
+# the rows again.
+#
+# Returns: the number of tables counted, or
+#          -1 if an error occurs (with a message printed).
+#
+def install_counters(dbConn):
+    actions = [(_create_table, None)]
+    for table in COUNTED_TABLES:
+        actions.append((_create_insert_trigger.format(table = table), None))
+        actions.append((_create_delete_trigger.format(table = table), None))
+        actions.append((_store_count.format(table = table), None))
+    if datatier.perform_actions(dbConn, actions) == -1:
+        return -1
+
+    datatier.connection_info(dbConn)["row_counters"] = True
+    return len(COUNTED_TABLES)
+
+
+##################################################################
+#
+# rebuild_counters:
+#
+# Counts the rows of every counted table again, in one transaction
+# (e.g. after rows were loaded while the triggers were missing).
+#
+# Returns: the number of tables counted, or
+#          -1 if an error occurs (with a message printed).
+#
+def rebuild_counters(dbConn):
+    if not has_counters(dbConn):
+        return install_counters(dbConn)
+
+    actions = [(_store_count.format(table = table), None) for table in COUNTED_TABLES]
+    if datatier.perform_actions(dbConn, actions) == -1:
+        return -1
+    return len(COUNTED_TABLES)
+
+
+##################################################################
+#
+# exact_count:
+#
+# Returns: the number of rows in table (one of COUNTED_TABLES) as
+#          kept by the counters, or
+#          -1 if the counters are not installed or an error occurs.
+#
+def exact_count(dbConn, table):
+    if table not in COUNTED_TABLES or not has_counters(dbConn):
+        return -1
+    row = datatier.select_one_row(dbConn, _count_sql, [table])
+    if not row:
+        return -1
+    return row[0]
+
+
+##################################################################
+#
+# approximate_count:
+#
+# Estimates the number of rows in table without reading the table:
+# the row count ANALYZE recorded in sqlite_stat1 (out of date by the
+# rows added or deleted since it last ran), or if the table was
+# never analyzed, its largest rowid (too high when rows have been
+# deleted or, as with Movie_ID, the IDs are not consecutive).
+#
+# Returns: the estimate, or
+#          -1 if an error occurs (with a message printed).
+#
+def approximate_count(dbConn, table):
+    if not _table_name.match(table):
+        print("approximate_count failed: invalid table name:", table)
+        return -1
+
+    if datatier.table_exists(dbConn, "sqlite_stat1"):
+        # every entry of a table starts with its number of rows
+        row = datatier.select_one_row(dbConn,
+            "SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = ?", [table])
+        if row is None:
+            return -1
+        if row[0] is not None:
+            return row[0]
+
+    # table names cannot be bound as parameters
+    row = datatier.select_one_row(dbConn, f"SELECT MAX(rowid) FROM {table}")
+    if row is None:
+        return -1
+    return row[0] or 0
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Install or rebuild the row counters of the Movies and Ratings tables.")
+    parser.add_argument("database", help="path to the MovieLens sqlite database")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="count the rows of an existing installation again")
+    args = parser.parse_args()
+
+    dbConn = sqlite3.connect(args.database)
+    if args.rebuild:
+        count = rebuild_counters(dbConn)
+    else:
+        count = install_counters(dbConn)
+    if count == -1:
+        dbConn.close()
+        sys.exit(1)
+    for table in COUNTED_TABLES:
+        print(f"{table}: {exact_count(dbConn, table):,} rows")
+    dbConn.close()
@@ -4,7 +4,119 @@
 #
 # Original author: Ellen Kidane and Prof. Joe Hummel
 #
+# Every function accepts either a plain sqlite3 connection or a
+# ConnectionPool (see below) as its dbConn argument. With a pool,
+# SELECTs run on a read connection borrowed for the duration of the
+# call and action queries run on the pool's single writer.
+#
+# Queries that run often can be declared once with prepare(), which
+# gives them a name (used by tools that inspect every query) and
+# keeps the exact same SQL text object, so sqlite3's per-connection
+# statement cache always finds the compiled statement. The three
+# query functions also keep one cursor per connection and thread
+# instead of creating and closing a cursor on every call.
+#
+# Functions registered with add_query_hook() are called after every
+# query with its timing and outcome (see querystats.py for the
+# statistics collector and slow-query log built on this).
+#
+# perform_action commits after every query, unless it runs inside a
+# transaction() block (the commit then happens when the outermost
+# block ends) or group commit is enabled on the connection (see
+# enable_group_commit).
+#
+import contextlib
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+import urllib.parse
+
+
+# Per-connection bookkeeping for features layered on top of a plain
+# sqlite3 connection (e.g. "has this database been migrated?").
+# sqlite3.Connection objects do not support attributes or weak
+# references, so entries are keyed by id() and keep the connection
+# alive until forget_connection() is called.
+_connection_info = {}
+
+# Statements declared with prepare(), by name.
+_statements = {}
+
+# Long-lived cursors: per thread, a dict of id(connection) ->
+# (connection, cursor). Set REUSE_CURSORS to False to go back to a
+# fresh cursor per call (e.g. to measure the difference).
+_cursors = threading.local()
+REUSE_CURSORS = True
+
+# Functions called after every query (see add_query_hook). Replaced,
+# never changed in place, so it can be read without a lock.
+_query_hooks = ()
+
+# Pragmas connect() applies to read-only connections: map up to 256 MB
+# of the file into memory (pages are read straight from the OS page
+# cache instead of being copied into sqlite's own cache), a 64 MB page
+# cache for what is not mapped, and temporary b-trees (sorts, GROUP
+# BY) in memory.
+READ_ONLY_PRAGMAS = {
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
+_pragma_name = re.compile(r"^[A-Za-z_]+$")
+
+
+##################################################################
+#
+# connect:
+#
+# Opens a connection to the database file dbName. By default this
+# is the same as sqlite3.connect(dbName). With read_only the file is
+# opened with a "mode=ro" URI: it must already exist, every write
+# fails, and READ_ONLY_PRAGMAS are applied. immutable (which implies
+# read_only) also tells sqlite that nothing will change the file
+# while it is open, so it takes no locks at all and any number of
+# processes can read it with no locking overhead -- only use it for
+# files nothing writes to, or readers will see corrupt data. pragmas
+# is a dictionary of extra (or replacement) pragma settings, e.g.
+# {"mmap_size": 0}. timeout and check_same_thread are passed on to
+# sqlite3.connect.
+#
+# Returns: the sqlite3 connection (errors are raised, as
+#          sqlite3.connect does).
+#
+def connect(dbName, read_only = False, immutable = False, pragmas = None,
+            timeout = 5.0, check_same_thread = True):
+    settings = {}
+    if read_only or immutable:
+        query = {"mode": "ro"}
+        if immutable:
+            query["immutable"] = "1"
+        uri = "file:" + urllib.parse.quote(os.path.abspath(dbName)) + "?" + urllib.parse.urlencode(query)
+        dbConn = sqlite3.connect(uri, uri = True, timeout = timeout, check_same_thread = check_same_thread)
+        settings.update(READ_ONLY_PRAGMAS)
+    else:
+        dbConn = sqlite3.connect(dbName, timeout = timeout, check_same_thread = check_same_thread)
+    if pragmas:
+        settings.update(pragmas)
+
+    try:
+        for (name, value) in settings.items():
+            # pragma values cannot be bound as parameters
+            if not _pragma_name.match(name) or not (isinstance(value, int) or _pragma_name.match(str(value))):
+                raise ValueError("invalid pragma setting: %s = %r" % (name, value))
+            dbConn.execute("PRAGMA %s = %s" % (name, value))
+        if read_only or immutable:
+            # a file that is not a database is only noticed on the first read
+            dbConn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    except BaseException:
+        dbConn.close()
+        raise
+    return dbConn
+
 
 
 ##################################################################
@@ -27,12 +139,21 @@ def select_one_row(dbConn, sql, parameters = None):
     if (parameters == None):
         parameters = []
     
-    #create the cursor
-    dbCursor = dbConn.cursor()
     #try to execute the sql and return the result
     try:
-        dbCursor.execute(sql, parameters)
-        row = dbCursor.fetchone()
+        with _reading(dbConn) as conn:
+            #borrow the connection's cursor
+            dbCursor = _borrow_cursor(conn)
+            finished = False
+            try:
+                with _measure(conn, sql, parameters) as timing:
+                    dbCursor.execute(sql, parameters)
+                    row = dbCursor.fetchone()
+                    #the cursor can only be kept once the query has run to the end
+                    finished = row is None or dbCursor.fetchone() is None
+                    timing.rows = 1 if row else 0
+            finally:
+                _return_cursor(conn, dbCursor, finished)
         if row:
             return row
         else:
@@ -40,8 +161,6 @@ def select_one_row(dbConn, sql, parameters = None):
     except Exception as err:
         print("select_one_row failed:", err)
         return None
-    finally:
-        dbCursor.close()
 
 
 
@@ -66,12 +185,18 @@ def select_n_rows(dbConn, sql, parameters = None):
     if (parameters == None):
         parameters = []
     
-    #create the cursor
-    dbCursor = dbConn.cursor()
     #try to execute the sql
     try:
-        dbCursor.execute(sql, parameters)
-        rows = dbCursor.fetchall()
+        with _reading(dbConn) as conn:
+            #borrow the connection's cursor
+            dbCursor = _borrow_cursor(conn)
+            try:
+                with _measure(conn, sql, parameters) as timing:
+                    dbCursor.execute(sql, parameters)
+                    rows = dbCursor.fetchall()
+                    timing.rows = len(rows)
+            finally:
+                _return_cursor(conn, dbCursor, True)
         if rows: 
             return rows
         else:
@@ -79,8 +204,69 @@ def select_n_rows(dbConn, sql, parameters = None):
     except Exception as err:
         print("select_n_rows failed:", err)
         return None
-    finally: 
-        dbCursor.close()
+
+
+
+##################################################################
+#
+# iter_rows:
+#
+# Given a database connection and a SQL SELECT query, returns a
+# generator that yields the rows retrieved by the query one at a
+# time, fetching them from sqlite batch_size rows at a time. Unlike
+# select_n_rows, the result is never held in memory all at once.
+# The query can be parameterized, in which case pass 
+# the values as a list via parameters; this parameter 
+# is optional.
+# With a pool, the read connection stays borrowed until the
+# generator is exhausted or closed.
+#
+# Yields: the rows retrieved by the query; if an error occurs a
+#         message is printed and the generator stops early, so
+#         the caller cannot tell a failed query from one with
+#         fewer rows. With raise_errors the error is raised to
+#         the caller instead (no message is printed).
+#
+def iter_rows(dbConn, sql, parameters = None, batch_size = 500, raise_errors = False):
+    for rows in iter_batches(dbConn, sql, parameters, batch_size, raise_errors):
+        yield from rows
+
+
+##################################################################
+#
+# iter_batches:
+#
+# Like iter_rows, but yields the rows batch by batch, each batch the
+# list that the cursor's fetchmany(batch_size) returned (e.g. to be
+# copied into an array in one step).
+#
+def iter_batches(dbConn, sql, parameters = None, batch_size = 500, raise_errors = False):
+    if (parameters == None):
+        parameters = []
+
+    try:
+        with _reading(dbConn) as conn:
+            #a cursor of its own, since other queries may run on this
+            #connection while the caller is still consuming rows
+            dbCursor = conn.cursor()
+            try:
+                #the time measured includes the time the caller spends
+                #between batches
+                with _measure(conn, sql, parameters) as timing:
+                    dbCursor.execute(sql, parameters)
+                    timing.rows = 0
+                    while True:
+                        rows = dbCursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        timing.rows += len(rows)
+                        yield rows
+            finally:
+                dbCursor.close()
+    except Exception as err:
+        if raise_errors:
+            raise
+        print("iter_rows failed:", err)
 
 
 
@@ -108,19 +294,785 @@ def perform_action(dbConn, sql, parameters = None):
     if (parameters == None):
         parameters = []
     
-    #create the cursor
-    dbCursor = dbConn.cursor()
-    
     #try to execute and if successful, commit the changes
     #and return the # of rows modified by the query
     try:
-        dbCursor.execute(sql, parameters)
-        dbConn.commit()
-        return dbCursor.rowcount
+        with _writing(dbConn) as conn:
+            #inside a transaction() block, or with group commit, the
+            #commit is left to the unit of work
+            work = _current_work(conn)
+            if work is not None:
+                _begin(conn, work)
+            #borrow the connection's cursor
+            dbCursor = _borrow_cursor(conn)
+            try:
+                with _measure(conn, sql, parameters) as timing:
+                    dbCursor.execute(sql, parameters)
+                    if work is None:
+                        conn.commit()
+                    timing.rows = dbCursor.rowcount
+                if work is not None:
+                    _wrote(dbConn, conn, work, 1)
+                return dbCursor.rowcount
+            finally:
+                #cleanup code that gets executed either way:
+                _return_cursor(conn, dbCursor, True)
     except Exception as err:
         #if it fails print an error msg and return -1
         print("perform_action failed:", err)
         return -1
-    finally:
-        #cleanup code that gets executed either way:
-        dbCursor.close()
\ No newline at end of file
+
+
+
+##################################################################
+#
+# perform_actions:
+#
+# Given a database connection and a list of (sql, parameters)
+# pairs, executes the action queries in order inside a single
+# transaction. Either every query takes effect (one commit at the
+# end) or none do (the transaction is rolled back on error).
+# parameters may be None for queries that take no values. Inside a
+# transaction() block the queries form a savepoint of that block.
+#
+# Returns: - the total number of rows modified by the queries, or
+#          - -1 if an error occurs (with a message printed).
+#
+def perform_actions(dbConn, actions):
+    try:
+        #the transaction is opened explicitly, so that schema changes (which
+        #sqlite3 does not implicitly wrap) are covered as well, and is
+        #rolled back if anything fails
+        with transaction(dbConn) as conn:
+            #create the cursor
+            dbCursor = conn.cursor()
+            try:
+                total = 0
+                for (sql, parameters) in actions:
+                    if parameters is None:
+                        parameters = []
+                    with _measure(conn, sql, parameters) as timing:
+                        dbCursor.execute(sql, parameters)
+                        timing.rows = dbCursor.rowcount
+                    if dbCursor.rowcount > 0:
+                        total += dbCursor.rowcount
+                _count_writes(conn, len(actions))
+            finally:
+                dbCursor.close()
+        return total
+    except Exception as err:
+        #print an error msg and return -1
+        print("perform_actions failed:", err)
+        return -1
+
+
+
+##################################################################
+#
+# perform_many:
+#
+# Given a database connection, a SQL action query and an iterable
+# of batches (each batch a list of parameter lists), executes the
+# query once per parameter list using executemany, batch by batch,
+# inside a single transaction that is committed once at the end.
+# The batches are consumed lazily, so they may come from a
+# generator (which may itself read from this connection) and the
+# whole input never has to be in memory. If anything fails the
+# transaction is rolled back and nothing is written. Inside a
+# transaction() block the rows form a savepoint of that block.
+#
+# Returns: - the total number of rows modified by the query, or
+#          - -1 if an error occurs (with a message printed).
+#
+def perform_many(dbConn, sql, batches):
+    try:
+        #measured as one query (without per-row parameters), commit included
+        with _measure_write(dbConn, sql) as timing:
+            with transaction(dbConn) as conn:
+                #create the cursor
+                dbCursor = conn.cursor()
+                try:
+                    total = 0
+                    for batch in batches:
+                        if not batch:
+                            continue
+                        dbCursor.executemany(sql, batch)
+                        if dbCursor.rowcount > 0:
+                            total += dbCursor.rowcount
+                    _count_writes(conn, total)
+                finally:
+                    dbCursor.close()
+            timing.rows = total
+        return total
+    except Exception as err:
+        #print an error msg and return -1
+        print("perform_many failed:", err)
+        return -1
+
+
+
+##################################################################
+#
+# transaction:
+#
+# Context manager that makes everything written through this module
+# inside the block one atomic unit:
+#
+#   with datatier.transaction(dbConn):
+#       datatier.perform_action(dbConn, ...)
+#       datatier.perform_action(dbConn, ...)
+#
+# The writes are committed when the outermost block ends, and
+# rolled back if the block raises an exception (which is then
+# re-raised). Blocks can be nested: an inner block is a savepoint,
+# so an exception leaving it undoes only its own writes. With a
+# ConnectionPool the calling thread holds the writer for the whole
+# block, and its queries inside the block see its own writes.
+# Errors that perform_action reports by returning -1 do not roll
+# anything back; raise to abandon the block. With group commit
+# enabled, the outermost block only counts as writes to be
+# committed with the next group.
+#
+# Yields: the sqlite3 connection the block writes through.
+#
+@contextlib.contextmanager
+def transaction(dbConn):
+    with _writing(dbConn) as conn:
+        info = connection_info(conn)
+        work = info.get("unit_of_work")
+        if work is None:
+            work = info["unit_of_work"] = _UnitOfWork()
+        _begin(conn, work)
+        work.depth += 1
+        savepoint = "datatier_%d" % work.depth
+        # what is left of the unit of work if the block is rolled back:
+        # the writes counted and the callbacks registered before it
+        mark = (work.writes, len(work.callbacks), len(work.rollbacks))
+        try:
+            conn.execute("SAVEPOINT " + savepoint)
+            yield conn
+        except BaseException:
+            work.depth -= 1
+            _rollback_to(conn, work, savepoint, mark)
+            raise
+        work.depth -= 1
+        conn.execute("RELEASE " + savepoint)
+        if work.depth == 0:
+            _settle(dbConn, conn, work)
+
+
+##################################################################
+#
+# on_commit:
+#
+# Calls fn() once the writes made so far are committed: right away
+# if they already are, else when the transaction() block or group
+# they belong to is committed. fn is not called if they are rolled
+# back. Exceptions raised by fn are printed and otherwise ignored.
+#
+def on_commit(dbConn, fn):
+    with _writing(dbConn) as conn:
+        work = _current_work(conn)
+        if work is not None and conn.in_transaction:
+            work.callbacks.append(fn)
+            return
+    _call(fn)
+
+
+##################################################################
+#
+# on_rollback:
+#
+# The reverse of on_commit: calls fn() if the writes made so far are
+# rolled back (by a transaction() block that raises), after the
+# rollback, e.g. to drop what was cached from data that no longer
+# exists. fn is not called if they are committed, nor if they are
+# already committed. Exceptions raised by fn are printed and
+# otherwise ignored.
+#
+def on_rollback(dbConn, fn):
+    with _writing(dbConn) as conn:
+        work = _current_work(conn)
+        if work is not None and conn.in_transaction:
+            work.rollbacks.append(fn)
+
+
+##################################################################
+#
+# enable_group_commit:
+#
+# Lets perform_action (and the other action functions) leave their
+# writes uncommitted until max_writes writes are waiting or the
+# first of them is max_delay_ms old, then commits them together:
+# one journal sync for the whole group instead of one per write.
+# Until then the writes are visible only through this connection
+# (for a pool: to threads inside a transaction() block). With a
+# ConnectionPool a timer commits a group that reaches max_delay_ms
+# without further writes; with a plain connection the age is only
+# checked on the next write, so call flush() when the writes stop.
+# Writes waiting to be committed are lost if the program crashes.
+#
+def enable_group_commit(dbConn, max_writes = 100, max_delay_ms = 50.0):
+    if max_writes < 1:
+        raise ValueError("max_writes must be at least 1")
+    with _writing(dbConn) as conn:
+        info = connection_info(conn)
+        work = info.get("unit_of_work")
+        if work is None:
+            work = info["unit_of_work"] = _UnitOfWork()
+        work.max_writes = max_writes
+        work.max_delay = max_delay_ms / 1000.0
+
+
+##################################################################
+#
+# disable_group_commit:
+#
+# Commits the writes waiting in the current group and goes back to
+# committing every write.
+#
+# Returns: the number of writes committed, or
+#          -1 if an error occurs (with a message printed).
+#
+def disable_group_commit(dbConn):
+    with _writing(dbConn) as conn:
+        committed = flush(dbConn)
+        work = _current_work(conn)
+        if work is not None:
+            work.max_writes = None
+            _cancel_timer(work)
+            if work.depth == 0:
+                connection_info(conn).pop("unit_of_work", None)
+        return committed
+
+
+##################################################################
+#
+# flush:
+#
+# Commits the writes waiting for group commit now (does nothing
+# inside a transaction() block, whose writes are committed when it
+# ends).
+#
+# Returns: the number of writes committed, or
+#          -1 if an error occurs (with a message printed).
+#
+def flush(dbConn):
+    try:
+        with _writing(dbConn) as conn:
+            work = _current_work(conn)
+            if work is None or work.depth > 0:
+                return 0
+            committed = work.writes
+            _commit(conn, work)
+            return committed
+    except Exception as err:
+        print("flush failed:", err)
+        return -1
+
+
+
+##################################################################
+#
+# table_exists:
+#
+# Given a database connection (or pool) and the name of a table, returns
+# True if the table exists in the database and False if not
+# (or if an error occurs, with a message printed).
+#
+def table_exists(dbConn, name):
+    row = select_one_row(dbConn,
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        [name])
+    return bool(row)
+
+
+
+##################################################################
+#
+# database_file:
+#
+# Given a database connection (or pool), returns the path of the
+# file behind it, for opening more connections to the same database
+# (e.g. in other processes), or None for an in-memory or temporary
+# database (or if an error occurs, with a message printed).
+#
+def database_file(dbConn):
+    row = select_one_row(dbConn,
+        "SELECT file FROM pragma_database_list WHERE name = 'main'")
+    if not row or not row[0]:
+        return None
+    return row[0]
+
+
+
+##################################################################
+#
+# connection_info:
+#
+# Returns a dictionary private to the given connection, which the
+# upper tiers use to remember per-connection facts (for example
+# whether an optional table has been installed) instead of asking
+# the database again on every call.
+#
+def connection_info(dbConn):
+    entry = _connection_info.get(id(dbConn))
+    if entry is None:
+        entry = (dbConn, {})
+        _connection_info[id(dbConn)] = entry
+    return entry[1]
+
+
+##################################################################
+#
+# forget_connection:
+#
+# Drops whatever connection_info() has recorded for the given
+# connection. Call this before closing a connection that is not
+# going to be used again.
+#
+def forget_connection(dbConn):
+    _connection_info.pop(id(dbConn), None)
+    cache = getattr(_cursors, "by_conn", None)
+    if cache:
+        entry = cache.pop(id(dbConn), None)
+        if entry is not None:
+            entry[1].close()
+
+
+
+##################################################################
+#
+# Statement class:
+# - A SQL query declared once under a name (see prepare). It is a
+#   str, so it can be passed anywhere SQL text is expected:
+#    + Properties:
+#      > name: string
+#
+class Statement(str):
+    # name : string
+    @property
+    def name(self):
+        return self._name
+
+
+##################################################################
+#
+# prepare:
+#
+# Declares a named SQL query and returns it as a Statement, which
+# can then be passed to select_one_row, select_n_rows, etc. in
+# place of the SQL text. Declare statements once (e.g. at module
+# level) and reuse them. Declaring the same name again returns the
+# existing Statement if the SQL is the same, and is an error if it
+# differs.
+#
+# Returns: the Statement for this name.
+#
+def prepare(name, sql):
+    existing = _statements.get(name)
+    if existing is not None:
+        if existing != sql:
+            raise ValueError("statement %r is already declared with different SQL" % name)
+        return existing
+    statement = Statement(sql)
+    statement._name = name
+    _statements[name] = statement
+    return statement
+
+
+##################################################################
+#
+# registered_statements:
+#
+# Returns: a list of every Statement declared with prepare(), in
+#          the order they were declared.
+#
+def registered_statements():
+    return list(_statements.values())
+
+
+# the long-lived cursor for this thread and connection
+def _borrow_cursor(conn):
+    if not REUSE_CURSORS:
+        return conn.cursor()
+    cache = getattr(_cursors, "by_conn", None)
+    if cache is None:
+        cache = _cursors.by_conn = {}
+    entry = cache.get(id(conn))
+    if entry is None:
+        entry = (conn, conn.cursor())
+        cache[id(conn)] = entry
+    return entry[1]
+
+
+# a cursor whose query stopped part way through still holds sqlite's
+# read snapshot, so it is closed (and replaced next time) instead of kept
+def _return_cursor(conn, cursor, finished):
+    if REUSE_CURSORS and finished:
+        return
+    cache = getattr(_cursors, "by_conn", None)
+    if cache:
+        entry = cache.get(id(conn))
+        if entry is not None and entry[1] is cursor:
+            del cache[id(conn)]
+    cursor.close()
+
+
+
+##################################################################
+#
+# add_query_hook:
+#
+# Registers a function to be called after every query run through
+# this module, as hook(conn, sql, parameters, seconds, rows, error):
+#   conn       - the sqlite3 connection the query ran on
+#   sql        - the SQL text (a Statement, with a name, if prepared)
+#   parameters - the parameter values (None for perform_many)
+#   seconds    - how long the query took
+#   rows       - rows returned (SELECT) or modified (action queries),
+#                or None if the query failed
+#   error      - the exception if the query failed, else None
+# Hooks run on the calling thread while it still holds the
+# connection, so they may run queries of their own on conn. An
+# exception raised by a hook is printed and otherwise ignored.
+#
+def add_query_hook(hook):
+    global _query_hooks
+    _query_hooks = _query_hooks + (hook,)
+
+
+##################################################################
+#
+# remove_query_hook:
+#
+# Unregisters a function added with add_query_hook (does nothing
+# if it is not registered).
+#
+def remove_query_hook(hook):
+    global _query_hooks
+    _query_hooks = tuple(h for h in _query_hooks if h is not hook)
+
+
+# times one query and tells the hooks about it; rows is filled in by
+# the caller once it knows the count
+class _Timing:
+    __slots__ = ("conn", "sql", "parameters", "rows", "start")
+
+    def __init__(self, conn, sql, parameters):
+        self.conn = conn
+        self.sql = sql
+        self.parameters = parameters
+        self.rows = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        rows = self.rows if exc is None else None
+        for hook in _query_hooks:
+            try:
+                hook(self.conn, self.sql, self.parameters, seconds, rows, exc)
+            except Exception as err:
+                print("query hook failed:", err)
+        return False
+
+
+# stands in for _Timing when no hooks are registered
+class _NoTiming:
+    __slots__ = ("rows",)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_no_timing = _NoTiming()
+
+
+def _measure(conn, sql, parameters):
+    if _query_hooks:
+        return _Timing(conn, sql, parameters)
+    return _no_timing
+
+
+
+##################################################################
+#
+# ConnectionPool class:
+# - Lets many threads share one database file:
+#    + Constructor(dbName, pool_size, timeout)
+#      > dbName: path of the sqlite database
+#      > pool_size: maximum number of read connections (default 4)
+#      > timeout: seconds to wait for a free read connection, and
+#                 for sqlite's own locks (default 30)
+#    + reader(): context manager that lends the calling thread a
+#      read connection; a thread that already holds one (or holds
+#      the writer) gets the same connection back
+#    + writer(): context manager that gives the calling thread
+#      exclusive use of the single write connection
+#    + close(): closes every connection
+#
+# The database is switched to WAL mode when the pool is created,
+# so readers never block the writer and the writer never blocks
+# readers. Writes are serialized through one connection because
+# sqlite only allows one writer at a time anyway; queueing them
+# here avoids "database is locked" retries between threads.
+#
+class ConnectionPool:
+    # Constructor
+    def __init__(self, dbName, pool_size = 4, timeout = 30.0):
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        self._dbName = dbName
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._num_readers = 0
+        self._all = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+        self._writer = self._open()
+        self._writer_lock = threading.RLock()
+        self._writer_owner = None
+        self._writer.execute("PRAGMA journal_mode = WAL")
+
+    # dbName : string
+    @property
+    def dbName(self):
+        return self._dbName
+
+    # pool_size : int
+    @property
+    def pool_size(self):
+        return self._pool_size
+
+    # connections are created here and handed between threads by the
+    # pool, never used by two threads at the same time
+    def _open(self):
+        conn = sqlite3.connect(self._dbName, timeout = self._timeout, check_same_thread = False)
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def _acquire_reader(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("connection pool is closed")
+            grow = self._num_readers < self._pool_size
+            if grow:
+                self._num_readers += 1
+        if grow:
+            conn = self._open()
+            conn.execute("PRAGMA query_only = ON")
+            return conn
+        try:
+            return self._idle.get(timeout = self._timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("no read connection available (pool size %d)" % self._pool_size)
+
+    @contextlib.contextmanager
+    def reader(self):
+        # a thread in the middle of a write reads through the writer so
+        # that it sees its own uncommitted changes
+        if self._writer_owner == threading.get_ident():
+            yield self._writer
+            return
+        held = getattr(self._local, "reader", None)
+        if held is not None:
+            yield held
+            return
+        conn = self._acquire_reader()
+        self._local.reader = conn
+        try:
+            yield conn
+        finally:
+            self._local.reader = None
+            self._idle.put(conn)
+
+    @contextlib.contextmanager
+    def writer(self):
+        with self._writer_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("connection pool is closed")
+            outer = self._writer_owner is None
+            self._writer_owner = threading.get_ident()
+            try:
+                yield self._writer
+            finally:
+                if outer:
+                    self._writer_owner = None
+
+    def close(self):
+        # writes waiting for group commit are committed, not lost
+        flush(self)
+        with self._lock:
+            self._closed = True
+            conns, self._all = self._all, []
+        forget_connection(self)
+        for conn in conns:
+            forget_connection(conn)
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+# the connection a SELECT should run on
+def _reading(dbConn):
+    if isinstance(dbConn, ConnectionPool):
+        return dbConn.reader()
+    return contextlib.nullcontext(dbConn)
+
+
+# the connection an action query should run on
+def _writing(dbConn):
+    if isinstance(dbConn, ConnectionPool):
+        return dbConn.writer()
+    return contextlib.nullcontext(dbConn)
+
+
+# Per-connection state of transaction() blocks and group commit,
+# kept in connection_info(conn)["unit_of_work"] of the writing
+# connection. Only the thread writing through the connection uses it.
+class _UnitOfWork:
+    __slots__ = ("depth", "writes", "since", "max_writes", "max_delay", "callbacks", "rollbacks", "timer")
+
+    def __init__(self):
+        self.depth = 0            # open transaction() blocks
+        self.writes = 0           # writes not yet committed
+        self.since = None         # when the open transaction began
+        self.max_writes = None    # group commit limits (None: off)
+        self.max_delay = None
+        self.callbacks = []       # fn to call after the commit
+        self.rollbacks = []       # fn to call after a rollback
+        self.timer = None
+
+
+# the unit of work of a writing connection, or None
+def _current_work(conn):
+    entry = _connection_info.get(id(conn))
+    if entry is None:
+        return None
+    return entry[1].get("unit_of_work")
+
+
+# opens the transaction the unit of work's writes go into
+def _begin(conn, work):
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+        work.since = time.monotonic()
+        work.writes = 0
+
+
+# records writes made directly by perform_actions / perform_many
+def _count_writes(conn, count):
+    work = _current_work(conn)
+    if work is not None:
+        work.writes += count
+
+
+# after a write outside any transaction() block: commit it, now or
+# with its group
+def _wrote(dbConn, conn, work, count):
+    work.writes += count
+    if work.depth == 0:
+        _settle(dbConn, conn, work)
+
+
+def _settle(dbConn, conn, work):
+    if work.max_writes is None:
+        _commit(conn, work)
+        # nothing is left for the unit of work to do
+        connection_info(conn).pop("unit_of_work", None)
+        return
+    if work.writes >= work.max_writes or time.monotonic() - work.since >= work.max_delay:
+        _commit(conn, work)
+    elif work.timer is None and isinstance(dbConn, ConnectionPool):
+        work.timer = threading.Timer(work.max_delay, flush, [dbConn])
+        work.timer.daemon = True
+        work.timer.start()
+
+
+def _commit(conn, work):
+    _cancel_timer(work)
+    if conn.in_transaction:
+        conn.commit()
+    work.writes = 0
+    work.since = None
+    work.rollbacks = []
+    callbacks, work.callbacks = work.callbacks, []
+    for fn in callbacks:
+        _call(fn)
+
+
+# undoes a transaction() block that raised; mark is the number of
+# writes counted and of callbacks registered when the block began
+def _rollback_to(conn, work, savepoint, mark):
+    (writes, num_callbacks, num_rollbacks) = mark
+    try:
+        conn.execute("ROLLBACK TO " + savepoint)
+        conn.execute("RELEASE " + savepoint)
+    except sqlite3.Error:
+        # sqlite already rolled back the whole transaction
+        pass
+    if work.depth == 0 and (work.max_writes is None or not conn.in_transaction):
+        # the outermost block: nothing else belongs to the transaction
+        # (with group commit, the group's earlier writes are kept)
+        if conn.in_transaction:
+            conn.rollback()
+        _cancel_timer(work)
+        if work.max_writes is None:
+            connection_info(conn).pop("unit_of_work", None)
+
+    if conn.in_transaction:
+        # only the writes made inside the block are gone, with the
+        # callbacks registered since it began (blocks before it at the
+        # same depth keep theirs)
+        work.writes = writes
+        del work.callbacks[num_callbacks:]
+        undone = work.rollbacks[num_rollbacks:]
+        del work.rollbacks[num_rollbacks:]
+    else:
+        work.writes = 0
+        work.callbacks = []
+        (undone, work.rollbacks) = (work.rollbacks, [])
+    for fn in undone:
+        _call(fn)
+
+
+def _cancel_timer(work):
+    if work.timer is not None:
+        work.timer.cancel()
+        work.timer = None
+
+
+def _call(fn):
+    try:
+        fn()
+    except Exception as err:
+        print("on_commit / on_rollback callback failed:", err)
+
+
+# times a whole perform_many (begin to commit) for the query hooks
+@contextlib.contextmanager
+def _measure_write(dbConn, sql):
+    if not _query_hooks:
+        yield _no_timing
+        return
+    with _writing(dbConn) as conn:
+        with _measure(conn, sql, None) as timing:
+            yield timing
@@ -0,0 +1,246 @@
+#
+# gen_moviedb.py
+# Generates a synthetic SQLite database with the MovieLens schema
+# that objecttier.py expects (Movies, Ratings, Genres, Movie_Genres,
+# Companies, Movie_Production_Companies, Movie_Taglines), for
+# benchmarking at sizes and skews the real data does not have.
+#
+# The number of ratings per movie follows a Zipf distribution: the
+# k-th most popular movie gets a share of the ratings proportional
+# to 1 / k^skew. Popularity is shuffled, so it is not correlated
+# with Movie_ID.
+#
+# Functions:
+# - create_schema(dbConn): creates the (empty) tables.
+# - generate(dbConn, ...): fills them with synthetic data.
+#
+# Usage:
+#   python gen_moviedb.py bench.db
+#   python gen_moviedb.py bench.db --movies 1000000 --ratings 100000000 --skew 1.1
+#
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+
+import schema
+
+
+_create_tables = """
+CREATE TABLE Movies (
+    Movie_ID           INTEGER PRIMARY KEY,
+    Title              TEXT NOT NULL,
+    Release_Date       TEXT,
+    Runtime            INTEGER,
+    Original_Language  TEXT,
+    Budget             INTEGER,
+    Revenue            INTEGER
+);
+CREATE TABLE Ratings (
+    Movie_ID  INTEGER NOT NULL,
+    Rating    INTEGER NOT NULL
+);
+CREATE TABLE Genres (
+    Genre_ID    INTEGER PRIMARY KEY,
+    Genre_Name  TEXT NOT NULL
+);
+CREATE TABLE Movie_Genres (
+    Movie_ID  INTEGER NOT NULL,
+    Genre_ID  INTEGER NOT NULL
+);
+CREATE TABLE Companies (
+    Company_ID    INTEGER PRIMARY KEY,
+    Company_Name  TEXT NOT NULL
+);
+CREATE TABLE Movie_Production_Companies (
+    Movie_ID    INTEGER NOT NULL,
+    Company_ID  INTEGER NOT NULL
+);
+CREATE TABLE Movie_Taglines (
+    Movie_ID  INTEGER PRIMARY KEY,
+    Tagline   TEXT NOT NULL
+);
+"""
+
+_genre_names = [
+    "Action", "Adventure", "Animation", "Comedy", "Crime", "Documentary",
+    "Drama", "Family", "Fantasy", "Foreign", "History", "Horror", "Music",
+    "Mystery", "Romance", "Science Fiction", "TV Movie", "Thriller", "War",
+    "Western",
+]
+
+_languages = ["en", "en", "en", "en", "fr", "es", "de", "ja", "it", "ko", "zh", "hi"]
+
+_title_words = [
+    "the", "of", "a", "and", "night", "day", "love", "star", "war", "wars",
+    "dark", "knight", "return", "story", "toy", "man", "woman", "city",
+    "last", "first", "blue", "red", "king", "queen", "ghost", "house",
+    "summer", "winter", "secret", "life", "death", "dream", "road", "river",
+    "café", "lost", "world", "time", "heart", "fire", "ice", "iron", "silver",
+    "golden", "shadow", "light", "sea", "sky", "moon", "sun",
+]
+
+_tagline_words = [
+    "every", "one", "has", "a", "secret", "the", "adventure", "takes", "off",
+    "no", "one", "is", "safe", "some", "legends", "never", "die", "this",
+    "summer", "nothing", "will", "be", "the", "same", "again",
+]
+
+
+##################################################################
+#
+# create_schema:
+#
+# Creates the tables objecttier uses, without indexes beyond the
+# primary keys (see schema.ensure_indexes for those).
+#
+def create_schema(dbConn):
+    dbConn.executescript(_create_tables)
+
+
+##################################################################
+#
+# generate:
+#
+# Fills an empty schema with num_movies movies and num_ratings
+# ratings (Zipf-distributed over the movies with exponent skew),
+# plus genres, production companies and taglines. rand is a
+# random.Random, so the same seed gives the same database. Rows are
+# inserted batch_size at a time; progress is reported through
+# report(message) if given.
+#
+def generate(dbConn, num_movies, num_ratings, skew = 1.0, num_companies = 5000,
+             tagline_fraction = 0.6, rand = None, batch_size = 100000, report = None):
+    if rand is None:
+        rand = random.Random()
+    if report is None:
+        report = lambda message: None
+
+    dbConn.executemany("INSERT INTO Genres VALUES (?, ?)",
+        list(enumerate(_genre_names, start = 1)))
+    dbConn.executemany("INSERT INTO Companies VALUES (?, ?)",
+        ((i, _company_name(rand, i)) for i in range(1, num_companies + 1)))
+
+    _insert_batched(dbConn, "INSERT INTO Movies VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (_movie_row(rand, movie_id) for movie_id in range(1, num_movies + 1)), batch_size)
+    report(f"{num_movies:,} movies")
+
+    _insert_batched(dbConn, "INSERT INTO Movie_Genres VALUES (?, ?)",
+        ((movie_id, genre_id)
+         for movie_id in range(1, num_movies + 1)
+         for genre_id in rand.sample(range(1, len(_genre_names) + 1), rand.randint(0, 3))),
+        batch_size)
+    _insert_batched(dbConn, "INSERT INTO Movie_Production_Companies VALUES (?, ?)",
+        ((movie_id, company_id)
+         for movie_id in range(1, num_movies + 1)
+         for company_id in _sample_ids(rand, num_companies, rand.randint(0, 3))),
+        batch_size)
+    _insert_batched(dbConn, "INSERT INTO Movie_Taglines VALUES (?, ?)",
+        ((movie_id, _tagline(rand))
+         for movie_id in range(1, num_movies + 1)
+         if rand.random() < tagline_fraction),
+        batch_size)
+    report("genres, companies and taglines")
+
+    # popularity rank -> movie id, and the Zipf cumulative weights by rank
+    by_rank = list(range(1, num_movies + 1))
+    rand.shuffle(by_rank)
+    cum_weights = list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, num_movies + 1)))
+    total = cum_weights[-1]
+
+    def ratings():
+        for _ in range(num_ratings):
+            rank = bisect.bisect_left(cum_weights, rand.random() * total)
+            # ratings lean towards the middle-high end, like real ones
+            yield (by_rank[min(rank, num_movies - 1)], min(10, max(0, round(rand.gauss(6.5, 2)))))
+
+    done = 0
+    for batch in _batches(ratings(), batch_size):
+        dbConn.executemany("INSERT INTO Ratings VALUES (?, ?)", batch)
+        dbConn.commit()
+        done += len(batch)
+        if done % (batch_size * 10) == 0 or done == num_ratings:
+            report(f"{done:,} / {num_ratings:,} ratings")
+
+
+def _insert_batched(dbConn, sql, rows, batch_size):
+    for batch in _batches(rows, batch_size):
+        dbConn.executemany(sql, batch)
+    dbConn.commit()
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _sample_ids(rand, n, k):
+    return {rand.randint(1, n) for _ in range(k)}
+
+
+def _movie_row(rand, movie_id):
+    words = rand.randint(1, 5)
+    title = " ".join(rand.choice(_title_words) for _ in range(words)).title()
+    year = rand.randint(1920, 2024)
+    release = f"{year}-{rand.randint(1, 12):02d}-{rand.randint(1, 28):02d}"
+    budget = rand.choice([0, 0, rand.randint(1, 300) * 1000000])
+    revenue = 0 if budget == 0 else int(budget * rand.uniform(0, 5))
+    return (movie_id, title, release, rand.randint(60, 200), rand.choice(_languages), budget, revenue)
+
+
+def _company_name(rand, company_id):
+    return rand.choice(_title_words).title() + " " + rand.choice(["Pictures", "Films", "Studios", "Entertainment"]) + f" {company_id}"
+
+
+def _tagline(rand):
+    return " ".join(rand.choice(_tagline_words) for _ in range(rand.randint(3, 9))).capitalize() + "."
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic MovieLens-shaped database.")
+    parser.add_argument("database", help="path of the database to create")
+    parser.add_argument("--movies", type=int, default=10000, help="number of movies (default 10,000)")
+    parser.add_argument("--ratings", type=int, default=500000, help="number of ratings (default 500,000)")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of ratings per movie (default 1.0)")
+    parser.add_argument("--companies", type=int, default=5000, help="number of production companies")
+    parser.add_argument("--tagline-fraction", type=float, default=0.6, help="share of movies with a tagline")
+    parser.add_argument("--seed", type=int, default=341, help="random seed (default 341)")
+    parser.add_argument("--no-indexes", action="store_true", help="do not create the supporting indexes")
+    parser.add_argument("--force", action="store_true", help="overwrite an existing file")
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        if not args.force:
+            print(f"{args.database} already exists (use --force to overwrite)")
+            sys.exit(1)
+        os.remove(args.database)
+
+    start = time.perf_counter()
+    report = lambda message: print(f"[{time.perf_counter() - start:8.1f}s] {message}")
+
+    dbConn = sqlite3.connect(args.database)
+    # a throwaway database does not need crash safety while loading
+    dbConn.execute("PRAGMA journal_mode = OFF")
+    dbConn.execute("PRAGMA synchronous = OFF")
+    create_schema(dbConn)
+    generate(dbConn, args.movies, args.ratings, skew = args.skew,
+             num_companies = args.companies, tagline_fraction = args.tagline_fraction,
+             rand = random.Random(args.seed), report = report)
+    if not args.no_indexes:
+        created = schema.ensure_indexes(dbConn)
+        report(f"indexes: {', '.join(created) if created else 'none'}")
+    dbConn.execute("PRAGMA journal_mode = DELETE")
+    dbConn.close()
+    report(f"done: {args.database}")
@@ -0,0 +1,243 @@
+#
+# leaderboard.py
+# Materialized top-N rankings ("leaderboards") that are kept up to
+# date one review at a time instead of being recomputed from the
+# Ratings table. objecttier.py uses them in get_top_N_movies.
+#
+# A leaderboard for (N, min_num_reviews) keeps the best N + headroom
+# movies with at least min_num_reviews reviews, sorted the way
+# get_top_N_movies sorts them (average rating, highest first, ties
+# by Movie_ID, lowest first). When a movie's rating changes it is
+# moved within the sorted list, enters it if it now ranks above the
+# last movie kept, or leaves it. Only when more than headroom movies
+# have dropped out, and fewer than N are left, is the ranking loaded
+# from the database again.
+#
+# The entries are objects with Movie_ID, Num_Reviews and Avg_Rating
+# properties (objecttier.MovieRating).
+#
+# Classes:
+# - Leaderboard: one ranking.
+# - LeaderboardSet: the rankings served, with a staleness limit.
+#
+import bisect
+import threading
+import time
+
+
+# the sort key of an entry: best first
+def _rank(entry):
+    return (-entry.Avg_Rating, entry.Movie_ID)
+
+
+##################################################################
+#
+# Leaderboard class:
+# - The best movies with a minimum number of reviews, kept sorted:
+#    + Constructor(N, min_num_reviews, headroom)
+#    + load(entries, now): replaces the ranking with entries, the
+#      best (up to) capacity qualifying movies (sorted into rank
+#      order here)
+#    + top(n): the best n entries, or None if the ranking must be
+#      loaded again to know them
+#    + update(entry): a movie's new Num_Reviews / Avg_Rating
+#    + clear(): forgets the ranking (top() returns None until load())
+#    + Properties:
+#      > N: int
+#      > min_num_reviews: int
+#      > capacity: int (N + headroom, the entries kept)
+#      > size: int (entries currently kept)
+#      > loaded_at: float, when load() was last called (None: never)
+#
+# The list always holds the best size qualifying movies: every
+# qualifying movie left out ranks below every movie kept. complete
+# records that no qualifying movie was left out at all.
+#
+class Leaderboard:
+    # Constructor
+    def __init__(self, N, min_num_reviews, headroom = 50):
+        if N < 1:
+            raise ValueError("N must be at least 1")
+        if headroom < 0:
+            raise ValueError("headroom must not be negative")
+        self._N = N
+        self._min_num_reviews = min_num_reviews
+        self._capacity = N + headroom
+        self._keys = []
+        self._entries = []
+        self._ids = {}   # Movie_ID -> key of the movies kept
+        self._complete = False
+        self._loaded_at = None
+
+    #read only properties
+
+    # N : int
+    @property
+    def N(self):
+        return self._N
+
+    # min_num_reviews : int
+    @property
+    def min_num_reviews(self):
+        return self._min_num_reviews
+
+    # capacity : int
+    @property
+    def capacity(self):
+        return self._capacity
+
+    # size : int
+    @property
+    def size(self):
+        return len(self._entries)
+
+    # loaded_at : float or None
+    @property
+    def loaded_at(self):
+        return self._loaded_at
+
+    def load(self, entries, now):
+        # update() relies on the order; do not trust the caller's
+        self._entries = sorted(entries, key = _rank)[:self._capacity]
+        self._keys = [_rank(entry) for entry in self._entries]
+        self._ids = {entry.Movie_ID: key for (entry, key) in zip(self._entries, self._keys)}
+        self._complete = len(entries) < self._capacity
+        self._loaded_at = now
+
+    def top(self, n):
+        if self._loaded_at is None:
+            return None
+        if len(self._entries) < n and not self._complete:
+            return None
+        return self._entries[:n]
+
+    def update(self, entry):
+        if self._loaded_at is None:
+            return
+
+        old_key = self._ids.pop(entry.Movie_ID, None)
+        if old_key is not None:
+            i = bisect.bisect_left(self._keys, old_key)
+            del self._keys[i]
+            del self._entries[i]
+
+        if entry.Num_Reviews < self._min_num_reviews:
+            return
+        key = _rank(entry)
+        # a movie ranking below the last one kept may rank below movies
+        # that were left out, so it can only be added if none were
+        if not self._complete and (not self._keys or key > self._keys[-1]):
+            return
+        i = bisect.bisect_left(self._keys, key)
+        self._keys.insert(i, key)
+        self._entries.insert(i, entry)
+        self._ids[entry.Movie_ID] = key
+        if len(self._entries) > self._capacity:
+            dropped = self._entries.pop()
+            self._keys.pop()
+            del self._ids[dropped.Movie_ID]
+            self._complete = False
+
+    def clear(self):
+        self._keys = []
+        self._entries = []
+        self._ids = {}
+        self._complete = False
+        self._loaded_at = None
+
+
+##################################################################
+#
+# LeaderboardSet class:
+# - The leaderboards served, by (N, min_num_reviews):
+#    + Constructor(boards, headroom, max_age, clock)
+#      > boards: list of (N, min_num_reviews) pairs to materialize
+#      > headroom: int, extra movies kept per board (see above)
+#      > max_age: seconds after which a board is loaded again even
+#                 if it was kept up to date (changes made by other
+#                 processes are only seen then), or None for never
+#      > clock: function returning the current time in seconds
+#               (default time.monotonic)
+#    + board_for(N, min_num_reviews): the board that can answer
+#      this ranking (same minimum, at least N movies), or None
+#    + top(N, min_num_reviews): the ranking, or None if it has to be
+#      loaded (never loaded, too many movies dropped out, too old)
+#    + token(): call before loading a ranking, pass to load()
+#    + load(N, min_num_reviews, entries, token): stores a ranking
+#      loaded from the database, unless a movie was updated since
+#      token was taken (entries may already be out of date then)
+#    + update(entry): applies a movie's new rating to every board
+#    + invalidate(): makes every board load again on its next use
+#    + stats(): hits, loads and updates, as a dictionary
+#
+class LeaderboardSet:
+    # Constructor
+    def __init__(self, boards, headroom = 50, max_age = None, clock = time.monotonic):
+        if max_age is not None and max_age < 0:
+            raise ValueError("max_age must not be negative (or None)")
+        self._boards = {}
+        for (N, min_num_reviews) in boards:
+            self._boards[(N, min_num_reviews)] = Leaderboard(N, min_num_reviews, headroom)
+        self._max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._hits = 0
+        self._loads = 0
+        self._updates = 0
+
+    def board_for(self, N, min_num_reviews):
+        best = None
+        for board in self._boards.values():
+            if board.min_num_reviews == min_num_reviews and board.N >= N:
+                if best is None or board.N < best.N:
+                    best = board
+        return best
+
+    def top(self, N, min_num_reviews):
+        board = self.board_for(N, min_num_reviews)
+        if board is None:
+            return None
+        with self._lock:
+            if (self._max_age is not None and board.loaded_at is not None
+                    and self._clock() - board.loaded_at >= self._max_age):
+                return None
+            entries = board.top(N)
+            if entries is not None:
+                self._hits += 1
+            return entries
+
+    def token(self):
+        return self._generation
+
+    def load(self, N, min_num_reviews, entries, token = None):
+        board = self.board_for(N, min_num_reviews)
+        if board is None:
+            return
+        with self._lock:
+            if token is not None and token != self._generation:
+                return
+            board.load(entries, self._clock())
+            self._loads += 1
+
+    def update(self, entry):
+        with self._lock:
+            self._generation += 1
+            self._updates += 1
+            for board in self._boards.values():
+                board.update(entry)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            for board in self._boards.values():
+                board.clear()
+
+    def stats(self):
+        return {
+            "boards": sorted(self._boards),
+            "max_age": self._max_age,
+            "hits": self._hits,
+            "loads": self._loads,
+            "updates": self._updates,
+        }
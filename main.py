@@ -17,19 +17,62 @@
 #                   the minimum number of reviews the movie needs to have
 # - command_five(): allows the user to add a new review in the database
 # - command_six(): Allows a user to set a tagline for a movie.
+# Every command reads the user's answers through its ask parameter, which is
+# input() in interactive mode and the command's arguments in batch mode.
+#
+# Batch mode runs the commands in a script file without the menu:
+#   python main.py movielens.db --batch session.txt [--workers 4]
+# Each line of the script is a command and its answers, either as shell-style
+# words (3 42, or 6 "Some tagline" 42) or as JSON ({"command": "3", "args": ["42"]}).
+# Blank lines and lines starting with # are skipped, and x ends the script.
+# The output of each command is exactly what interactive mode prints for it.
+# With --workers the commands are spread over that many processes (each with
+# its own connection); their output is still printed in script order, but a
+# command may then run before a review or tagline added earlier in the script. A
+# throughput and latency report per command goes to stderr.
+#
+# --read-only opens the database read-only, memory-mapped and with a larger
+# page cache (see datatier.connect), for replicas that only answer queries;
+# commands 5 and 6 then fail. --immutable also skips all file locking, for
+# files that nothing writes to while the app runs.
+#
+# --approximate-counts lets command 1 estimate the number of movies and reviews
+# (see counters.approximate_count) instead of counting every row, unless the
+# database has the row counters from counters.py, which are exact and just as fast.
+#
+# Query statistics (see querystats.py) are collected when the
+# environment variable MOVIEDB_QUERY_STATS is set ("text" or "json"
+# picks the dump format) or MOVIEDB_SLOW_QUERY_MS gives a slow-query
+# threshold in milliseconds. Sending the process SIGUSR1 then dumps
+# the statistics to stderr, and they are dumped again on exit.
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import shlex
+import signal
 import sqlite3
+import sys
+import time
+import datatier
 import objecttier
+import querystats
+
 
 
+# set by --approximate-counts
+APPROXIMATE_COUNTS = False
 
 ##################################################################
 # command_one:
 # Description: Gives general statistics for the database. Gives information on total number
 #              of movies and reviews in the database
 # Parameter: dbConn - allows for connection to the database
-def command_one(dbConn):
-    total_movies = objecttier.num_movies(dbConn)
-    total_reviews = objecttier.num_reviews(dbConn)
+def command_one(dbConn, ask = input):
+    total_movies = objecttier.num_movies(dbConn, APPROXIMATE_COUNTS)
+    total_reviews = objecttier.num_reviews(dbConn, APPROXIMATE_COUNTS)
 
     if total_movies == -1 or total_reviews == -1:
         print("error")
@@ -43,16 +86,20 @@ def command_one(dbConn):
 # Description: user enters a name of the movie and the program finds the results and 
 #              prints out the id, title, and release year of the movie
 # Parameter: dbConn - allows for connection to the database
-def command_two(dbConn):
+def command_two(dbConn, ask = input):
     #Get the input from the user
-    movie_input= input("Enter the name of the movie to find (wildcards _ and % allowed):")
-    movies = objecttier.get_movies(dbConn, movie_input)
+    movie_input= ask("Enter the name of the movie to find (wildcards _ and % allowed):")
+    #count the matches first, so a broad search does not load the whole catalog
+    num_found = objecttier.count_movies(dbConn, movie_input)
+    if num_found < 0:
+        num_found = 0
     print()
-    print(f"Number of movies found: {len(movies)}")
-    if len(movies) > 100:
+    print(f"Number of movies found: {num_found}")
+    if num_found > 100:
         print()
         print("There are too many movies to display (more than 100). Please narrow your search and try again.")
     else:
+        movies = objecttier.get_movies(dbConn, movie_input) if num_found > 0 else []
         print()
         for movie in movies:
             print(f"{movie.Movie_ID} : {movie.Title} ({movie.Release_Year})")
@@ -62,9 +109,9 @@ def command_two(dbConn):
 # Description: Find and output the detailed information about the movie. The user enters
 #              a movie_id and it retrieves the data
 # Parameter: dbConn - allows for connection to the database
-def command_three(dbConn):
+def command_three(dbConn, ask = input):
     #prompt to enter movie id
-    movie_id = input("Enter a movie ID: ")
+    movie_id = ask("Enter a movie ID: ")
     #get the movie details from the objecttier and retrieve the data with the users input
     movie_details = objecttier.get_movie_details(dbConn, movie_id)
     
@@ -92,16 +139,16 @@ def command_three(dbConn):
 # Description: output the top N movies based on their rating. The user enters N and
 #              the minimum number of reviews the movie needs to have
 # Parameter: dbConn - allows for connection to the database
-def command_four(dbConn):
+def command_four(dbConn, ask = input):
     # get the inputs from the user
     # - n for the number of reviews the user wants
     # - min_reviews for the minimum number of reviews per movie
-    n = int(input("Enter a value for N: "))
+    n = int(ask("Enter a value for N: "))
     # validity check
     if n <= 0:
         print("Please enter a positive value for N.")
         return
-    min_reviews = int(input("Enter a value for the minimum number of reviews: "))
+    min_reviews = int(ask("Enter a value for the minimum number of reviews: "))
     #validity check
     if min_reviews <= 0:
         print("Please enter a positive value for the minimum number of reviews.")
@@ -125,15 +172,15 @@ def command_four(dbConn):
 # command_five()
 # Description: allows the user to add a new review in the database
 # Parameter: dbConn - allows for connection in the database
-def command_five(dbConn):
+def command_five(dbConn, ask = input):
     #prompt to get rating from user
-    rating = int(input("Enter a value for the new rating (0-10): "))
+    rating = int(ask("Enter a value for the new rating (0-10): "))
     #check validity
     if not 0 <= rating <= 10:
         print("Invalid rating. Please enter a value between 0 and 10 (inclusive).")
         return
     # prompt to get the movie id
-    movie_id = input("Enter a movie ID: ")
+    movie_id = ask("Enter a movie ID: ")
 
     changedRating = objecttier.add_review(dbConn, movie_id, rating)
     if changedRating:
@@ -148,11 +195,11 @@ def command_five(dbConn):
 # command_six()
 # Description: Allows a user to set a tagline for a movie.
 # Parameter: dbConn - allows connection to the database
-def command_six(dbConn):
+def command_six(dbConn, ask = input):
     #prompt for a new tagline
-    tagline = input("Enter a tagline: ")
+    tagline = ask("Enter a tagline: ")
     #prompt for the movie id
-    movie_id = input("Enter a movie ID: ")
+    movie_id = ask("Enter a movie ID: ")
     #store the results from the objecttier
     added = objecttier.set_tagline(dbConn, movie_id, tagline)
     #if added returns any value then print this message
@@ -164,63 +211,263 @@ def command_six(dbConn):
         print("No movie matching that ID was found in the database.")
 ##################################################################
 #
-# main
+# enable_query_stats()
+# Description: turns on query statistics and the slow-query log if the
+#              environment asks for them (see the top of this file)
+# Returns: the dump format ("text" or "json"), or None if not enabled
+def enable_query_stats():
+    stats_format = os.environ.get("MOVIEDB_QUERY_STATS")
+    slow_query_ms = os.environ.get("MOVIEDB_SLOW_QUERY_MS")
+    if not stats_format and not slow_query_ms:
+        return None
+
+    try:
+        threshold = float(slow_query_ms) if slow_query_ms else None
+    except ValueError:
+        print(f"ignoring MOVIEDB_SLOW_QUERY_MS={slow_query_ms!r}: not a number", file=sys.stderr)
+        threshold = None
+    stats_format = "json" if stats_format == "json" else "text"
+    querystats.enable(threshold)
+
+    # SIGUSR1 does not exist on Windows; the handler can interrupt a
+    # query being counted, which is why QueryStats's lock is reentrant
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: querystats.dump(stats_format))
+    return stats_format
+
+
+# the menu commands by number
+COMMANDS = {
+    "1": command_one,
+    "2": command_two,
+    "3": command_three,
+    "4": command_four,
+    "5": command_five,
+    "6": command_six,
+}
+
+##################################################################
+#
+# read_script()
+# Description: reads the commands of a batch script (see the top of this file)
+# Parameter: filename - the script file
+# Returns: a list of (line number, command, list of answers)
+def read_script(filename):
+    commands = []
+    with open(filename, encoding="utf-8") as infile:
+        for (line_number, line) in enumerate(infile, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                words = [str(entry["command"])] + [str(arg) for arg in entry.get("args", [])]
+            else:
+                words = shlex.split(line)
+            if words[0] == "x":
+                break
+            commands.append((line_number, words[0], words[1:]))
+    return commands
+
+# an ask function that answers with the given arguments, echoing the
+# prompt the way input() does when stdin is not a terminal
+def _scripted(answers):
+    answers = iter(answers)
+    def ask(prompt=""):
+        sys.stdout.write(prompt)
+        try:
+            return next(answers)
+        except StopIteration:
+            raise EOFError("not enough arguments for the command") from None
+    return ask
+
+##################################################################
+#
+# run_command()
+# Description: runs one command of a batch script, capturing what it prints
+# Parameter: dbConn - allows for connection to the database
+#            command - (line number, command, list of answers)
+# Returns: (the command's output, seconds it took, error message or None)
+def run_command(dbConn, command):
+    (line_number, cmd, answers) = command
+    output = io.StringIO()
+    error = None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        try:
+            if cmd in COMMANDS:
+                COMMANDS[cmd](dbConn, _scripted(answers))
+            else:
+                print("Error, unknown command, try again...")
+        except Exception as err:
+            error = f"line {line_number}: command {cmd} failed: {err}"
+    return (output.getvalue(), time.perf_counter() - start, error)
+
+##################################################################
+#
+# open_database()
+# Description: connects to the database the way --read-only / --immutable ask for
+# Parameter: dbName - the database file
+#            open_mode - "rw" (the default), "ro" or "immutable"
+# Returns: the connection (raises sqlite3.Error if it cannot be opened)
+def open_database(dbName, open_mode="rw"):
+    if open_mode == "rw":
+        return sqlite3.connect(dbName)
+    return datatier.connect(dbName, read_only=True, immutable=(open_mode == "immutable"))
+
+# each worker process of a parallel batch has its own connection
+_worker_conn = None
+
+def _open_worker(dbName, open_mode, approximate_counts):
+    global _worker_conn, APPROXIMATE_COUNTS
+    _worker_conn = open_database(dbName, open_mode)
+    APPROXIMATE_COUNTS = approximate_counts
+
+def _run_in_worker(command):
+    return run_command(_worker_conn, command)
+
+##################################################################
+#
+# run_batch()
+# Description: runs the commands of a batch script, printing their output in
+#              script order and a per-command latency report to stderr
+# Parameter: dbName - the database file
+#            commands - as returned by read_script()
+#            workers - number of processes to spread the commands over (1: none)
+#            open_mode - how to open the database (see open_database())
+# Returns: the number of commands that failed
+def run_batch(dbName, commands, workers=1, open_mode="rw"):
+    start = time.perf_counter()
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_open_worker,
+                                                    initargs=(dbName, open_mode, APPROXIMATE_COUNTS)) as executor:
+            results = executor.map(_run_in_worker, commands, chunksize=max(1, len(commands) // (workers * 8)))
+            latencies = _print_results(commands, results)
+    else:
+        dbConn = open_database(dbName, open_mode)
+        latencies = _print_results(commands, (run_command(dbConn, command) for command in commands))
+        datatier.forget_connection(dbConn)
+        dbConn.close()
+    elapsed = time.perf_counter() - start
+
+    failures = latencies.pop(None, 0)
+    print(f"{len(commands)} commands in {elapsed:.3f}s ({len(commands) / elapsed if elapsed > 0 else 0:.1f}/s)"
+          f", {workers} worker(s), {failures} failed", file=sys.stderr)
+    print(f"{'command':>7} {'count':>7} {'per sec':>9} {'mean ms':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}",
+          file=sys.stderr)
+    for cmd in sorted(latencies):
+        stats = querystats.percentiles(latencies[cmd])
+        print(f"{cmd:>7} {stats['count']:7} {stats['calls_per_sec'] or 0:9.1f} {stats['mean_ms']:9.3f} {stats['p50_ms']:9.3f} "
+              f"{stats['p90_ms']:9.3f} {stats['p99_ms']:9.3f} {stats['max_ms']:9.3f}", file=sys.stderr)
+    return failures
+
+# prints the output of each command as it comes in (errors to stderr)
+# and returns the latencies by command, plus the number of failures under None
+def _print_results(commands, results):
+    latencies = {None: 0}
+    for (command, (output, seconds, error)) in zip(commands, results):
+        sys.stdout.write(output)
+        if error is not None:
+            sys.stdout.flush()
+            print(error, file=sys.stderr)
+            latencies[None] += 1
+        latencies.setdefault(command[1], []).append(seconds)
+    return latencies
+##################################################################
 #
-print("Project 2: Movie Database App (N-Tier)")
-print("CS 341, Spring 2025")
-print()
-print("This application allows you to analyze various")
-print("aspects of the MovieLens database.")
-print()
-# get input from user
-dbName = input("Enter the name of the database you would like to use: ")
-# connect to the database
-dbConn = sqlite3.connect(dbName)
-print()
-print("Successfully connected to the database!")
-
-#menu loop 
-while True:
+# interactive()
+# Description: the menu loop: asks for a database and runs the commands the
+#              user picks until they enter x
+# Parameter: open_mode - how to open the database (see open_database())
+def interactive(open_mode="rw"):
+    print("Project 2: Movie Database App (N-Tier)")
+    print("CS 341, Spring 2025")
+    print()
+    print("This application allows you to analyze various")
+    print("aspects of the MovieLens database.")
     print()
-    # command menu for the app
-    print("Select a menu option: ")
-    print("  1. Print general statistics about the database")
-    print("  2. Find movies matching a pattern for the name")
-    print("  3. Find details of a movie by movie ID")
-    print("  4. Top N movies by average rating, with a minimum number of reviews")
-    print("  5. Add a new review for a movie")
-    print("  6. Set the tagline of a movie")
-    print("or x to exit the program.")
-    #get the command from the user
-    cmd = input("Your choice --> ")
+    # get input from user
+    dbName = input("Enter the name of the database you would like to use: ")
+    # connect to the database
+    try:
+        dbConn = open_database(dbName, open_mode)
+    except sqlite3.Error as err:
+        print()
+        print(f"Unable to open the database: {err}")
+        return
     print()
+    print("Successfully connected to the database!")
+
+    #menu loop 
+    while True:
+        print()
+        # command menu for the app
+        print("Select a menu option: ")
+        print("  1. Print general statistics about the database")
+        print("  2. Find movies matching a pattern for the name")
+        print("  3. Find details of a movie by movie ID")
+        print("  4. Top N movies by average rating, with a minimum number of reviews")
+        print("  5. Add a new review for a movie")
+        print("  6. Set the tagline of a movie")
+        print("or x to exit the program.")
+        #get the command from the user
+        cmd = input("Your choice --> ")
+        print()
+
+        #commands 1-6
+        if cmd in COMMANDS:
+            #call command_one() ... command_six() to handle the command
+            COMMANDS[cmd](dbConn)
+        #exit
+        elif cmd == "x":
+            #exit out of the loop to end the game
+            break
+        else:
+            print("Error, unknown command, try again...")
+
+
+
+    print("Exiting program.")
+
+
+##################################################################
+#
+# main()
+# Description: interactive mode, or batch mode if a script is given
+def main():
+    parser = argparse.ArgumentParser(description="Movie Database App (N-Tier).")
+    parser.add_argument("database", nargs="?", help="database for batch mode")
+    parser.add_argument("--batch", metavar="SCRIPT", help="run the commands in SCRIPT instead of the menu")
+    parser.add_argument("--workers", type=int, default=1, help="processes to run a batch on (default 1)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--read-only", action="store_true", help="open the database read-only and memory-mapped")
+    mode.add_argument("--immutable", action="store_true", help="like --read-only, without any file locking")
+    parser.add_argument("--approximate-counts", action="store_true",
+                        help="estimate the numbers of movies and reviews in command 1")
+    args = parser.parse_args()
+    if args.batch and not args.database:
+        parser.error("--batch needs a database")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
 
-    #command one
-    if cmd == "1":
-        #call command_one() to handle the command
-        command_one(dbConn)
-    #command two
-    elif cmd == "2":
-        command_two(dbConn)
-    #command three
-    elif cmd == "3":
-        command_three(dbConn)
-    #command four
-    elif cmd == "4":
-        command_four(dbConn)
-    #command five\
-    elif cmd == "5":
-        command_five(dbConn)
-    #command six
-    elif cmd == "6":
-        command_six(dbConn)
-    #exit
-    elif cmd == "x":
-        #exit out of the loop to end the game
-        break
+    global APPROXIMATE_COUNTS
+    APPROXIMATE_COUNTS = args.approximate_counts
+    open_mode = "immutable" if args.immutable else "ro" if args.read_only else "rw"
+    stats_format = enable_query_stats()
+    failures = 0
+    if args.batch:
+        try:
+            failures = run_batch(args.database, read_script(args.batch), args.workers, open_mode)
+        except sqlite3.Error as err:
+            print(f"Unable to open the database: {err}", file=sys.stderr)
+            return 1
     else:
-        print("Error, unknown command, try again...")
+        interactive(open_mode)
 
+    if stats_format:
+        querystats.dump(stats_format)
+    return 1 if failures else 0
 
 
-print("Exiting program.")
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,387 @@
+#
+# memcatalog.py
+# Loads the catalog -- every movie with its rating count and
+# average, tagline, genres and companies -- into structures inside
+# the process, for read-only traffic that should not wait on sqlite
+# at all. A loaded MemoryCatalog is an objecttier.MovieCatalog, so
+# it is selected by passing it to the objecttier read functions in
+# place of the connection:
+#
+#   catalog = memcatalog.load_catalog(dbConn)
+#   objecttier.get_movies(catalog, "%star%")
+#   objecttier.get_movie_details(catalog, 11)
+#   objecttier.get_top_N_movies(catalog, 10, 100)
+#
+# The structures:
+# - the movies in Movie_ID order, with an array of their IDs that a
+#   movie is found in by binary search, and their MovieDetails;
+# - the titles (case-folded like sqlite's LIKE, i.e. ASCII letters
+#   only) sorted, for patterns with a literal prefix ("star%"), and
+#   an index of the 3-character substrings (trigrams) of the titles,
+#   for the other patterns: the literal parts of a pattern are
+#   broken into trigrams and only the titles that have all of them
+#   are matched against the pattern;
+# - the movies with reviews in leaderboard order (average rating,
+#   highest first, ties by Movie_ID, lowest first), and for each
+#   minimum number of reviews asked for, the positions of the movies
+#   that have enough reviews (kept for the last few minimums).
+#
+# The catalog is a copy: reviews and taglines written after it was
+# loaded are not in it until it is loaded again.
+#
+# check_parity runs the read functions on a catalog and on the
+# database it came from and reports every difference, e.g. before
+# pointing read traffic at a catalog:
+#   python memcatalog.py movielens.db --check
+#   python memcatalog.py movielens.db --check --columnar movielens.mcol
+# (tests/test_memcatalog.py runs it on a generated database).
+#
+# Classes:
+# - MemoryCatalog: a loaded catalog (an objecttier.MovieCatalog).
+#
+# Functions:
+# - load_catalog(dbConn): loads the catalog of a database into memory.
+# - check_parity(dbConn, catalog, samples): compares a catalog with its database.
+#
+# Usage:
+#   python memcatalog.py movielens.db
+#   python memcatalog.py movielens.db --check --samples 1000
+#
+import argparse
+import bisect
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import datatier
+import aggregates
+import objecttier
+import snapshot
+import columnar
+
+
+# the length of the substrings in the title index
+GRAM = 3
+
+# how many minimum-review filters of the leaderboard are kept
+_MAX_FILTERS = 16
+
+# the case folding of sqlite's LIKE: ASCII letters only
+_fold = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def _grams(text):
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+# True if the folded title matches a pattern without _, given as its
+# literal parts (the pattern split at each %): the title starts with
+# the first part, ends with the last, and has the others in between,
+# in order
+def _matches(literals, title):
+    if len(literals) == 1:
+        return title == literals[0]
+    (first, last) = (literals[0], literals[-1])
+    if not title.startswith(first):
+        return False
+    position = len(first)
+    for literal in literals[1:-1]:
+        position = title.find(literal, position)
+        if position == -1:
+            return False
+        position += len(literal)
+    return len(title) - position >= len(last) and title.endswith(last)
+
+
+##################################################################
+#
+# MemoryCatalog class:
+# - The catalog of a database, in memory (see load_catalog). Pass
+#   it to the objecttier read functions in place of dbConn, or call
+#   their methods on it directly (see objecttier.MovieCatalog):
+#    + num_movies(), num_reviews(), get_movies(pattern),
+#      get_movie_details(movie_id), get_top_N_movies(N, min_num_reviews), ...
+#    + Properties:
+#      > loaded_at: float (time.time() when it was loaded)
+#
+class MemoryCatalog(objecttier.MovieCatalog):
+    # Constructor: use load_catalog; details is a list of MovieDetails
+    # objects in Movie_ID order
+    def __init__(self, details, num_reviews):
+        self._details = details
+        self._ids = [movie.Movie_ID for movie in details]
+        self._num_reviews = num_reviews
+        self._loaded_at = time.time()
+
+        # Release_Year is strftime('%Y', Release_Date)
+        self._movies = [
+            objecttier.Movie(movie.Movie_ID, movie.Title,
+                             movie.Release_Date[:4] if isinstance(movie.Release_Date, str) else None)
+            for movie in details]
+
+        # the titles, case-folded, sorted and indexed by trigram (a
+        # NULL title matches no pattern)
+        titles = [(movie.Title.translate(_fold), row)
+                  for (row, movie) in enumerate(details) if isinstance(movie.Title, str)]
+        self._titled = [row for (_, row) in titles]
+        self._folded = [movie.Title.translate(_fold) if isinstance(movie.Title, str) else None for movie in details]
+        titles.sort()
+        self._sorted_titles = [title for (title, _) in titles]
+        self._sorted_rows = [row for (_, row) in titles]
+        index = {}
+        for (title, row) in titles:
+            for gram in _grams(title):
+                index.setdefault(gram, set()).add(row)
+        self._index = index
+
+        # the movies with reviews, in leaderboard order
+        ranked = [row for (row, movie) in enumerate(details) if movie.Num_Reviews > 0]
+        ranked.sort(key = lambda row: (-details[row].Avg_Rating, details[row].Movie_ID))
+        self._ranked = ranked
+        self._ratings = [None] * len(details)
+        for row in ranked:
+            self._ratings[row] = objecttier.MovieRating(
+                details[row].Movie_ID, details[row].Title, self._movies[row].Release_Year,
+                details[row].Num_Reviews, float(details[row].Avg_Rating))
+        self._filters = OrderedDict()
+        self._filters_lock = threading.Lock()
+
+    #read only properties
+
+    # loaded_at : float
+    @property
+    def loaded_at(self):
+        return self._loaded_at
+
+    def num_movies(self):
+        return len(self._details)
+
+    def num_reviews(self):
+        return self._num_reviews
+
+    def get_movies(self, pattern):
+        try:
+            pattern = str(pattern)
+            if pattern and pattern.strip("%") == "":
+                return [self._movies[row] for row in self._titled]
+            folded = pattern.translate(_fold)
+            rows = self._candidates(folded)
+            if "_" in pattern:
+                like = columnar.like_pattern(pattern)
+                return [self._movies[row] for row in rows if like.fullmatch(self._movies[row].Title)]
+            literals = folded.split("%")
+            if len(literals) == 3 and literals[0] == literals[2] == "":
+                # "%text%", the usual search
+                text = literals[1]
+                return [self._movies[row] for row in rows if text in self._folded[row]]
+            return [self._movies[row] for row in rows if _matches(literals, self._folded[row])]
+        except Exception as err:
+            print("get_movies failed:", err)
+            return []
+
+    # the rows (in Movie_ID order) whose titles can match the folded
+    # pattern: the titles that start with its literal prefix or that
+    # have every trigram of its literal parts, whichever are fewer
+    def _candidates(self, pattern):
+        literals = pattern.replace("_", "%").split("%")
+
+        postings = []
+        for gram in set().union(*(_grams(literal) for literal in literals)):
+            rows = self._index.get(gram)
+            if rows is None:
+                return []
+            postings.append(rows)
+
+        prefix = literals[0]
+        if prefix:
+            low = bisect.bisect_left(self._sorted_titles, prefix)
+            high = bisect.bisect_left(self._sorted_titles, prefix + "\U0010ffff", low)
+            if not postings or high - low <= min(len(rows) for rows in postings):
+                return sorted(self._sorted_rows[low:high])
+
+        if not postings:
+            return self._titled
+        postings.sort(key = len)
+        return sorted(postings[0].intersection(*postings[1:]))
+
+    def get_movie_details(self, movie_id):
+        movie_id = objecttier._normalize_movie_id(movie_id)
+        if not isinstance(movie_id, int):
+            return None
+        row = bisect.bisect_left(self._ids, movie_id)
+        if row < len(self._ids) and self._ids[row] == movie_id:
+            return self._details[row]
+        return None
+
+    def get_top_N_movies(self, N, min_num_reviews):
+        try:
+            rows = self._ranked if min_num_reviews <= 1 else self._filtered(min_num_reviews)
+            return [self._ratings[row] for row in rows[:max(N, 0)]]
+        except Exception as err:
+            print("get_top_N_movies failed:", err)
+            return []
+
+    # the leaderboard of the movies with at least min_num_reviews reviews
+    # (the catalog can be read from several threads)
+    def _filtered(self, min_num_reviews):
+        with self._filters_lock:
+            rows = self._filters.get(min_num_reviews)
+            if rows is not None:
+                self._filters.move_to_end(min_num_reviews)
+                return rows
+        rows = [row for row in self._ranked if self._details[row].Num_Reviews >= min_num_reviews]
+        with self._filters_lock:
+            self._filters[min_num_reviews] = rows
+            if len(self._filters) > _MAX_FILTERS:
+                self._filters.popitem(last = False)
+        return rows
+
+
+##################################################################
+#
+# load_catalog:
+#
+# Reads every movie of the database behind dbConn (with the details
+# query, see snapshot.details_query, so the details are exactly what
+# get_movie_details returns) and the number of reviews into memory.
+#
+# Returns: a MemoryCatalog object, or
+#          None if an error occurs (with a message printed).
+#
+def load_catalog(dbConn):
+    try:
+        sql = snapshot.details_query("IS NOT NULL", aggregates.has_rating_stats(dbConn)) + "ORDER BY m.Movie_ID"
+        details = [objecttier._movie_details_from_row(row)
+                   for row in datatier.iter_rows(dbConn, sql, None, 5000, raise_errors = True)]
+        num_reviews = objecttier.num_reviews(dbConn)
+        if num_reviews == -1:
+            raise RuntimeError("counting the reviews failed")
+        return MemoryCatalog(details, num_reviews)
+    except Exception as err:
+        print("load_catalog failed:", err)
+        return None
+
+
+##################################################################
+#
+# check_parity:
+#
+# Runs the objecttier read functions against catalog (any
+# objecttier.MovieCatalog) and against dbConn, the database it was
+# loaded from, and prints each call whose results differ: the counts,
+# a set of title patterns (plus patterns cut from samples random
+# titles), the details of samples random movies and a few IDs that
+# do not exist, and leaderboards of several sizes and minimums.
+#
+# Returns: the number of calls checked and the number that differed,
+#          as a tuple.
+#
+def check_parity(dbConn, catalog, samples = 200):
+    movies = objecttier.get_movies(dbConn, "%")
+    picked = random.sample(movies, min(samples, len(movies)))
+
+    patterns = ["%", "%%", "", "_", "%a%", "%the%", "the%", "%s", "_a%", "%_e_%", "%1%", "%é%", "%100%%"]
+    for movie in picked[:max(1, samples // 4)]:
+        title = movie.Title or ""
+        start = random.randrange(len(title) + 1)
+        cut = title[start:start + random.randint(1, 6)]
+        patterns += [cut + "%", "%" + cut + "%", "%" + cut.swapcase() + "%", "%" + cut.replace(cut[:1], "_", 1) + "%"]
+
+    ids = [movie.Movie_ID for movie in picked]
+    ids += [0, -1, 2 ** 40, "abc", None]
+    if picked:
+        ids.append(str(picked[0].Movie_ID))
+
+    checks = [("num_movies", ()), ("num_reviews", ())]
+    for pattern in patterns:
+        checks += [("get_movies", (pattern,)), ("count_movies", (pattern,)),
+                   ("get_movies_page", (pattern, 10, None))]
+    checks += [("get_movie_details", (movie_id,)) for movie_id in ids]
+    checks.append(("get_movie_details_many", (ids,)))
+    for N in (1, 10, 100):
+        for min_num_reviews in (0, 1, 2, 10, 100, 1000):
+            checks.append(("get_top_N_movies", (N, min_num_reviews)))
+
+    differences = 0
+    for (name, args) in checks:
+        function = getattr(objecttier, name)
+        expected = _comparable(function(dbConn, *args))
+        found = _comparable(function(catalog, *args))
+        if expected != found:
+            differences += 1
+            print(f"DIFFERENT: {name}{args!r}")
+            print(f"  sqlite:  {_shorten(expected)}")
+            print(f"  catalog: {_shorten(found)}")
+    return (len(checks), differences)
+
+
+# a result as plain values: the properties of the objects in it
+def _comparable(value):
+    if isinstance(value, (list, tuple)):
+        return [_comparable(item) for item in value]
+    if isinstance(value, (objecttier.Movie, objecttier.MovieRating, objecttier.MovieDetails)):
+        return {name[1:]: getattr(value, name) for name in type(value).__slots__}
+    return value
+
+
+def _shorten(value):
+    text = repr(value)
+    return text if len(text) <= 300 else text[:300] + "..."
+
+
+# the mean time of one call of fn over the given arguments, in microseconds
+def _time_calls(fn, arguments):
+    start = time.perf_counter()
+    for args in arguments:
+        fn(*args)
+    return (time.perf_counter() - start) / len(arguments) * 1e6
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load the catalog into memory, time its lookups against sqlite, or check that they agree.")
+    parser.add_argument("database", help="path to the MovieLens sqlite database")
+    parser.add_argument("--check", action="store_true", help="compare the catalog's answers with the database's")
+    parser.add_argument("--samples", type=int, default=200, help="random movies to check or time (default 200)")
+    parser.add_argument("--columnar", metavar="FILE",
+                        help="check or time a catalog file from columnar.py instead of loading one")
+    args = parser.parse_args()
+
+    dbConn = datatier.connect(args.database, read_only = True)
+    start = time.perf_counter()
+    if args.columnar:
+        catalog = columnar.load_catalog(args.columnar)
+    else:
+        catalog = load_catalog(dbConn)
+    if catalog is None:
+        sys.exit(1)
+    print(f"Loaded {catalog.num_movies():,} movies in {time.perf_counter() - start:.2f}s.")
+
+    if args.check:
+        (checked, differences) = check_parity(dbConn, catalog, args.samples)
+        print(f"{checked:,} calls checked, {differences:,} different.")
+        dbConn.close()
+        sys.exit(1 if differences else 0)
+
+    titles = [movie.Title or "" for movie in objecttier.get_movies(dbConn, "%")]
+    titles = random.sample(titles, min(args.samples, len(titles)))
+    ids = [movie.Movie_ID for movie in objecttier.get_movies(dbConn, "%")]
+    ids = [(movie_id,) for movie_id in random.sample(ids, min(args.samples, len(ids)))]
+    workloads = [
+        ("get_movie_details", objecttier.get_movie_details, ids),
+        ("get_movies prefix", objecttier.get_movies, [(title[:4] + "%",) for title in titles]),
+        ("get_movies substring", objecttier.get_movies, [("%" + title[1:5] + "%",) for title in titles]),
+        ("get_top_N_movies", objecttier.get_top_N_movies, [(10, 1), (10, 100), (100, 10)] * 10),
+    ]
+    print(f"{'lookup':<22} {'sqlite us':>10} {'catalog us':>11}")
+    for (name, fn, arguments) in workloads:
+        on_sqlite = _time_calls(lambda *a: fn(dbConn, *a), arguments)
+        on_catalog = _time_calls(lambda *a: fn(catalog, *a), arguments)
+        print(f"{name:<22} {on_sqlite:10.1f} {on_catalog:11.1f}")
+    dbConn.close()
@@ -10,18 +10,82 @@
 # - Movie : contains movie movie details 
 # - MovieRating: contains rating information on the movie
 # - MovieDetails: Contains detailed information about the movie, including genres and production companies
+# - ReviewImportResult: counts of accepted / rejected rows from a bulk review import
+# - MovieCatalog: base class of in-memory read-only catalogs the read functions can query instead
 #
 # Functions:
-# - num_movies(dbConn): Returns the number of movies in the database.
-# - num_reviews(dbConn): Returns the number of reviews in the database.
+# - num_movies(dbConn, approximate): Returns the number of movies in the database.
+# - num_reviews(dbConn, approximate): Returns the number of reviews in the database.
 # - get_movies(dbConn, pattern): Retrieves movies matching a title pattern.
+# - search_movies(dbConn, text, mode, limit): Retrieves movies by words in the title (full-text index).
+# - count_movies(dbConn, pattern): Counts the movies matching a title pattern.
+# - get_movies_page(dbConn, pattern, page_size, after): One page of get_movies plus a token for the next.
+# - iter_movies(dbConn, pattern, batch_size): Streams the movies matching a title pattern.
 # - get_movie_details(dbConn, movie_id): Retrieves detailed information for a movie.
+# - get_movie_details_many(dbConn, movie_ids): Retrieves details for many movies with one query.
 # - get_top_N_movies(dbConn, N, min_num_reviews): Retrieves the top N movies by rating.
 # - add_review(dbConn, movie_id, rating): Adds a user rating for a given movie.
+# - add_reviews(dbConn, reviews, chunk_size): Bulk-adds many ratings in one transaction.
+# - read_reviews_file(filename): Streams (movie_id, rating) pairs from a CSV or JSONL file.
 # - set_tagline(dbConn, movie_id, tagline): Updates or inserts a movie's tagline.
+# - set_taglines(dbConn, taglines): Sets many taglines in one transaction.
+# - enable_details_cache(max_size, ttl): Caches MovieDetails objects in memory.
+# - disable_details_cache(): Turns the cache off again.
+# - flush_details_cache(movie_id): Drops one movie (or every movie) from the cache.
+# - details_cache_stats(): Hit / miss / eviction counters of the cache.
+# - enable_leaderboards(boards, headroom, max_age): Keeps top-N rankings materialized in memory.
+# - disable_leaderboards(): Turns them off again.
+# - leaderboard_stats(): Hit / load / update counters of the leaderboards.
 #
 # ** !! This file relies on datatier.py to interact with the database
+#
+# If the per-movie rating aggregates from aggregates.py are installed,
+# get_movie_details and get_top_N_movies read them instead of
+# aggregating the Ratings table on every call, and get_movie_details
+# reads the details snapshot from snapshot.py, when it is installed,
+# instead of joining the tables. Likewise num_movies
+# and num_reviews read the row counters from counters.py when they
+# are installed instead of counting every row.
+#
+# The read functions also accept a MovieCatalog (one loaded from a
+# columnar export, see columnar.py, or into memory, see memcatalog.py)
+# in place of dbConn, and then answer from it without sqlite.
+#
+# The write functions join the caller's datatier.transaction() block
+# (or the connection's group commit), so several of them can be made
+# one atomic unit and committed together:
+#   with datatier.transaction(dbConn):
+#       add_review(dbConn, 123, 8)
+#       set_tagline(dbConn, 123, "...")
+import abc
+import csv
+import json
+
 import datatier
+import aggregates
+import counters
+import schema
+import search
+import snapshot
+from cache import LRUCache, MISSING
+from leaderboard import LeaderboardSet
+
+
+# Optional cache of MovieDetails objects keyed by movie ID (see
+# enable_details_cache). None when caching is off. The cache is per
+# process and assumes the process works with one database.
+_details_cache = None
+
+# Optional materialized top-N rankings (see enable_leaderboards), or
+# None. Per process, like the cache.
+_leaderboards = None
+
+# add_reviews refreshes the leaderboards movie by movie for up to this
+# many movies; a bigger import makes them load again instead
+_MAX_LEADERBOARD_UPDATES = 256
+
+# yielded by read_reviews_file for a line it cannot read as a review
+MALFORMED_REVIEW = object()
 
 ##################################################################
 #
@@ -33,7 +97,13 @@ import datatier
 #      > Title: string
 #      > Release_Year: string
 #
+# The record classes below use __slots__: no per-instance __dict__,
+# which makes them several times smaller and faster to build when a
+# query returns hundreds of thousands of them (see bench_objects.py).
+#
 class Movie:
+    __slots__ = ("_Movie_ID", "_Title", "_Release_Year")
+
     # constructor to initialize all variables in the class
     def __init__(self, Movie_ID, Title, Release_Year):
         self._Movie_ID = Movie_ID
@@ -70,6 +140,8 @@ class Movie:
 #       > Avg_Rating: float
 #
 class MovieRating:
+    __slots__ = ("_Movie_ID", "_Title", "_Release_Year", "_Num_Reviews", "_Avg_Rating")
+
     # Constructor
     def __init__(self, Movie_ID, Title, Release_Year, Num_Reviews, Avg_Rating):
         self._Movie_ID = Movie_ID
@@ -124,6 +196,10 @@ class MovieRating:
 #     > Genre : list
 #     > Production_company : list
 class MovieDetails:
+    __slots__ = ("_Movie_ID", "_Title", "_Release_Date", "_Runtime", "_Original_Language",
+                 "_Budget", "_Revenue", "_Num_Reviews", "_Avg_Rating", "_Tagline",
+                 "_Genres", "_Production_Companies")
+
     # Constructor
     def __init__(self, Movie_ID, Title, Release_Date, Runtime, Original_Language, Budget, Revenue, Num_Reviews, Avg_Rating, Tagline, Genres, Production_Companies):
         self._Movie_ID = Movie_ID
@@ -201,24 +277,145 @@ class MovieDetails:
         return self._Production_Companies
 
 
+##################################################################
+#
+# ReviewImportResult class:
+# - Outcome of a bulk review import (see add_reviews):
+#   + Constructor(...)
+#   + Properties:
+#     > Num_Accepted: int (rows inserted)
+#     > Num_Unknown_Movie: int (rows rejected, no such movie)
+#     > Num_Invalid_Rating: int (rows rejected, rating not an integer 0-10)
+#     > Num_Malformed: int (rows rejected, not a (movie_id, rating) pair)
+#     > Num_Rejected: int (sum of the three rejection counts)
+#
+class ReviewImportResult:
+    __slots__ = ("_Num_Accepted", "_Num_Unknown_Movie", "_Num_Invalid_Rating", "_Num_Malformed")
+
+    # Constructor
+    def __init__(self, Num_Accepted, Num_Unknown_Movie, Num_Invalid_Rating, Num_Malformed):
+        self._Num_Accepted = Num_Accepted
+        self._Num_Unknown_Movie = Num_Unknown_Movie
+        self._Num_Invalid_Rating = Num_Invalid_Rating
+        self._Num_Malformed = Num_Malformed
+
+    #read only property functions
+
+    # Num_Accepted : int
+    @property
+    def Num_Accepted(self):
+        return self._Num_Accepted
+
+    # Num_Unknown_Movie : int
+    @property
+    def Num_Unknown_Movie(self):
+        return self._Num_Unknown_Movie
+
+    # Num_Invalid_Rating : int
+    @property
+    def Num_Invalid_Rating(self):
+        return self._Num_Invalid_Rating
+
+    # Num_Malformed : int
+    @property
+    def Num_Malformed(self):
+        return self._Num_Malformed
+
+    # Num_Rejected : int
+    @property
+    def Num_Rejected(self):
+        return self._Num_Unknown_Movie + self._Num_Invalid_Rating + self._Num_Malformed
+
+
+##################################################################
+#
+# MovieCatalog class:
+# - Base class of read-only, in-memory copies of the catalog (see
+#   columnar.py). The read functions of this module accept one in
+#   place of a database connection and call its methods instead of
+#   querying; the write functions fail on it, as on a read-only
+#   database. A subclass implements:
+#    + num_movies(), num_reviews()
+#    + get_movies(pattern)
+#    + get_movie_details(movie_id)
+#    + get_top_N_movies(N, min_num_reviews)
+#   with the results (and the None / [] / -1 on errors) of the
+#   functions of the same name, and inherits count_movies,
+#   get_movies_page, iter_movies and get_movie_details_many, which
+#   are built on those. A subclass that misses one of the five
+#   cannot be instantiated.
+#
+class MovieCatalog(abc.ABC):
+    @abc.abstractmethod
+    def num_movies(self):
+        pass
+
+    @abc.abstractmethod
+    def num_reviews(self):
+        pass
+
+    @abc.abstractmethod
+    def get_movies(self, pattern):
+        pass
+
+    @abc.abstractmethod
+    def get_movie_details(self, movie_id):
+        pass
+
+    @abc.abstractmethod
+    def get_top_N_movies(self, N, min_num_reviews):
+        pass
+
+    def count_movies(self, pattern):
+        return len(self.get_movies(pattern))
+
+    def get_movies_page(self, pattern, page_size = 100, after = None):
+        if page_size < 1:
+            print("get_movies_page failed: page_size must be at least 1")
+            return ([], None)
+        movies = self.get_movies(pattern)
+        if after is not None:
+            movies = [movie for movie in movies if movie.Movie_ID > int(after)]
+        if len(movies) > page_size:
+            return (movies[:page_size], str(movies[page_size - 1].Movie_ID))
+        return (movies, None)
+
+    def iter_movies(self, pattern, batch_size = 500):
+        return iter(self.get_movies(pattern))
+
+    def get_movie_details_many(self, movie_ids, chunk_size = 5000):
+        return [self.get_movie_details(movie_id) for movie_id in movie_ids]
+
+
 ##################################################################
 # 
 # num_movies:
 #
+# With approximate, returns an estimate that does not read the
+# Movies table (see counters.approximate_count) when the row
+# counters are not installed.
+#
 # Returns: the number of movies in the database, or
 #          -1 if an error occurs
 # 
-def num_movies(dbConn):
+# query to count all the movies in the database
+_num_movies_sql = datatier.prepare("num_movies", """
+    SELECT 
+        COUNT(*)
+    FROM
+        Movies
+""")
+
+def num_movies(dbConn, approximate = False):
+    if isinstance(dbConn, MovieCatalog):
+        return dbConn.num_movies()
     try:
-        # query to count all the movies in the database
-        movies= """
-        SELECT 
-            COUNT(*)
-        FROM
-            Movies
-        """
+        count = _counted_rows(dbConn, "Movies", approximate)
+        if count != -1:
+            return count
+
         # execute the query and store the results
-        row = datatier.select_one_row(dbConn, movies)
+        row = datatier.select_one_row(dbConn, _num_movies_sql)
         
         if row is None:
             #if not found, then return -1
@@ -229,24 +426,43 @@ def num_movies(dbConn):
     except:
         return -1
 
+
+# the row count of table from the counters if they are installed,
+# else an estimate if approximate is set; -1 means count the rows
+def _counted_rows(dbConn, table, approximate):
+    if counters.has_counters(dbConn):
+        return counters.exact_count(dbConn, table)
+    if approximate:
+        return counters.approximate_count(dbConn, table)
+    return -1
+
 ##################################################################
 # 
 # num_reviews:
 #
+# approximate is as for num_movies.
+#
 # Returns: the number of reviews in the database, or
 #          -1 if an error occurs
 #
-def num_reviews(dbConn):
+#query to get the total number of reviews in the database
+_num_reviews_sql = datatier.prepare("num_reviews", """
+    SELECT
+        COUNT(*)
+    FROM
+        Ratings
+""")
+
+def num_reviews(dbConn, approximate = False):
+    if isinstance(dbConn, MovieCatalog):
+        return dbConn.num_reviews()
     try:
-        #query to get the total number of reviews in the database
-        reviews  = """
-        SELECT
-            COUNT(*)
-        FROM
-            Ratings
-        """
+        count = _counted_rows(dbConn, "Ratings", approximate)
+        if count != -1:
+            return count
+
         # execute the query and store the results
-        row = datatier.select_one_row(dbConn, reviews)
+        row = datatier.select_one_row(dbConn, _num_reviews_sql)
         if row is None:
             #if not found, then return -1
             return -1
@@ -270,22 +486,25 @@ def num_reviews(dbConn):
 #          (or an internal error occurred, in which case 
 #          an error message is already output).
 #
+# query that gets the basic movie details (movie_id, title, and the year of release) of a specific movie
+# ordered by movie_id in ascending order
+_get_movies_sql = datatier.prepare("get_movies", """
+    SELECT
+        Movie_ID, Title, strftime('%Y', Release_Date)
+    FROM
+        Movies
+    WHERE
+        Title LIKE ?
+    ORDER BY
+        Movie_ID ASC
+""")
+
 def get_movies(dbConn, pattern):
+    if isinstance(dbConn, MovieCatalog):
+        return dbConn.get_movies(pattern)
     try:
-        # query that gets the basic movie details (movie_id, title, and the year of release) of a specific movie
-        # ordered by movie_id in ascending order
-        movies = """
-        SELECT
-            Movie_ID, Title, strftime('%Y', Release_Date)
-        FROM
-            Movies
-        WHERE
-            Title LIKE ?
-        ORDER BY
-            Movie_ID ASC
-        """
         # execute the query and store the results
-        rows = datatier.select_n_rows(dbConn, movies, [pattern])
+        rows = datatier.select_n_rows(dbConn, _get_movies_sql, [pattern])
         # store the result as a Movie object if it exists, else: empty list
         result = [Movie(row[0], row[1], row[2]) for row in rows] if rows else []
         #return the Movie objects 
@@ -293,6 +512,195 @@ def get_movies(dbConn, pattern):
     except:
         return []
 
+##################################################################
+#
+# count_movies:
+#
+# Counts the movies whose name are "like" the pattern (same
+# patterns as get_movies), without building any Movie objects.
+#
+# Returns: the number of matching movies, or
+#          -1 if an error occurs
+#
+_count_movies_sql = datatier.prepare("count_movies", """
+    SELECT
+        COUNT(*)
+    FROM
+        Movies
+    WHERE
+        Title LIKE ?
+""")
+
+def count_movies(dbConn, pattern):
+    if isinstance(dbConn, MovieCatalog):
+        return dbConn.count_movies(pattern)
+    try:
+        # execute the query and store the results
+        row = datatier.select_one_row(dbConn, _count_movies_sql, [pattern])
+        if row is None or row == ():
+            return -1
+        return row[0]
+    except:
+        return -1
+
+
+##################################################################
+#
+# get_movies_page:
+#
+# Like get_movies, but returns at most page_size movies at a time.
+# Pass the token returned with one page as after to get the next
+# page; leave after as None for the first page. Pages are keyed on
+# the last Movie_ID seen (not an offset), so every page costs the
+# same no matter how deep into the results it is, and movies added
+# or removed meanwhile do not shift later pages.
+#
+# Returns: a (movies, token) pair: the list of movies on this page
+#          in ascending order by movie ID, and the token for the
+#          next page, or None if this is the last page
+#          (an internal error gives ([], None), in which case an
+#          error message is already output).
+#
+# the first page
+_movies_first_page_sql = datatier.prepare("get_movies_page.first", """
+    SELECT
+        Movie_ID, Title, strftime('%Y', Release_Date)
+    FROM
+        Movies
+    WHERE
+        Title LIKE ?
+    ORDER BY
+        Movie_ID ASC
+    LIMIT ?
+""")
+
+# every later page, starting after the given Movie_ID
+_movies_next_page_sql = datatier.prepare("get_movies_page.next", """
+    SELECT
+        Movie_ID, Title, strftime('%Y', Release_Date)
+    FROM
+        Movies
+    WHERE
+        Title LIKE ? AND Movie_ID > ?
+    ORDER BY
+        Movie_ID ASC
+    LIMIT ?
+""")
+
+def get_movies_page(dbConn, pattern, page_size = 100, after = None):
+    if isinstance(dbConn, MovieCatalog):
+        return dbConn.get_movies_page(pattern, page_size, after)
+    try:
+        if page_size < 1:
+            raise ValueError("page_size must be at least 1")
+        # ask for one movie more than the page holds to find out if there is a next page
+        if after is None:
+            rows = datatier.select_n_rows(dbConn, _movies_first_page_sql, [pattern, page_size + 1])
+        else:
+            rows = datatier.select_n_rows(dbConn, _movies_next_page_sql, [pattern, int(after), page_size + 1])
+        if not rows:
+            return ([], None)
+
+        movies = [Movie(row[0], row[1], row[2]) for row in rows[:page_size]]
+        if len(rows) > page_size:
+            return (movies, str(movies[-1].Movie_ID))
+        return (movies, None)
+    except Exception as err:
+        print("get_movies_page failed:", err)
+        return ([], None)
+
+
+##################################################################
+#
+# iter_movies:
+#
+# Generator version of get_movies: yields the movies whose name
+# are "like" the pattern one at a time, in ascending order by movie
+# ID, reading them from the database batch_size rows at a time, so
+# even a "%" search over the whole catalog uses little memory.
+#
+def iter_movies(dbConn, pattern, batch_size = 500):
+    if isinstance(dbConn, MovieCatalog):
+        yield from dbConn.iter_movies(pattern, batch_size)
+        return
+    for row in datatier.iter_rows(dbConn, _get_movies_sql, [pattern], batch_size):
+        yield Movie(row[0], row[1], row[2])
+
+
+##################################################################
+#
+# search_movies:
+#
+# Finds and returns the movies whose titles contain the words in
+# text, using the full-text title index from search.py. mode is
+#   "token"  - every word must appear as a whole word (the default)
+#   "prefix" - every word must begin a word of the title, so
+#              "star wa" finds "Star Wars"
+#   "ranked" - titles containing any of the words (as prefixes),
+#              best matches first
+#   "like"   - no index: the original LIKE search for titles
+#              containing text, with the _ and % wildcards
+# Case and accents are ignored. If the title index is not installed
+# in the database, every mode falls back to "like". At most limit
+# movies are returned if limit is given.
+#
+# Returns: list of movies in ascending order by movie ID ("ranked":
+#          by relevance), or an empty list, which means that the
+#          query did not retrieve any data
+#          (or an internal error occurred, in which case 
+#          an error message is already output).
+#
+# movies whose titles match the FTS5 expression, in movie ID order (the
+# index's rowid is the Movie_ID, and FTS5 returns rowids in order without a sort)
+_search_movies_sql = datatier.prepare("search_movies", """
+    SELECT
+        m.Movie_ID, m.Title, strftime('%Y', m.Release_Date)
+    FROM
+        Movies_Title_FTS f
+    JOIN Movies m ON m.Movie_ID = f.rowid
+    WHERE
+        Movies_Title_FTS MATCH ?
+    ORDER BY
+        f.rowid ASC
+    LIMIT ?
+""")
+
+# the same, best matches (lowest bm25 rank) first
+_search_movies_ranked_sql = datatier.prepare("search_movies.ranked", """
+    SELECT
+        m.Movie_ID, m.Title, strftime('%Y', m.Release_Date)
+    FROM
+        Movies_Title_FTS f
+    JOIN Movies m ON m.Movie_ID = f.rowid
+    WHERE
+        Movies_Title_FTS MATCH ?
+    ORDER BY
+        f.rank, m.Movie_ID ASC
+    LIMIT ?
+""")
+
+def search_movies(dbConn, text, mode = "token", limit = None):
+    try:
+        if mode == "like" or not search.has_title_index(dbConn):
+            movies = get_movies(dbConn, "%" + text + "%")
+            return movies if limit is None else movies[:limit]
+
+        expression = search.match_expression(text, mode)
+        if not expression:
+            return []
+        if mode == "ranked":
+            sql = _search_movies_ranked_sql
+        else:
+            sql = _search_movies_sql
+
+        # execute the query and store the results
+        rows = datatier.select_n_rows(dbConn, sql, [expression, -1 if limit is None else limit])
+        # store the result as a Movie object if it exists, else: empty list
+        return [Movie(row[0], row[1], row[2]) for row in rows] if rows else []
+    except Exception as err:
+        print("search_movies failed:", err)
+        return []
+
 ##################################################################
 #
 # get_movie_details:
@@ -308,89 +716,169 @@ def get_movies(dbConn, pattern):
 #          (or an internal error occurred, in which case 
 #          an error message is already output).
 #
+# The details are read with one query that joins everything about the
+# selected movies (see snapshot.details_query). If the denormalized
+# snapshot from snapshot.py is installed, a movie whose snapshot is up
+# to date is read from it instead, by primary key.
+
+# one movie: ?1 is the movie id
+_movie_details_sql = datatier.prepare("get_movie_details",
+    snapshot.details_query("= ?1", False))
+_movie_details_stats_sql = datatier.prepare("get_movie_details.stats",
+    snapshot.details_query("= ?1", True))
+
+# many movies: ?1 is a JSON array of movie ids, so one statement serves any
+# number of ids without running into sqlite's limit on ? parameters
+_movie_details_many_sql = datatier.prepare("get_movie_details_many",
+    snapshot.details_query("IN (SELECT value FROM json_each(?1))", False))
+_movie_details_many_stats_sql = datatier.prepare("get_movie_details_many.stats",
+    snapshot.details_query("IN (SELECT value FROM json_each(?1))", True))
+
+# the same columns from the snapshot, for movies whose snapshot is up to
+# date (not in the change log); ?1 as above
+_snapshot_details_sql = datatier.prepare("get_movie_details.snapshot", """
+    SELECT
+        Movie_ID, Title, Release_Date, Runtime, Original_Language,
+        Budget, Revenue, Num_Reviews, Avg_Rating, Tagline, Genres, Companies
+    FROM
+        Movie_Detail_Snapshot
+    WHERE
+        Movie_ID = ?1
+        AND NOT EXISTS (SELECT 1 FROM Movie_Detail_Changes WHERE Movie_ID = ?1)
+""")
+_snapshot_details_many_sql = datatier.prepare("get_movie_details_many.snapshot", """
+    SELECT
+        s.Movie_ID, s.Title, s.Release_Date, s.Runtime, s.Original_Language,
+        s.Budget, s.Revenue, s.Num_Reviews, s.Avg_Rating, s.Tagline, s.Genres, s.Companies
+    FROM
+        Movie_Detail_Snapshot s
+    WHERE
+        s.Movie_ID IN (SELECT value FROM json_each(?1))
+        AND NOT EXISTS (SELECT 1 FROM Movie_Detail_Changes c WHERE c.Movie_ID = s.Movie_ID)
+""")
+
+
+# turns a row of the details query into a MovieDetails object
+def _movie_details_from_row(row):
+    #handle the missing tagline
+    if row[9] is not None:
+        tagline = row[9]
+    else:
+        tagline = ""
+
+    #split the genres and companies back into lists, ordered by name
+    genres = sorted(row[10].split("\x1f")) if row[10] else []
+    companies = sorted(row[11].split("\x1f")) if row[11] else []
+
+    #return the object MovieDetails
+    return MovieDetails(
+        row[0], row[1], row[2], row[3], row[4], 
+        row[5], row[6], row[7], row[8], tagline,
+        genres, companies
+    )
+
+
 def get_movie_details(dbConn, movie_id):
+    if isinstance(dbConn, MovieCatalog):
+        return dbConn.get_movie_details(movie_id)
     try:
-        
-        # query that retrieves the movie details (movie_id, title, release_date, runtime, original_language, budget, revenue,
-        # number of reviews, average rating, and tagline) of a specific movie. Joined with 2 other tables in the database, matching their movie_id's
-        # and grouped by the movie id.
-        details = """
-        SELECT
-            m.Movie_ID, m.Title, DATE(m.Release_Date), m.Runtime, m.Original_Language,
-            m.Budget, m.Revenue,
-            COUNT(r.Rating) AS num_reviews, 
-            IFNULL(AVG(r.Rating), 0) as avg_rating,
-            mt.Tagline
-        FROM
-            Movies m
-        LEFT JOIN Ratings r ON m.Movie_ID = r.Movie_ID
-        LEFT JOIN Movie_Taglines mt ON m.Movie_ID = mt.Movie_ID
-        WHERE
-            m.Movie_ID = ?
-        GROUP BY
-            m.Movie_ID
-        """ 
-        
-        #execute the query and store the results
-        row = datatier.select_one_row(dbConn, details, [movie_id])
+        #serve popular movies from the cache when it is on
+        cache = _details_cache
+        if cache is not None:
+            key = _normalize_movie_id(movie_id)
+            cached = cache.get(key)
+            if cached is not MISSING:
+                return cached
+            token = cache.token()
+
+        #read the snapshot if it is up to date for this movie
+        row = None
+        if snapshot.has_snapshot(dbConn):
+            row = datatier.select_one_row(dbConn, _snapshot_details_sql, [movie_id])
+
+        if not row:
+            if aggregates.has_rating_stats(dbConn):
+                details = _movie_details_stats_sql
+            else:
+                details = _movie_details_sql
+
+            #execute the query and store the results
+            row = datatier.select_one_row(dbConn, details, [movie_id])
         
         #check to see if the data was found
-        if row is None:
+        if row is None or row == ():
             return None #if not found, return none
 
-        #handle the missing tagline
-        if row[9] is not None:
-            tagline = row[9]
-        else:
-            tagline = ""
-        
-        # query to get the genre of the movie the user has selected. Ordered by the genre name
-        genres_sql = """
-        SELECT
-            g.Genre_Name
-        FROM
-            Genres g
-        JOIN
-            Movie_Genres mg ON g.Genre_ID = mg.Genre_ID
-        WHERE 
-            mg.Movie_ID = ?
-        ORDER BY 
-            g.Genre_Name ASC
-        """
-        #execute and store the results
-        genre_results = datatier.select_n_rows(dbConn, genres_sql, [movie_id])
-        
-        #add to the list of genres
-        genres = [genre[0] for genre in genre_results] if genre_results else []
-
-        #get the production company of a movie the user selected and ordered by comapny name in ascending order
-        companies_sql = """
-        SELECT
-            c.Company_Name
-        FROM
-            Companies c
-        JOIN
-            Movie_Production_Companies mpc ON c.Company_ID = mpc.Company_ID
-        WHERE
-            mpc.Movie_ID = ?
-        ORDER BY
-            c.Company_Name ASC
-        """
-        # execute and store the results
-        companies_results = datatier.select_n_rows(dbConn, companies_sql, [movie_id])
-
-        #add to the list of companies
-        companies = [company[0] for company in companies_results] if companies_results else []
-
-        #return the object MovieDetails
-        return MovieDetails(
-            row[0], row[1], row[2], row[3], row[4], 
-            row[5], row[6], row[7], row[8], tagline,
-            genres, companies
-        )
+        movie = _movie_details_from_row(row)
+        if cache is not None:
+            cache.put(key, movie, token)
+        return movie
     except:
         return None
-         
+
+
+##################################################################
+#
+# get_movie_details_many:
+#
+# Like get_movie_details, but for a list of movie IDs at once.
+# All of the movies are loaded with a single query (per chunk of
+# chunk_size IDs), rather than one or more queries per movie.
+#
+# Returns: a list with one entry per ID in movie_ids, in the same
+#          order: the MovieDetails object for that movie, or None
+#          if no movie matches the ID. None is returned instead of
+#          the list if an internal error occurred (in which case
+#          an error message is already output).
+#
+def get_movie_details_many(dbConn, movie_ids, chunk_size = 5000):
+    if isinstance(dbConn, MovieCatalog):
+        return dbConn.get_movie_details_many(movie_ids, chunk_size)
+    try:
+        if aggregates.has_rating_stats(dbConn):
+            details = _movie_details_many_stats_sql
+        else:
+            details = _movie_details_many_sql
+
+        movie_ids = [_normalize_movie_id(movie_id) for movie_id in movie_ids]
+        found = {}
+        wanted = list(dict.fromkeys(movie_id for movie_id in movie_ids if isinstance(movie_id, (int, str))))
+
+        #take what we can from the cache and only query the rest
+        cache = _details_cache
+        if cache is not None:
+            token = cache.token()
+            missing = []
+            for movie_id in wanted:
+                cached = cache.get(movie_id)
+                if cached is MISSING:
+                    missing.append(movie_id)
+                else:
+                    found[movie_id] = cached
+            wanted = missing
+
+        #the snapshot first, then the query for the movies it did not have
+        queries = [details]
+        if snapshot.has_snapshot(dbConn):
+            queries.insert(0, _snapshot_details_many_sql)
+
+        for sql in queries:
+            for start in range(0, len(wanted), chunk_size):
+                rows = datatier.select_n_rows(dbConn, sql, [json.dumps(wanted[start:start + chunk_size])])
+                if rows is None:
+                    return None
+                for row in rows:
+                    movie = _movie_details_from_row(row)
+                    found[row[0]] = movie
+                    if cache is not None:
+                        cache.put(row[0], movie, token)
+            wanted = [movie_id for movie_id in wanted if movie_id not in found]
+
+        return [found.get(movie_id) for movie_id in movie_ids]
+    except Exception as err:
+        print("get_movie_details_many failed:", err)
+        return None
+
 
 ##################################################################
 #
@@ -401,6 +889,7 @@ def get_movie_details(dbConn, movie_id):
 # reviews.
 # Example: get_top_N_movies(10, 100) will return the top 10 movies
 #          with at least 100 reviews.
+# Movies with the same average are ordered by movie ID, lowest first.
 #
 # Returns: a list of 0 or more MovieRating objects
 #          note that if the list is empty, it may be because the 
@@ -408,32 +897,100 @@ def get_movie_details(dbConn, movie_id):
 #          (or an internal error occurred, in which case 
 #          an error message is already output).
 #
+# query that gets the movie_id, title, release year, number of reviews, and average rating of movies. Number of movies depend on users input
+_top_movies_sql = datatier.prepare("get_top_N_movies", """
+    SELECT
+        m.Movie_ID, m.Title, strftime('%Y', m.Release_Date),
+        COUNT(r.Rating) as Num_Reviews,
+        CAST(AVG(r.Rating) AS FLOAT) as Avg_Rating
+    FROM
+        Movies m 
+    JOIN Ratings r on m.Movie_ID = r.Movie_ID
+    GROUP BY 
+        m.Movie_ID
+    HAVING
+        Num_Reviews >= ?
+    ORDER BY
+        Avg_Rating DESC, m.Movie_ID ASC
+    LIMIT ?
+""")
+
+# same ranking from the maintained aggregates: walks them in rating order (via
+# their index) and stops after N matches, instead of grouping and sorting the
+# whole Ratings table (CROSS JOIN keeps sqlite from choosing Movies as the
+# outer loop, which would need a sort again)
+_top_movies_stats_sql = datatier.prepare("get_top_N_movies.stats", """
+    SELECT
+        s.Movie_ID, m.Title, strftime('%Y', m.Release_Date),
+        s.Num_Reviews,
+        s.Avg_Rating
+    FROM
+        Movie_Rating_Stats s
+    CROSS JOIN Movies m on m.Movie_ID = s.Movie_ID
+    WHERE
+        s.Num_Reviews >= ?
+    ORDER BY
+        s.Avg_Rating DESC, s.Movie_ID ASC
+    LIMIT ?
+""")
+
+# one movie's entry in the ranking, to update the leaderboards after
+# it was reviewed (same columns as the ranking queries above)
+_leaderboard_movie_sql = datatier.prepare("leaderboard.movie", """
+    SELECT
+        m.Movie_ID, m.Title, strftime('%Y', m.Release_Date),
+        COUNT(r.Rating) as Num_Reviews,
+        CAST(AVG(r.Rating) AS FLOAT) as Avg_Rating
+    FROM
+        Movies m
+    JOIN Ratings r on m.Movie_ID = r.Movie_ID
+    WHERE
+        m.Movie_ID = ?
+    GROUP BY
+        m.Movie_ID
+""")
+
+_leaderboard_movie_stats_sql = datatier.prepare("leaderboard.movie.stats", """
+    SELECT
+        s.Movie_ID, m.Title, strftime('%Y', m.Release_Date),
+        s.Num_Reviews,
+        s.Avg_Rating
+    FROM
+        Movie_Rating_Stats s
+    JOIN Movies m on m.Movie_ID = s.Movie_ID
+    WHERE
+        s.Movie_ID = ?
+""")
+
 def get_top_N_movies(dbConn, N, min_num_reviews):
+    if isinstance(dbConn, MovieCatalog):
+        return dbConn.get_top_N_movies(N, min_num_reviews)
     try:
-        # query that gets the movie_id, title, release year, number of reviews, and average rating of movies. Number of movies depend on users input
-        ratings = """
-        SELECT
-            m.Movie_ID, m.Title, strftime('%Y', m.Release_Date),
-            COUNT(r.Rating) as Num_Reviews,
-            CAST(AVG(r.Rating) AS FLOAT) as Avg_Rating
-        FROM
-            Movies m 
-        JOIN Ratings r on m.Movie_ID = r.Movie_ID
-        GROUP BY 
-            m.Movie_ID
-        HAVING
-            Num_Reviews >= ?
-        ORDER BY
-            Avg_Rating DESC
-        LIMIT ?
-        """
-        # execute and store the results of the query
-        rows = datatier.select_n_rows(dbConn, ratings, [min_num_reviews, N])
+        # a materialized leaderboard answers without a query when it can
+        boards = _leaderboards
+        board = boards.board_for(N, min_num_reviews) if boards is not None else None
+        if board is not None:
+            top_movies = boards.top(N, min_num_reviews)
+            if top_movies is not None:
+                return list(top_movies)
+            token = boards.token()
+
+        if aggregates.has_rating_stats(dbConn):
+            ratings = _top_movies_stats_sql
+        else:
+            ratings = _top_movies_sql
+        # execute and store the results of the query (a whole
+        # leaderboard's worth if one is being loaded)
+        limit = board.capacity if board is not None else N
+        rows = datatier.select_n_rows(dbConn, ratings, [min_num_reviews, limit])
         #store the results in the movieRating object if it exists
         top_movies = [
             MovieRating(row[0], row[1], row[2], row[3], row[4]) for row in rows
             ] if rows else []
 
+        if board is not None and rows is not None:
+            boards.load(N, min_num_reviews, top_movies, token)
+            top_movies = top_movies[:N]
         return top_movies
     except:
         return []
@@ -451,37 +1008,219 @@ def get_top_N_movies(dbConn, N, min_num_reviews):
 #          0 if not (e.g. if the movie does not exist, or
 #                    if an internal error occurred).
 #
+#find the movie based on movie_id
+_movie_exists_sql = datatier.prepare("movie_exists", """
+    SELECT
+        1
+    FROM
+        Movies
+    WHERE
+        Movie_ID = ?
+""")
+
+# add the review into the reviews table
+_insert_review_sql = datatier.prepare("add_review", """
+    INSERT INTO
+        Ratings (Movie_ID, Rating)
+    VALUES
+        (?, ?)
+""")
+
 def add_review(dbConn, movie_id, rating):
     try:
-        #find the movie that we want to add the review to based on movie_id
-        find_movie = """
-        SELECT
-            1
-        FROM
-            Movies
-        WHERE
-            Movie_ID = ?
-        """
-        row = datatier.select_one_row(dbConn, find_movie, [movie_id])
-        #if we cant find the movie_id, then return 0
-        if row is None or row[0] == 0:
-            return 0
-        
-        # add the review into the reviews table
-        insert_review = """
-        INSERT INTO
-            Ratings (Movie_ID, Rating)
-        VALUES
-            (?, ?)
-        """
-        #call perform action to handle the insert method
-        rows_changed = datatier.perform_action(dbConn, insert_review, [movie_id, rating])
+        #the check and the insert are one unit of work, which joins the
+        #caller's datatier.transaction() block if there is one
+        with datatier.transaction(dbConn):
+            #find the movie that we want to add the review to based on movie_id
+            row = datatier.select_one_row(dbConn, _movie_exists_sql, [movie_id])
+            #if we cant find the movie_id, then return 0
+            if row is None or row[0] == 0:
+                return 0
+
+            #call perform action to handle the insert method
+            rows_changed = datatier.perform_action(dbConn, _insert_review_sql, [movie_id, rating])
+            if rows_changed > 0:
+                _details_changed(dbConn, [movie_id])
+                _ratings_changed(dbConn, [movie_id])
 
         return 1 if rows_changed > 0 else 0 #return 1 if success, 0 for failure
     except:
         return 0 #fail
 
 
+##################################################################
+#
+# add_reviews:
+#
+# Inserts many reviews at once. reviews is an iterable of
+# (movie_id, rating) pairs -- a list, a generator, or the name of a
+# .csv / .jsonl file (see read_reviews_file) -- and is consumed in
+# chunks of chunk_size, so very large imports use bounded memory.
+# Each chunk's movie IDs are checked against the Movies table with
+# one query, and the valid rows are inserted with executemany. The
+# whole import is a single transaction: one commit at the end, and
+# nothing is written if an internal error occurs part way through.
+# Rows for unknown movies, ratings that are not an integer between
+# 0 and 10, and rows that are not pairs (including strings and
+# MALFORMED_REVIEW) are skipped and counted.
+#
+# Returns: a ReviewImportResult object with the per-row counts, or
+#          None if an internal error occurred (and nothing was
+#          inserted; an error message is already output).
+#
+def add_reviews(dbConn, reviews, chunk_size = 1000):
+    try:
+        if isinstance(reviews, str):
+            reviews = read_reviews_file(reviews)
+
+        # counters shared with the chunk generator below
+        counts = {"unknown": 0, "invalid": 0, "malformed": 0}
+        # movie ids already checked against the Movies table, so each
+        # distinct id is looked up at most once per import
+        known = {}
+        # movies that received reviews (their cached details go stale)
+        touched = set()
+
+        #turn the raw input into chunks of validated [movie_id, rating] rows
+        def chunks():
+            for chunk in _chunked(reviews, chunk_size):
+                pending = []
+                for review in chunk:
+                    #a string would unpack character by character
+                    if review is MALFORMED_REVIEW or isinstance(review, (str, bytes)):
+                        counts["malformed"] += 1
+                        continue
+                    try:
+                        movie_id, rating = review
+                    except (TypeError, ValueError):
+                        counts["malformed"] += 1
+                        continue
+                    if not isinstance(movie_id, (int, str)):
+                        counts["malformed"] += 1
+                        continue
+                    rating = _valid_rating(rating)
+                    if rating is None:
+                        counts["invalid"] += 1
+                        continue
+                    pending.append((_normalize_movie_id(movie_id), rating))
+
+                _lookup_movie_ids(dbConn, {movie_id for (movie_id, _) in pending}, known)
+
+                rows = []
+                for (movie_id, rating) in pending:
+                    if known[movie_id]:
+                        rows.append([movie_id, rating])
+                        touched.add(movie_id)
+                    else:
+                        counts["unknown"] += 1
+                yield rows
+
+        inserted = datatier.perform_many(dbConn, _insert_review_sql, chunks())
+        if inserted == -1:
+            return None
+        _details_changed(dbConn, touched)
+        _ratings_changed(dbConn, touched)
+
+        return ReviewImportResult(inserted, counts["unknown"], counts["invalid"], counts["malformed"])
+    except Exception as err:
+        print("add_reviews failed:", err)
+        return None
+
+
+##################################################################
+#
+# read_reviews_file:
+#
+# Generator that streams (movie_id, rating) pairs from a file, one
+# line at a time. A .jsonl file holds one JSON value per line,
+# either [movie_id, rating] or {"movie_id": ..., "rating": ...};
+# any other file is read as CSV with movie_id, rating columns (a
+# header line is skipped). Lines that cannot be understood are
+# yielded as MALFORMED_REVIEW, which add_reviews counts as malformed.
+#
+def read_reviews_file(filename):
+    with open(filename, newline = "", encoding = "utf-8") as infile:
+        if filename.lower().endswith(".jsonl"):
+            for line in infile:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    value = json.loads(line)
+                except ValueError:
+                    yield MALFORMED_REVIEW
+                    continue
+                if isinstance(value, dict):
+                    yield (value.get("movie_id", value.get("Movie_ID")),
+                           value.get("rating", value.get("Rating")))
+                elif isinstance(value, list):
+                    yield value
+                else:
+                    yield MALFORMED_REVIEW
+        else:
+            first = True
+            for row in csv.reader(infile):
+                if not row:
+                    continue
+                #skip a header line such as "movie_id,rating"
+                if first and not row[0].strip().lstrip("-").isdigit():
+                    first = False
+                    continue
+                first = False
+                yield tuple(field.strip() for field in row)
+
+
+# splits an iterable into lists of at most size items
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# returns the rating as an int if it is a whole number 0-10, else None
+def _valid_rating(rating):
+    try:
+        value = float(rating)
+    except (TypeError, ValueError):
+        return None
+    if not 0 <= value <= 10 or value != int(value):
+        return None
+    return int(value)
+
+
+# movie ids typed by users or read from files arrive as strings;
+# use the integer form when there is one so "862" and 862 are the
+# same movie
+def _normalize_movie_id(movie_id):
+    if isinstance(movie_id, str):
+        try:
+            return int(movie_id.strip())
+        except ValueError:
+            return movie_id
+    return movie_id
+
+
+# records in known (movie_id -> True/False) whether each of the
+# given movie ids exists, querying only the ones not seen before
+def _lookup_movie_ids(dbConn, movie_ids, known):
+    missing = [movie_id for movie_id in movie_ids if movie_id not in known]
+    # stay well below sqlite's limit on the number of ? parameters
+    for start in range(0, len(missing), 500):
+        batch = missing[start:start + 500]
+        sql = "SELECT Movie_ID FROM Movies WHERE Movie_ID IN (" + ", ".join("?" * len(batch)) + ")"
+        rows = datatier.select_n_rows(dbConn, sql, batch)
+        if rows is None:
+            raise RuntimeError("movie lookup failed")
+        found = {row[0] for row in rows}
+        for movie_id in batch:
+            known[movie_id] = movie_id in found
+
+
 ##################################################################
 #
 # set_tagline:
@@ -497,64 +1236,269 @@ def add_review(dbConn, movie_id, rating):
 #          0 if not (e.g. if the movie does not exist, or
 #                    if an internal error occurred).
 #
+# insert or replace the tagline in one statement, only if the movie exists
+# (needs Movie_ID to be the primary key, or unique, in Movie_Taglines)
+_upsert_tagline_sql = datatier.prepare("set_tagline", """
+    INSERT INTO Movie_Taglines (Movie_ID, Tagline)
+    SELECT
+        Movie_ID, ?2
+    FROM
+        Movies
+    WHERE
+        Movie_ID = ?1
+    ON CONFLICT (Movie_ID) DO UPDATE SET
+        Tagline = excluded.Tagline
+""")
+
+# without such a key: update the movie's tagline...
+_update_tagline_sql = datatier.prepare("set_tagline.update", """
+    UPDATE Movie_Taglines
+    SET Tagline = ?2
+    WHERE Movie_ID = ?1
+      AND EXISTS (SELECT 1 FROM Movies WHERE Movie_ID = ?1)
+""")
+
+# ...or insert it if it has none (the two run in one transaction)
+_insert_tagline_sql = datatier.prepare("set_tagline.insert", """
+    INSERT INTO Movie_Taglines (Movie_ID, Tagline)
+    SELECT
+        Movie_ID, ?2
+    FROM
+        Movies
+    WHERE
+        Movie_ID = ?1
+      AND NOT EXISTS (SELECT 1 FROM Movie_Taglines WHERE Movie_ID = ?1)
+""")
+
 def set_tagline(dbConn, movie_id, tagline):
     try:
-        #query to check if the movie exists in the database based on the movie_id
-        exists = """
-        SELECT 
-            1
-        FROM 
-            Movies
-        WHERE
-            Movie_ID = ?
-        """
-        #execute and store the result of the movie existing 
-        result = datatier.select_one_row(dbConn, exists, [movie_id])
-        
-        #if the movie does not exist or exists as () then return 0
-        if result is None or result == ():
-            return 0 # movie does not exist
-    
-        #check if a tagline exists for the movie
-        tagline_sql = """
-        SELECT 
-            COUNT(*)
-        FROM 
-            Movie_Taglines
-        WHERE
-            Movie_ID = ?
-        """
-        #execute the query and store its results
-        tagline_result = datatier.select_one_row(dbConn, tagline_sql, [movie_id])
-        
-        #if there is no result, then return 0
-        if tagline_result is None:
-            return 0
-
-        #update the table and set the tagline
-        update_sql = """
-            UPDATE Movie_Taglines 
-            SET Tagline = ? 
-            WHERE Movie_ID = ?
-        """
-        #insert a new one
-        insert_sql = """
-        INSERT INTO Movie_Taglines (Movie_ID, Tagline)
-        VALUES (?, ?)
-        """
-        #Initialize to 0 
-        changed = 0
-        #print(f"tagline results: {tagline_result}")
-        if tagline_result[0] > 0:
-            #UPDATE
-            #execute the query and store the results
-            changed = datatier.perform_action(dbConn, update_sql, [tagline, movie_id])
+        #a single statement checks that the movie exists and sets the tagline,
+        #so no other writer can get in between
+        if _taglines_keyed(dbConn):
+            changed = datatier.perform_action(dbConn, _upsert_tagline_sql, [movie_id, tagline])
         else:
-            #INSERT
-            #execute and store the results
-            changed = datatier.perform_action(dbConn, insert_sql, [movie_id, tagline])
-        
+            changed = datatier.perform_actions(dbConn, [
+                (_update_tagline_sql, [movie_id, tagline]),
+                (_insert_tagline_sql, [movie_id, tagline]),
+            ])
+
+        if changed > 0:
+            _details_changed(dbConn, [movie_id])
+
         #if any changes were made, then return 1 for success, 0 for failure
         return 1 if changed > 0 else 0
     except:
-        return 0
\ No newline at end of file
+        return 0
+
+
+##################################################################
+#
+# set_taglines:
+#
+# Sets the taglines of many movies at once. taglines is a dictionary
+# of movie ID -> tagline, or an iterable of (movie_id, tagline)
+# pairs; a movie listed twice gets the last tagline. Like
+# set_tagline, movies that do not exist are skipped. All the
+# taglines are set in a single transaction: either all of them
+# are written, or none are if an internal error occurs.
+#
+# Returns: the number of taglines set, or
+#          -1 if an internal error occurred (with a message printed).
+#
+def set_taglines(dbConn, taglines):
+    try:
+        if isinstance(taglines, dict):
+            taglines = taglines.items()
+        # one row per movie, keeping its last tagline
+        latest = {}
+        for (movie_id, tagline) in taglines:
+            latest[_normalize_movie_id(movie_id)] = tagline
+        rows = [[movie_id, tagline] for (movie_id, tagline) in latest.items()]
+
+        if _taglines_keyed(dbConn):
+            changed = datatier.perform_many(dbConn, _upsert_tagline_sql, _chunked(rows, 1000))
+        else:
+            actions = []
+            for row in rows:
+                actions.append((_update_tagline_sql, row))
+                actions.append((_insert_tagline_sql, row))
+            changed = datatier.perform_actions(dbConn, actions)
+        if changed == -1:
+            return -1
+
+        _details_changed(dbConn, latest)
+        return changed
+    except Exception as err:
+        print("set_taglines failed:", err)
+        return -1
+
+
+# True if Movie_ID is a unique key of Movie_Taglines, so the upsert
+# can be used (remembered per connection)
+def _taglines_keyed(dbConn):
+    info = datatier.connection_info(dbConn)
+    if "taglines_keyed" not in info:
+        info["taglines_keyed"] = schema.has_unique_key(dbConn, "Movie_Taglines", ("Movie_ID",))
+    return info["taglines_keyed"]
+
+
+##################################################################
+#
+# enable_details_cache:
+#
+# Turns on an in-process cache of MovieDetails objects, used by
+# get_movie_details and get_movie_details_many. At most max_size
+# movies are kept (least recently used are evicted first), and if
+# ttl is given an entry is reloaded once it is ttl seconds old.
+# add_review, add_reviews and set_tagline drop the movies they
+# change from the cache; changes made to the database by other
+# programs are only picked up after flush_details_cache() (or when
+# the ttl runs out). Enabling the cache again replaces it.
+#
+def enable_details_cache(max_size = 1024, ttl = None):
+    global _details_cache
+    _details_cache = LRUCache(max_size, ttl)
+
+
+##################################################################
+#
+# disable_details_cache:
+#
+# Turns the MovieDetails cache off and discards its contents.
+#
+def disable_details_cache():
+    global _details_cache
+    _details_cache = None
+
+
+##################################################################
+#
+# flush_details_cache:
+#
+# Drops the given movie from the MovieDetails cache, or every movie
+# if no movie ID is given. Does nothing if the cache is off.
+#
+def flush_details_cache(movie_id = None):
+    cache = _details_cache
+    if cache is None:
+        return
+    if movie_id is None:
+        cache.clear()
+    else:
+        cache.invalidate(_normalize_movie_id(movie_id))
+
+
+##################################################################
+#
+# details_cache_stats:
+#
+# Returns: a dictionary with the size, hits, misses, evictions,
+#          expirations and invalidations of the MovieDetails
+#          cache, or None if the cache is off.
+#
+def details_cache_stats():
+    cache = _details_cache
+    if cache is None:
+        return None
+    return cache.stats()
+
+
+# called after a write that changes what get_movie_details returns
+# for the movies: they are dropped from the cache now, and again when
+# the write is committed (a read in between may have cached the
+# committed, old details) or rolled back (a read in between on the
+# writing connection may have cached the details being undone)
+def _details_changed(dbConn, movie_ids):
+    cache = _details_cache
+    if cache is None:
+        return
+    movie_ids = [_normalize_movie_id(movie_id) for movie_id in movie_ids]
+
+    def invalidate():
+        for movie_id in movie_ids:
+            cache.invalidate(movie_id)
+
+    invalidate()
+    datatier.on_commit(dbConn, invalidate)
+    datatier.on_rollback(dbConn, invalidate)
+
+
+##################################################################
+#
+# enable_leaderboards:
+#
+# Keeps the top-N rankings in boards -- (N, min_num_reviews) pairs --
+# materialized in memory, so get_top_N_movies answers them (and any
+# smaller N with the same minimum) without a query. Each ranking is
+# loaded from the database on first use with headroom movies more
+# than it shows; add_review and add_reviews then update the movies
+# they review in place (see leaderboard.py). If max_age is given, a
+# ranking is also loaded again once it is max_age seconds old, which
+# is how changes made by other programs are picked up. Enabling the
+# leaderboards again replaces them.
+#
+def enable_leaderboards(boards = ((10, 10), (50, 100), (100, 1000)), headroom = 50, max_age = None):
+    global _leaderboards
+    _leaderboards = LeaderboardSet(boards, headroom, max_age)
+
+
+##################################################################
+#
+# disable_leaderboards:
+#
+# Stops materializing the rankings; get_top_N_movies queries the
+# database on every call again.
+#
+def disable_leaderboards():
+    global _leaderboards
+    _leaderboards = None
+
+
+##################################################################
+#
+# leaderboard_stats:
+#
+# Returns: a dictionary with the boards, max_age, and the number of
+#          rankings answered (hits), loaded and updated, or None if
+#          the leaderboards are off.
+#
+def leaderboard_stats():
+    boards = _leaderboards
+    if boards is None:
+        return None
+    return boards.stats()
+
+
+# called after a write that changes the ratings of the movies; the
+# leaderboards are updated once the write is committed (or rolled
+# back)
+def _ratings_changed(dbConn, movie_ids):
+    if _leaderboards is None:
+        return
+    movie_ids = list(movie_ids)
+    datatier.on_commit(dbConn, lambda: _update_leaderboards(dbConn, movie_ids))
+    # a ranking loaded through the writing connection before a
+    # rollback may hold the undone ratings
+    datatier.on_rollback(dbConn, lambda: _update_leaderboards(dbConn, movie_ids))
+
+
+def _update_leaderboards(dbConn, movie_ids):
+    boards = _leaderboards
+    if boards is None:
+        return
+    if len(movie_ids) > _MAX_LEADERBOARD_UPDATES:
+        boards.invalidate()
+        return
+
+    if aggregates.has_rating_stats(dbConn):
+        sql = _leaderboard_movie_stats_sql
+    else:
+        sql = _leaderboard_movie_sql
+    for movie_id in movie_ids:
+        row = datatier.select_one_row(dbConn, sql, [movie_id])
+        if row is None:
+            # the movie's new rating is unknown: start over
+            boards.invalidate()
+            return
+        if row:
+            boards.update(MovieRating(row[0], row[1], row[2], row[3], row[4]))
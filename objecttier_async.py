@@ -0,0 +1,156 @@
+#
+# objecttier_async.py
+# Coroutine versions of the objecttier functions, for asyncio
+# programs (web services, ...) that must not block their event loop
+# on sqlite.
+#
+# Every call runs the ordinary objecttier function on a dedicated
+# thread pool. The threads share a datatier.ConnectionPool with one
+# read connection per thread (and the pool's single writer), and
+# sqlite releases the GIL while it executes a query, so lookups
+# started together with asyncio.gather run in parallel.
+#
+# Classes:
+# - AsyncObjectTier: the coroutine API over one database file.
+#
+# Usage:
+#   async with objecttier_async.AsyncObjectTier("movielens.db", max_workers = 8) as db:
+#       details = await asyncio.gather(*(db.get_movie_details(i) for i in movie_ids))
+#
+# Return values and error handling are those of objecttier: the
+# coroutines return -1 / None / [] and print a message on errors.
+# The details-cache functions and read_reviews_file do no database
+# I/O and are called on objecttier directly.
+#
+import asyncio
+import concurrent.futures
+import functools
+
+import datatier
+import objecttier
+
+
+##################################################################
+#
+# AsyncObjectTier class:
+# - Coroutine versions of the objecttier functions over one database:
+#    + Constructor(dbName, max_workers, max_pending, timeout)
+#      > dbName: path of the sqlite database (a file: an in-memory
+#                database cannot be shared between connections)
+#      > max_workers: threads, and read connections, that run the
+#                     queries (default 4)
+#      > max_pending: calls allowed to be running or queued at once
+#                     (default 4 * max_workers); further calls wait
+#                     in the event loop until one finishes, so a
+#                     gather over 100,000 lookups does not queue
+#                     100,000 tasks on the thread pool
+#      > timeout: seconds to wait for sqlite's locks (default 30)
+#    + The objecttier functions as coroutines, with the same
+#      parameters minus dbConn: num_movies(), get_movie_details(id), ...
+#    + iter_movies(pattern, batch_size): an async generator
+#    + close() (a coroutine), or use "async with"
+#    + Properties:
+#      > max_workers: int
+#      > max_pending: int
+#      > pool: the datatier.ConnectionPool the queries run on
+#
+class AsyncObjectTier:
+    # Constructor
+    def __init__(self, dbName, max_workers = 4, max_pending = None, timeout = 30.0):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if max_pending is None:
+            max_pending = 4 * max_workers
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+        self._max_workers = max_workers
+        self._max_pending = max_pending
+        self._pool = datatier.ConnectionPool(dbName, pool_size = max_workers, timeout = timeout)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers = max_workers, thread_name_prefix = "objecttier")
+        self._pending = asyncio.Semaphore(max_pending)
+
+    #read only properties
+
+    # max_workers : int
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    # max_pending : int
+    @property
+    def max_pending(self):
+        return self._max_pending
+
+    # pool : datatier.ConnectionPool
+    @property
+    def pool(self):
+        return self._pool
+
+    # runs fn(pool, *args) on the thread pool
+    async def _run(self, fn, *args):
+        async with self._pending:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, self._pool, *args))
+
+    async def num_movies(self, approximate = False):
+        return await self._run(objecttier.num_movies, approximate)
+
+    async def num_reviews(self, approximate = False):
+        return await self._run(objecttier.num_reviews, approximate)
+
+    async def get_movies(self, pattern):
+        return await self._run(objecttier.get_movies, pattern)
+
+    async def count_movies(self, pattern):
+        return await self._run(objecttier.count_movies, pattern)
+
+    async def get_movies_page(self, pattern, page_size = 100, after = None):
+        return await self._run(objecttier.get_movies_page, pattern, page_size, after)
+
+    # pages through the movies with get_movies_page, so the thread pool
+    # is never held while the caller works on a batch
+    async def iter_movies(self, pattern, batch_size = 500):
+        after = None
+        while True:
+            (movies, after) = await self.get_movies_page(pattern, batch_size, after)
+            for movie in movies:
+                yield movie
+            if after is None:
+                return
+
+    async def search_movies(self, text, mode = "token", limit = None):
+        return await self._run(objecttier.search_movies, text, mode, limit)
+
+    async def get_movie_details(self, movie_id):
+        return await self._run(objecttier.get_movie_details, movie_id)
+
+    async def get_movie_details_many(self, movie_ids, chunk_size = 5000):
+        return await self._run(objecttier.get_movie_details_many, list(movie_ids), chunk_size)
+
+    async def get_top_N_movies(self, N, min_num_reviews):
+        return await self._run(objecttier.get_top_N_movies, N, min_num_reviews)
+
+    async def add_review(self, movie_id, rating):
+        return await self._run(objecttier.add_review, movie_id, rating)
+
+    # reviews may be a generator (e.g. objecttier.read_reviews_file):
+    # it is consumed on the worker thread
+    async def add_reviews(self, reviews, chunk_size = 1000):
+        return await self._run(objecttier.add_reviews, reviews, chunk_size)
+
+    async def set_tagline(self, movie_id, tagline):
+        return await self._run(objecttier.set_tagline, movie_id, tagline)
+
+    # waits for the calls already running, then closes the connections
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(self._executor.shutdown, wait = True))
+        self._pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
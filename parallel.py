@@ -0,0 +1,255 @@
+#
+# parallel.py
+# Aggregates the Ratings table on several cores at once: the table
+# is split into ranges (of Movie_ID, or of rowid), each range is
+# aggregated by a separate worker process on its own read-only
+# connection (see datatier.connect), and the partial counts and sums
+# are merged. sqlite runs one query on one core, so this is how a
+# full-catalog recompute gets faster than a single GROUP BY.
+#
+# Splitting by Movie_ID (the default) lets every worker read its
+# range from the Ratings_By_Movie index (see schema.py) already
+# grouped by movie, and no movie is split between two ranges.
+# Splitting by rowid gives ranges with the same number of rows even
+# when a few movies have most of the ratings, but each worker then
+# groups its rows itself and a movie's partial results are added up
+# across ranges.
+#
+# There are more ranges than workers (4 per worker by default), so
+# a worker that finishes a quick range picks up the next one.
+#
+# Functions:
+# - split_ranges(dbConn, num_ranges, split): the (low, high) ranges to aggregate.
+# - aggregate_ratings(dbName, workers, num_ranges, split): per-movie counts and sums.
+# - rating_totals(dbName, workers, num_ranges, split): count and sums of every rating.
+#
+# Usage:
+#   python parallel.py movielens.db --workers 8
+#   python aggregates.py movielens.db --rebuild --workers 8
+#
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+import datatier
+
+
+# smallest and largest key of the ratings, for each way of splitting
+# (as two subqueries: sqlite only looks up a MIN or MAX in the index
+# when it is the only aggregate of its SELECT)
+_bounds_sql = {
+    "movie": datatier.prepare("parallel.bounds.movie",
+        "SELECT (SELECT MIN(Movie_ID) FROM Ratings), (SELECT MAX(Movie_ID) FROM Ratings)"),
+    "rowid": datatier.prepare("parallel.bounds.rowid",
+        "SELECT (SELECT MIN(rowid) FROM Ratings), (SELECT MAX(rowid) FROM Ratings)"),
+}
+
+# count, sum and sum of squares of the ratings of each movie in a range
+_range_stats_sql = {
+    "movie": datatier.prepare("parallel.stats.movie", """
+        SELECT
+            Movie_ID, COUNT(Rating), SUM(Rating), SUM(Rating * Rating)
+        FROM
+            Ratings
+        WHERE
+            Movie_ID BETWEEN ? AND ? AND Rating IS NOT NULL
+        GROUP BY
+            Movie_ID
+    """),
+    "rowid": datatier.prepare("parallel.stats.rowid", """
+        SELECT
+            Movie_ID, COUNT(Rating), SUM(Rating), SUM(Rating * Rating)
+        FROM
+            Ratings
+        WHERE
+            rowid BETWEEN ? AND ? AND Rating IS NOT NULL
+        GROUP BY
+            Movie_ID
+    """),
+}
+
+# count, sum and sum of squares of all the ratings in a range
+_range_totals_sql = {
+    "movie": datatier.prepare("parallel.totals.movie", """
+        SELECT
+            COUNT(Rating), SUM(Rating), SUM(Rating * Rating)
+        FROM
+            Ratings
+        WHERE
+            Movie_ID BETWEEN ? AND ?
+    """),
+    "rowid": datatier.prepare("parallel.totals.rowid", """
+        SELECT
+            COUNT(Rating), SUM(Rating), SUM(Rating * Rating)
+        FROM
+            Ratings
+        WHERE
+            rowid BETWEEN ? AND ?
+    """),
+}
+
+# the worker process's read-only connection (see _open_worker)
+_worker_conn = None
+
+
+##################################################################
+#
+# split_ranges:
+#
+# Divides the keys of the Ratings table -- Movie_ID, or rowid if
+# split is "rowid" -- into (up to) num_ranges ranges of equal width,
+# as (low, high) pairs with both ends included, in order.
+#
+# Returns: a list of (low, high) pairs ([] if there are no ratings),
+#          or None if an error occurs (with a message printed).
+#
+def split_ranges(dbConn, num_ranges, split = "movie"):
+    if split not in _bounds_sql:
+        print("split_ranges failed: split must be 'movie' or 'rowid'")
+        return None
+    row = datatier.select_one_row(dbConn, _bounds_sql[split])
+    if row is None:
+        return None
+    (low, high) = row
+    if low is None:
+        return []
+
+    width = max(1, -(-(high - low + 1) // max(1, num_ranges)))
+    return [(start, min(start + width - 1, high)) for start in range(low, high + 1, width)]
+
+
+# runs in each worker process when it starts
+def _open_worker(dbName):
+    global _worker_conn
+    _worker_conn = datatier.connect(dbName, read_only = True)
+
+
+# the aggregate of one range, computed in a worker process (or in
+# this process, on dbConn)
+def _aggregate_range(what, split, low, high, dbConn = None):
+    if dbConn is None:
+        dbConn = _worker_conn
+    if what == "stats":
+        rows = datatier.select_n_rows(dbConn, _range_stats_sql[split], [low, high])
+    else:
+        rows = datatier.select_one_row(dbConn, _range_totals_sql[split], [low, high])
+    if rows is None:
+        raise RuntimeError(f"aggregating ratings {low}..{high} failed")
+    return rows
+
+
+# aggregates every range, with workers processes (in this process
+# if workers is 1), returning the results in range order
+def _aggregate(dbName, what, workers, num_ranges, split):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    if num_ranges is None:
+        num_ranges = 4 * workers
+    if split not in _bounds_sql:
+        raise ValueError("split must be 'movie' or 'rowid'")
+
+    dbConn = datatier.connect(dbName, read_only = True)
+    try:
+        ranges = split_ranges(dbConn, num_ranges, split)
+        if ranges is None:
+            raise RuntimeError("splitting the ratings failed")
+        if workers == 1 or len(ranges) <= 1:
+            return [_aggregate_range(what, split, low, high, dbConn) for (low, high) in ranges]
+    finally:
+        datatier.forget_connection(dbConn)
+        dbConn.close()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = min(workers, len(ranges)),
+                                                initializer = _open_worker, initargs = (dbName,)) as pool:
+        futures = [pool.submit(_aggregate_range, what, split, low, high) for (low, high) in ranges]
+        return [future.result() for future in futures]
+
+
+##################################################################
+#
+# aggregate_ratings:
+#
+# Computes, for every movie with at least one rating, the number of
+# ratings, their sum and the sum of their squares (the columns of
+# aggregates.py's Movie_Rating_Stats), splitting the work into
+# num_ranges ranges (default 4 per worker) aggregated by workers
+# processes (default: one per CPU). dbName is the path of the
+# database file.
+#
+# Returns: a list of (Movie_ID, Num_Reviews, Sum_Rating, Sum_Squares)
+#          tuples in Movie_ID order, or
+#          None if an error occurs (with a message printed).
+#
+def aggregate_ratings(dbName, workers = None, num_ranges = None, split = "movie"):
+    try:
+        partials = _aggregate(dbName, "stats", workers, num_ranges, split)
+    except Exception as err:
+        print("aggregate_ratings failed:", err)
+        return None
+
+    if split == "movie":
+        # the ranges are in order and no movie is in two of them
+        return [row for rows in partials for row in rows]
+
+    merged = {}
+    for rows in partials:
+        for (movie_id, count, total, squares) in rows:
+            if movie_id in merged:
+                (c, t, s) = merged[movie_id]
+                merged[movie_id] = (c + count, t + total, s + squares)
+            else:
+                merged[movie_id] = (count, total, squares)
+    return [(movie_id,) + merged[movie_id] for movie_id in sorted(merged)]
+
+
+##################################################################
+#
+# rating_totals:
+#
+# Like aggregate_ratings, but for the catalog as a whole: the number
+# of ratings, their sum and the sum of their squares.
+#
+# Returns: a (count, sum, sum of squares) tuple, or
+#          None if an error occurs (with a message printed).
+#
+def rating_totals(dbName, workers = None, num_ranges = None, split = "movie"):
+    try:
+        partials = _aggregate(dbName, "totals", workers, num_ranges, split)
+    except Exception as err:
+        print("rating_totals failed:", err)
+        return None
+
+    (count, total, squares) = (0, 0, 0)
+    for (c, t, s) in partials:
+        count += c
+        total += t or 0
+        squares += s or 0
+    return (count, total, squares)
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate the Ratings table with several processes.")
+    parser.add_argument("database", help="path to the MovieLens sqlite database")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1],
+                        help="worker counts to time (default: 1 and one per CPU)")
+    parser.add_argument("--ranges", type=int, help="ranges to split the ratings into (default 4 per worker)")
+    parser.add_argument("--split", choices=["movie", "rowid"], default="movie", help="how to split the ratings")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'movies':>10} {'seconds':>9}")
+    for workers in args.workers:
+        start = time.perf_counter()
+        rows = aggregate_ratings(args.database, workers, args.ranges, args.split)
+        elapsed = time.perf_counter() - start
+        if rows is None:
+            sys.exit(1)
+        print(f"{workers:8} {len(rows):10,} {elapsed:9.3f}")
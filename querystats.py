@@ -0,0 +1,287 @@
+#
+# querystats.py
+# Per-statement query statistics and a slow-query log, collected
+# through datatier's query hooks (datatier.add_query_hook).
+#
+# Statements declared with datatier.prepare() are reported under
+# their name ("get_movie_details", ...); other SQL under its text,
+# with whitespace collapsed.
+#
+# Classes:
+# - QueryStats: call counts, rows, errors and a latency histogram per statement.
+# - SlowQueryLog: logs the SQL, parameters and query plan of slow queries.
+#
+# Functions:
+# - enable(slow_query_ms): installs a QueryStats (and, if a threshold is given, a SlowQueryLog).
+# - disable(): removes them again.
+# - dump(format, out): writes the collected statistics as "text" or "json".
+# - percentiles(samples): summarizes a list of latencies (used by benchmark.py and main.py).
+#
+# Usage (from main.py, see there):
+#   MOVIEDB_QUERY_STATS=1 MOVIEDB_SLOW_QUERY_MS=50 python main.py
+#   kill -USR1 <pid>          (dumps the statistics to stderr)
+#
+import json
+import logging
+import re
+import sys
+import threading
+
+import datatier
+
+
+# upper bounds (milliseconds) of the latency histogram buckets; the
+# last bucket holds everything slower
+BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+_whitespace = re.compile(r"\s+")
+
+# the collector / log installed by enable()
+_stats = None
+_slow_log = None
+
+
+# the name a statement is reported under
+def _statement_key(sql):
+    name = getattr(sql, "name", None)
+    if name is not None:
+        return name
+    text = _whitespace.sub(" ", str(sql)).strip()
+    if len(text) > 80:
+        text = text[:77] + "..."
+    return text
+
+
+##################################################################
+#
+# QueryStats class:
+# - A datatier query hook that counts, per statement:
+#    + Constructor()
+#    + call it as a hook: add with datatier.add_query_hook(stats)
+#    + as_dict(): statement -> {calls, errors, rows, total_ms,
+#      mean_ms, max_ms, histogram}, where histogram maps each bucket
+#      label ("<=1ms", ..., ">2500ms") to the calls that fell in it
+#    + to_text(), to_json(): as_dict() formatted for reading
+#    + reset(): forgets everything counted so far
+#
+class QueryStats:
+    # Constructor
+    def __init__(self):
+        # reentrant: main.py dumps the statistics from a signal
+        # handler, which can run while this thread holds the lock
+        self._lock = threading.RLock()
+        self._entries = {}   # key -> [calls, errors, rows, total_s, max_s, buckets]
+
+    def __call__(self, conn, sql, parameters, seconds, rows, error):
+        key = _statement_key(sql)
+        milliseconds = seconds * 1000.0
+        bucket = len(BUCKETS_MS)
+        for (i, bound) in enumerate(BUCKETS_MS):
+            if milliseconds <= bound:
+                bucket = i
+                break
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [0, 0, 0, 0.0, 0.0, [0] * (len(BUCKETS_MS) + 1)]
+                self._entries[key] = entry
+            entry[0] += 1
+            if error is not None:
+                entry[1] += 1
+            elif rows is not None and rows > 0:
+                entry[2] += rows
+            entry[3] += seconds
+            entry[4] = max(entry[4], seconds)
+            entry[5][bucket] += 1
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+    def as_dict(self):
+        with self._lock:
+            entries = {key: (entry[:5] + [list(entry[5])]) for (key, entry) in self._entries.items()}
+
+        labels = [f"<={bound:g}ms" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]:g}ms"]
+        result = {}
+        for (key, (calls, errors, rows, total, slowest, buckets)) in entries.items():
+            result[key] = {
+                "calls": calls,
+                "errors": errors,
+                "rows": rows,
+                "total_ms": total * 1000.0,
+                "mean_ms": total * 1000.0 / calls,
+                "max_ms": slowest * 1000.0,
+                "histogram": {label: count for (label, count) in zip(labels, buckets) if count},
+            }
+        return result
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent = 2)
+
+    def to_text(self):
+        stats = self.as_dict()
+        lines = [f"{'statement':40} {'calls':>8} {'errors':>6} {'rows':>10} {'total ms':>10} {'mean ms':>9} {'max ms':>9}"]
+        # the statements that took the most time in total first
+        for (key, entry) in sorted(stats.items(), key = lambda item: -item[1]["total_ms"]):
+            lines.append(f"{key[:40]:40} {entry['calls']:8} {entry['errors']:6} {entry['rows']:10} "
+                         f"{entry['total_ms']:10.2f} {entry['mean_ms']:9.3f} {entry['max_ms']:9.3f}")
+            lines.append("    " + "  ".join(f"{label} {count}" for (label, count) in entry["histogram"].items()))
+        return "\n".join(lines)
+
+
+##################################################################
+#
+# SlowQueryLog class:
+# - A datatier query hook that logs every query slower than a
+#   threshold, with its SQL, parameters and EXPLAIN QUERY PLAN:
+#    + Constructor(threshold_ms, logger, explain)
+#      > threshold_ms: float, queries taking at least this long
+#                      are logged
+#      > logger: logging.Logger to log to (at WARNING), default
+#                the "datatier.slow" logger
+#      > explain: bool, whether to include the query plan
+#    + Properties:
+#      > threshold_ms: float
+#      > count: int (slow queries logged so far)
+#
+class SlowQueryLog:
+    # Constructor
+    def __init__(self, threshold_ms, logger = None, explain = True):
+        self._threshold_ms = threshold_ms
+        self._logger = logger if logger is not None else logging.getLogger("datatier.slow")
+        self._explain = explain
+        self._count = 0
+        # the hooks run on every thread that queries (e.g. pool threads)
+        self._lock = threading.Lock()
+
+    #read only properties
+
+    # threshold_ms : float
+    @property
+    def threshold_ms(self):
+        return self._threshold_ms
+
+    # count : int
+    @property
+    def count(self):
+        return self._count
+
+    def __call__(self, conn, sql, parameters, seconds, rows, error):
+        milliseconds = seconds * 1000.0
+        if milliseconds < self._threshold_ms:
+            return
+        with self._lock:
+            self._count += 1
+
+        lines = [f"slow query ({milliseconds:.1f} ms, {_statement_key(sql)}):",
+                 "  sql: " + _whitespace.sub(" ", str(sql)).strip(),
+                 f"  parameters: {parameters!r}"]
+        if error is not None:
+            lines.append(f"  error: {error}")
+        else:
+            lines.append(f"  rows: {rows}")
+        if self._explain:
+            plan = _query_plan(conn, sql, parameters)
+            if plan:
+                lines.append("  plan:")
+                lines.extend("    " + detail for detail in plan)
+        self._logger.warning("\n".join(lines))
+
+
+# the EXPLAIN QUERY PLAN detail lines, or None if the plan cannot be
+# had (statements run without their parameters, scripts, ...)
+def _query_plan(conn, sql, parameters):
+    if parameters is None:
+        return None
+    try:
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + str(sql), parameters)]
+    except Exception:
+        return None
+
+
+##################################################################
+#
+# enable:
+#
+# Starts collecting query statistics (replacing any collection
+# started earlier), and, if slow_query_ms is given, logging the
+# queries that take at least that many milliseconds. The slow-query
+# log writes to the "datatier.slow" logger; if logging has not been
+# configured, its messages go to stderr.
+#
+# Returns: the QueryStats collecting the statistics.
+#
+def enable(slow_query_ms = None):
+    global _stats, _slow_log
+    disable()
+
+    _stats = QueryStats()
+    datatier.add_query_hook(_stats)
+    if slow_query_ms is not None:
+        _slow_log = SlowQueryLog(slow_query_ms)
+        datatier.add_query_hook(_slow_log)
+    return _stats
+
+
+##################################################################
+#
+# disable:
+#
+# Stops the collection started by enable().
+#
+def disable():
+    global _stats, _slow_log
+    for hook in (_stats, _slow_log):
+        if hook is not None:
+            datatier.remove_query_hook(hook)
+    _stats = None
+    _slow_log = None
+
+
+##################################################################
+#
+# dump:
+#
+# Writes the statistics collected since enable() to out (default
+# stderr), as "text" (a table, slowest statements first) or "json".
+# Writes nothing if collection is not enabled.
+#
+def dump(format = "text", out = None):
+    if _stats is None:
+        return
+    if out is None:
+        out = sys.stderr
+    if format == "json":
+        out.write(_stats.to_json() + "\n")
+    else:
+        out.write(_stats.to_text() + "\n")
+    out.flush()
+
+
+##################################################################
+#
+# percentiles:
+#
+# Returns: a dictionary summarizing a list of latencies (seconds)
+#          in milliseconds: count, mean, p50, p90, p99, max, plus
+#          the throughput in calls per second.
+#
+def percentiles(samples):
+    ordered = sorted(samples)
+    count = len(ordered)
+
+    def pick(fraction):
+        return ordered[min(count - 1, int(fraction * count))] * 1000.0
+
+    total = sum(ordered)
+    return {
+        "count": count,
+        "mean_ms": total / count * 1000.0,
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p99_ms": pick(0.99),
+        "max_ms": ordered[-1] * 1000.0,
+        "calls_per_sec": count / total if total > 0 else None,
+    }
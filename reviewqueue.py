@@ -0,0 +1,395 @@
+#
+# reviewqueue.py
+# Write-behind queue for reviews: add_review checks the review and
+# queues it, and returns without waiting for the database; a
+# background thread writes the queued reviews in batches, one
+# transaction (and one commit) per batch, through
+# objecttier.add_reviews. Under a burst of reviews the write lock is
+# then taken a few times per second instead of once per review, and
+# readers are not stalled behind a stream of commits.
+#
+# A review that add_review accepted is in the database once flush()
+# returns, or once the queue is closed (close() writes everything
+# still queued; it is also called when the program exits). The
+# database connections and the journal belong to the background
+# thread, which closes them when it stops.
+#
+# Optionally the queue keeps a journal file: every accepted review
+# is appended to it before add_review returns, and a queue opened on
+# the same journal after a crash writes the reviews that had not
+# been written yet. Each batch records its last journal entry in
+# the Review_Queue_Applied table in the same transaction, so no
+# review is written twice.
+#
+# Queued reviews are not in the database yet. The readers of the
+# queue (num_reviews, get_movie_details) can count them anyway with
+# include_pending = True.
+#
+# Classes:
+# - ReviewQueue: the queue over one database file.
+#
+# Usage:
+#   queue = reviewqueue.ReviewQueue("movielens.db", journal = "reviews.journal")
+#   queue.add_review(862, 9)
+#   ...
+#   queue.close()
+#
+import argparse
+import atexit
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+import datatier
+import objecttier
+
+
+_create_applied_table = """
+CREATE TABLE IF NOT EXISTS Review_Queue_Applied (
+    Journal  TEXT PRIMARY KEY,
+    Seq      INTEGER NOT NULL
+)
+"""
+
+_applied_sql = """
+SELECT Seq FROM Review_Queue_Applied WHERE Journal = ?
+"""
+
+_record_applied_sql = """
+INSERT INTO Review_Queue_Applied (Journal, Seq) VALUES (?1, ?2)
+ON CONFLICT (Journal) DO UPDATE SET Seq = excluded.Seq
+"""
+
+
+##################################################################
+#
+# ReviewQueue class:
+# - Reviews queued in memory (and optionally a journal file) and
+#   written to the database by a background thread:
+#    + Constructor(dbName, batch_size, max_delay_ms, max_pending, journal, sync, timeout)
+#      > dbName: path of the sqlite database (a file)
+#      > batch_size: reviews written per transaction, at most (default 1000)
+#      > max_delay_ms: how long a review may wait for its batch to
+#                      fill up before it is written anyway (default 50)
+#      > max_pending: reviews allowed in the queue; add_review waits
+#                     for room beyond that (default 100,000)
+#      > journal: path of the journal file, or None for no journal
+#      > sync: fsync the journal after every review (survives a power
+#                failure, not just a crash, and is much slower)
+#      > timeout: seconds to wait for sqlite's locks (default 30)
+#    + add_review(movie_id, rating, timeout): as objecttier.add_review,
+#      but only queues the review: 1 if it was queued, 0 if the movie
+#      does not exist or the rating is invalid, -1 if the queue stayed
+#      full for timeout seconds (None: wait as long as it takes) or is
+#      closed
+#    + pending(): reviews queued and not written yet
+#    + flush(timeout): writes the queued reviews now and waits for
+#      them; True when the queue is empty, False on timeout or if a
+#      batch failed (it is then retried)
+#    + num_reviews(include_pending): objecttier.num_reviews, plus the
+#      queued reviews if include_pending
+#    + get_movie_details(movie_id, include_pending): as objecttier's,
+#      with the queued reviews of the movie in Num_Reviews / Avg_Rating
+#      if include_pending
+#    + stats(): reviews written and rejected, batches, errors, pending
+#    + close(timeout): writes what is still queued and stops the
+#      thread; True once it has stopped, False if it is still writing
+#      after timeout seconds (it then closes the database and journal
+#      itself when it is done)
+#    + Properties:
+#      > pool: the datatier.ConnectionPool the queue works on
+#
+class ReviewQueue:
+    # Constructor
+    def __init__(self, dbName, batch_size = 1000, max_delay_ms = 50.0, max_pending = 100000,
+                 journal = None, sync = False, timeout = 30.0):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+        self._batch_size = batch_size
+        self._max_delay = max_delay_ms / 1000.0
+        self._max_pending = max_pending
+        self._sync = sync
+        self._pool = datatier.ConnectionPool(dbName, pool_size = 2, timeout = timeout)
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # held by the writer thread while a batch is committed and taken
+        # off the pending counts, so readers never count it twice
+        self._writing = threading.Lock()
+        # (seq, movie_id, rating, time queued)
+        self._queue = collections.deque()
+        self._in_flight = 0
+        self._by_movie = {}   # movie_id -> [queued reviews, sum of their ratings]
+        self._seq = 0
+        self._flush_requested = False
+        self._closing = False
+        self._failed = False
+        self._stats = {"written": 0, "rejected": 0, "batches": 0, "errors": 0}
+
+        self._journal_name = None
+        self._journal = None
+        if journal is not None:
+            self._open_journal(journal)
+
+        self._thread = threading.Thread(target = self._run, name = "reviewqueue", daemon = True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    #read only properties
+
+    # pool : datatier.ConnectionPool
+    @property
+    def pool(self):
+        return self._pool
+
+    # replays the journal entries not written yet, then keeps appending
+    def _open_journal(self, journal):
+        self._journal_name = os.path.abspath(journal)
+        if datatier.perform_actions(self._pool, [(_create_applied_table, None)]) == -1:
+            raise RuntimeError("cannot create the Review_Queue_Applied table")
+        row = datatier.select_one_row(self._pool, _applied_sql, [self._journal_name])
+        if row is None:
+            raise RuntimeError("cannot read the Review_Queue_Applied table")
+        applied = row[0] if row else 0
+        self._seq = applied
+
+        now = time.monotonic()
+        if os.path.exists(journal):
+            with open(journal, encoding = "utf-8") as infile:
+                for line in infile:
+                    try:
+                        (seq, movie_id, rating) = json.loads(line)
+                    except ValueError:
+                        continue   # a line cut short by a crash
+                    self._seq = max(self._seq, seq)
+                    if seq > applied:
+                        self._queue.append((seq, movie_id, rating, now))
+                        self._count(movie_id, rating, 1)
+        self._journal = open(journal, "a", encoding = "utf-8")
+        if not self._queue:
+            self._journal.truncate(0)
+
+    # adds (sign 1) or removes (sign -1) a review from the pending counts
+    def _count(self, movie_id, rating, sign):
+        counts = self._by_movie.get(movie_id)
+        if counts is None:
+            counts = self._by_movie[movie_id] = [0, 0]
+        counts[0] += sign
+        counts[1] += sign * rating
+        if counts[0] == 0:
+            del self._by_movie[movie_id]
+
+    def add_review(self, movie_id, rating, timeout = None):
+        if self._closing:
+            return -1
+        rating = objecttier._valid_rating(rating)
+        movie_id = objecttier._normalize_movie_id(movie_id)
+        if rating is None or not isinstance(movie_id, int):
+            return 0
+        row = datatier.select_one_row(self._pool, objecttier._movie_exists_sql, [movie_id])
+        if not row:
+            return 0
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while not self._closing and len(self._queue) + self._in_flight >= self._max_pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return -1
+                self._changed.wait(remaining)
+            if self._closing:
+                return -1
+
+            self._seq += 1
+            if self._journal is not None:
+                self._journal.write(json.dumps([self._seq, movie_id, rating]) + "\n")
+                self._journal.flush()
+                if self._sync:
+                    os.fsync(self._journal.fileno())
+            self._queue.append((self._seq, movie_id, rating, time.monotonic()))
+            self._count(movie_id, rating, 1)
+            if len(self._queue) >= self._batch_size:
+                self._changed.notify_all()
+        return 1
+
+    def pending(self):
+        with self._lock:
+            return len(self._queue) + self._in_flight
+
+    def flush(self, timeout = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            self._failed = False
+            self._flush_requested = True
+            self._changed.notify_all()
+            while self._queue or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if (remaining is not None and remaining <= 0) or self._failed or not self._thread.is_alive():
+                    return False
+                self._changed.wait(remaining)
+            return True
+
+    def num_reviews(self, include_pending = False):
+        if not include_pending:
+            return objecttier.num_reviews(self._pool)
+        with self._writing:
+            count = objecttier.num_reviews(self._pool)
+            if count == -1:
+                return -1
+            return count + self.pending()
+
+    def get_movie_details(self, movie_id, include_pending = False):
+        if not include_pending:
+            return objecttier.get_movie_details(self._pool, movie_id)
+        with self._writing:
+            movie = objecttier.get_movie_details(self._pool, movie_id)
+            if movie is None:
+                return None
+            with self._lock:
+                (count, total) = self._by_movie.get(movie.Movie_ID, (0, 0))
+        if count == 0:
+            return movie
+        num_reviews = movie.Num_Reviews + count
+        avg_rating = (movie.Avg_Rating * movie.Num_Reviews + total) / num_reviews
+        return objecttier.MovieDetails(
+            movie.Movie_ID, movie.Title, movie.Release_Date, movie.Runtime, movie.Original_Language,
+            movie.Budget, movie.Revenue, num_reviews, avg_rating, movie.Tagline,
+            movie.Genres, movie.Production_Companies)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending = len(self._queue) + self._in_flight)
+
+    def close(self, timeout = None):
+        with self._changed:
+            if self._closing:
+                return
+            self._closing = True
+            self._changed.notify_all()
+        atexit.unregister(self.close)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # a batch is still being written: the thread needs the
+            # database (and the journal) until it stops
+            print("ReviewQueue.close: still writing after %s seconds" % timeout)
+            return False
+        if self.pending():
+            print("ReviewQueue.close: %d reviews were not written" % self.pending())
+        return True
+
+    # the background thread: writes batches until the queue is closed,
+    # then closes the database and the journal
+    def _run(self):
+        try:
+            self._write_batches()
+        finally:
+            if self._journal is not None:
+                self._journal.close()
+            self._pool.close()
+
+    # waits for a full batch, the oldest review to be max_delay old, a
+    # flush or close, then writes a batch
+    def _write_batches(self):
+        while True:
+            with self._changed:
+                while True:
+                    if self._queue and (self._closing or self._flush_requested
+                                        or len(self._queue) >= self._batch_size):
+                        break
+                    if self._closing:
+                        return
+                    if not self._queue:
+                        self._flush_requested = False
+                        self._changed.wait()
+                        continue
+                    wait = self._queue[0][3] + self._max_delay - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._changed.wait(wait)
+                batch = [self._queue.popleft() for _ in range(min(self._batch_size, len(self._queue)))]
+                self._in_flight = len(batch)
+
+            with self._writing:
+                result = self._write(batch)
+                with self._changed:
+                    self._in_flight = 0
+                    if result is None:
+                        # put the batch back and try again a little later
+                        self._queue.extendleft(reversed(batch))
+                        self._stats["errors"] += 1
+                        self._failed = True
+                    else:
+                        for (_, movie_id, rating, _) in batch:
+                            self._count(movie_id, rating, -1)
+                        self._stats["written"] += result.Num_Accepted
+                        self._stats["rejected"] += result.Num_Rejected
+                        self._stats["batches"] += 1
+                        if self._journal is not None and not self._queue:
+                            # every entry is written and recorded as such
+                            self._journal.truncate(0)
+                    self._changed.notify_all()
+            if result is None:
+                if self._closing:
+                    return   # what is left stays in the journal, if there is one
+                time.sleep(max(self._max_delay, 0.1))
+
+    # writes a batch in one transaction; returns add_reviews' result,
+    # or None if nothing was written
+    def _write(self, batch):
+        try:
+            with datatier.transaction(self._pool):
+                result = objecttier.add_reviews(self._pool, [(movie_id, rating) for (_, movie_id, rating, _) in batch],
+                                                chunk_size = len(batch))
+                if result is None:
+                    raise RuntimeError("add_reviews failed")
+                if self._journal_name is not None:
+                    if datatier.perform_action(self._pool, _record_applied_sql,
+                                               [self._journal_name, batch[-1][0]]) == -1:
+                        raise RuntimeError("recording the journal position failed")
+            return result
+        except Exception as err:
+            print("ReviewQueue: writing %d reviews failed: %s" % (len(batch), err))
+            return None
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time add_review against the write-behind review queue.")
+    parser.add_argument("database", help="sqlite database to add the reviews to")
+    parser.add_argument("--reviews", type=int, default=5000, help="reviews to add each way (default 5000)")
+    parser.add_argument("--journal", help="journal file for the queue")
+    args = parser.parse_args()
+
+    dbConn = datatier.connect(args.database)
+    movie_id = datatier.select_one_row(dbConn, "SELECT MIN(Movie_ID) FROM Movies")[0]
+    if movie_id is None:
+        print("The database has no movies.")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    for i in range(args.reviews):
+        objecttier.add_review(dbConn, movie_id, i % 11)
+    direct = time.perf_counter() - start
+    dbConn.close()
+
+    queue = ReviewQueue(args.database, journal = args.journal)
+    start = time.perf_counter()
+    for i in range(args.reviews):
+        queue.add_review(movie_id, i % 11)
+    queued = time.perf_counter() - start
+    queue.flush()
+    flushed = time.perf_counter() - start
+    print(queue.stats())
+    queue.close()
+
+    print(f"{'add_review':24}{args.reviews / direct:10.0f} reviews/s")
+    print(f"{'queued (acknowledged)':24}{args.reviews / queued:10.0f} reviews/s")
+    print(f"{'queued (written)':24}{args.reviews / flushed:10.0f} reviews/s")
@@ -0,0 +1,238 @@
+#
+# schema.py
+# Index migration and query-plan checks for the MovieLens tables
+# used by objecttier.py.
+#
+# Functions:
+# - ensure_indexes(dbConn): creates any of the supporting indexes that are missing.
+# - has_unique_key(dbConn, table, columns): True if the columns are a primary key or unique index.
+# - explain_statements(dbConn): runs EXPLAIN QUERY PLAN on every prepared query.
+# - find_full_scans(plans): the queries that scan a whole table without being expected to.
+#
+# Usage:
+#   python schema.py movielens.db              (create missing indexes, then report plans)
+#   python schema.py movielens.db --check      (report only; exit status 1 on unexpected scans)
+#
+import argparse
+import sqlite3
+import sys
+
+import datatier
+
+
+# The indexes objecttier's queries rely on, as (name, table, columns).
+# Each is created only if the table does not already have an index
+# (or an INTEGER PRIMARY KEY) that starts with the same columns.
+# The Ratings and link-table indexes are covering: everything those
+# queries read from the table is in the index, so the table itself
+# is never visited.
+INDEXES = [
+    # per-movie rating counts / averages, and the Ratings joins
+    ("Ratings_By_Movie", "Ratings", ("Movie_ID", "Rating")),
+    # genres and production companies of a movie
+    ("Movie_Genres_By_Movie", "Movie_Genres", ("Movie_ID", "Genre_ID")),
+    ("Movie_Production_Companies_By_Movie", "Movie_Production_Companies", ("Movie_ID", "Company_ID")),
+    # tagline of a movie (usually already the primary key)
+    ("Movie_Taglines_By_Movie", "Movie_Taglines", ("Movie_ID",)),
+]
+
+# Queries that are meant to read a whole table: counting every row,
+# LIKE patterns (which can start with a wildcard), and the ranking
+# that aggregates every rating when the maintained aggregates from
+# aggregates.py are not installed. The ranking over the aggregates
+# walks their index in order and stops after N rows. analytics.py
+# reads the rating counts of every movie at once.
+EXPECTED_FULL_SCANS = {
+    "num_movies",
+    "num_reviews",
+    "get_movies",
+    "count_movies",
+    "get_movies_page.first",
+    "get_movies_page.next",
+    "get_top_N_movies",
+    "get_top_N_movies.stats",
+    "analytics.histograms",
+}
+
+
+##################################################################
+#
+# ensure_indexes:
+#
+# Creates whichever of the INDEXES are missing, in one transaction.
+# Safe to run any number of times: indexes that exist (under any
+# name) are left alone, and tables that do not exist are skipped.
+#
+# Returns: a list of the names of the indexes created (empty if
+#          there was nothing to do), or
+#          None if an error occurs (with a message printed).
+#
+def ensure_indexes(dbConn):
+    actions = []
+    created = []
+    for (name, table, columns) in INDEXES:
+        if not datatier.table_exists(dbConn, table):
+            continue
+        if _has_index_on(dbConn, table, columns):
+            continue
+        actions.append((f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})", None))
+        created.append(name)
+
+    if not actions:
+        return []
+    if datatier.perform_actions(dbConn, actions) == -1:
+        return None
+    return created
+
+
+# True if the table already has an index whose leading columns are
+# columns (or, for a single column, if it is the INTEGER PRIMARY KEY)
+def _has_index_on(dbConn, table, columns):
+    table_info = datatier.select_n_rows(dbConn, f"PRAGMA table_info({table})") or []
+    # (cid, name, type, notnull, default, pk)
+    pk = [row for row in table_info if row[5]]
+    if len(columns) == 1 and len(pk) == 1 and pk[0][1] == columns[0] and pk[0][2].upper() == "INTEGER":
+        return True
+
+    # (seq, name, unique, origin, partial)
+    for index in datatier.select_n_rows(dbConn, f"PRAGMA index_list({table})") or []:
+        # (seqno, cid, name)
+        info = datatier.select_n_rows(dbConn, f"PRAGMA index_info({index[1]})") or []
+        indexed = tuple(row[2] for row in sorted(info))
+        if indexed[:len(columns)] == tuple(columns):
+            return True
+    return False
+
+
+##################################################################
+#
+# has_unique_key:
+#
+# Returns True if exactly the given columns are the table's primary
+# key or a unique index on it (so "ON CONFLICT (columns)" can be
+# used when inserting), False if not or if the table does not exist.
+#
+def has_unique_key(dbConn, table, columns):
+    table_info = datatier.select_n_rows(dbConn, f"PRAGMA table_info({table})") or []
+    # (cid, name, type, notnull, default, pk): pk is the column's position in the key
+    pk = tuple(row[1] for row in sorted(table_info, key = lambda row: row[5]) if row[5])
+    if pk == tuple(columns):
+        return True
+
+    # (seq, name, unique, origin, partial)
+    for index in datatier.select_n_rows(dbConn, f"PRAGMA index_list({table})") or []:
+        if not index[2] or index[4]:
+            continue
+        # (seqno, cid, name)
+        info = datatier.select_n_rows(dbConn, f"PRAGMA index_info({index[1]})") or []
+        if tuple(row[2] for row in sorted(info)) == tuple(columns):
+            return True
+    return False
+
+
+##################################################################
+#
+# explain_statements:
+#
+# Runs EXPLAIN QUERY PLAN for every statement declared with
+# datatier.prepare() (import objecttier first so its queries are
+# declared). Parameters are bound as NULL, which does not change
+# the plan. Statements over optional tables that are not installed
+# in this database (e.g. the rating aggregates) are skipped.
+#
+# Returns: a list of (name, plan) pairs, where plan is a list of
+#          the plan's detail lines, or None for a skipped statement.
+#
+def explain_statements(dbConn):
+    plans = []
+    for statement in datatier.registered_statements():
+        plans.append((statement.name, _explain(dbConn, statement)))
+    return plans
+
+
+def _explain(dbConn, sql):
+    # sqlite3 does not say how many parameters a statement has, so
+    # try binding more NULLs until the count is right
+    for num_params in range(0, 10):
+        try:
+            dbCursor = dbConn.execute("EXPLAIN QUERY PLAN " + sql, [None] * num_params)
+            return [row[3] for row in dbCursor.fetchall()]
+        except sqlite3.ProgrammingError:
+            continue
+        except sqlite3.OperationalError:
+            return None
+    return None
+
+
+##################################################################
+#
+# find_full_scans:
+#
+# Given the output of explain_statements, picks out the plan lines
+# that scan a whole table or index ("SCAN ..."), ignoring virtual
+# tables (full-text index, json_each), constant rows, subqueries the
+# plan materialized itself (those only hold the already-filtered
+# rows), and the statements listed in EXPECTED_FULL_SCANS.
+#
+# Returns: a list of (name, plan line) pairs, one per full scan.
+#
+def find_full_scans(plans):
+    scans = []
+    for (name, plan) in plans:
+        if plan is None or name in EXPECTED_FULL_SCANS:
+            continue
+        materialized = {detail.split()[1] for detail in plan if detail.startswith("MATERIALIZE ")}
+        for detail in plan:
+            if not detail.startswith("SCAN "):
+                continue
+            if "VIRTUAL TABLE" in detail or detail.startswith("SCAN CONSTANT ROW"):
+                continue
+            if detail.split()[1] in materialized:
+                continue
+            scans.append((name, detail))
+    return scans
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create missing indexes and check objecttier's query plans for full scans.")
+    parser.add_argument("database", help="path to the MovieLens sqlite database")
+    parser.add_argument("--check", action="store_true",
+                        help="only report; do not create indexes")
+    args = parser.parse_args()
+
+    # declares every objecttier query with datatier.prepare()
+    import objecttier
+
+    dbConn = sqlite3.connect(args.database)
+    if not args.check:
+        created = ensure_indexes(dbConn)
+        if created is None:
+            sys.exit(1)
+        for name in created:
+            print(f"Created index {name}")
+
+    plans = explain_statements(dbConn)
+    for (name, plan) in plans:
+        print()
+        print(f"{name}:")
+        if plan is None:
+            print("  (skipped: uses a table that is not installed)")
+            continue
+        for detail in plan:
+            print(f"  {detail}")
+
+    scans = find_full_scans(plans)
+    print()
+    if scans:
+        print("Unexpected full scans:")
+        for (name, detail) in scans:
+            print(f"  {name}: {detail}")
+    else:
+        print("No unexpected full scans.")
+    dbConn.close()
+    sys.exit(1 if scans else 0)
@@ -0,0 +1,193 @@
+#
+# search.py
+# Full-text index over movie titles, so title searches are index
+# lookups instead of "Title LIKE ?" scans of the whole Movies table.
+#
+# The index is an FTS5 virtual table, Movies_Title_FTS, that uses
+# Movies itself as its content table (the titles are not stored
+# twice) with Movie_ID as its rowid. Triggers on Movies keep it in
+# sync with inserts, title changes and deletes.
+#
+# Functions:
+# - install_title_index(dbConn): creates the index and its triggers and fills it.
+# - rebuild_title_index(dbConn): refills the index from the Movies table.
+# - has_title_index(dbConn): True if the index is installed in the database.
+# - match_expression(text, mode): turns user text into an FTS5 query.
+#
+# Usage (one-time setup, or a rebuild after bulk changes):
+#   python search.py movielens.db
+#   python search.py movielens.db --rebuild
+#
+import argparse
+import re
+import sqlite3
+import sys
+
+import datatier
+
+
+TABLE_NAME = "Movies_Title_FTS"
+
+# unicode61 folds case (like LIKE does for ASCII) and, with
+# remove_diacritics, lets "cafe" find "Café"; the prefix indexes make
+# 2- and 3-character prefix queries cheap
+_create_index = """
+CREATE VIRTUAL TABLE IF NOT EXISTS Movies_Title_FTS USING fts5 (
+    Title,
+    content = 'Movies',
+    content_rowid = 'Movie_ID',
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+_create_insert_trigger = """
+CREATE TRIGGER IF NOT EXISTS Movies_Title_FTS_Insert
+AFTER INSERT ON Movies
+BEGIN
+    INSERT INTO Movies_Title_FTS (rowid, Title) VALUES (NEW.Movie_ID, NEW.Title);
+END
+"""
+
+_create_delete_trigger = """
+CREATE TRIGGER IF NOT EXISTS Movies_Title_FTS_Delete
+AFTER DELETE ON Movies
+BEGIN
+    INSERT INTO Movies_Title_FTS (Movies_Title_FTS, rowid, Title)
+    VALUES ('delete', OLD.Movie_ID, OLD.Title);
+END
+"""
+
+_create_update_trigger = """
+CREATE TRIGGER IF NOT EXISTS Movies_Title_FTS_Update
+AFTER UPDATE OF Movie_ID, Title ON Movies
+BEGIN
+    INSERT INTO Movies_Title_FTS (Movies_Title_FTS, rowid, Title)
+    VALUES ('delete', OLD.Movie_ID, OLD.Title);
+    INSERT INTO Movies_Title_FTS (rowid, Title) VALUES (NEW.Movie_ID, NEW.Title);
+END
+"""
+
+_rebuild_index = """
+INSERT INTO Movies_Title_FTS (Movies_Title_FTS) VALUES ('rebuild')
+"""
+
+# the characters FTS5's unicode61 tokenizer treats as part of a word
+_token = re.compile(r"\w+", re.UNICODE)
+
+
+##################################################################
+#
+# has_title_index:
+#
+# Returns True if the title index has been installed in the
+# database behind the given connection, False if not. The answer
+# is remembered per connection.
+#
+def has_title_index(dbConn):
+    info = datatier.connection_info(dbConn)
+    if "title_index" not in info:
+        info["title_index"] = datatier.table_exists(dbConn, TABLE_NAME)
+    return info["title_index"]
+
+
+##################################################################
+#
+# install_title_index:
+#
+# Creates the title index and the triggers that maintain it, and
+# fills it from the Movies table, all in one transaction.
+#
+# Returns: the number of titles indexed, or
+#          -1 if an error occurs (with a message printed).
+#
+def install_title_index(dbConn):
+    rows = datatier.perform_actions(dbConn, [
+        (_create_index, None),
+        (_create_insert_trigger, None),
+        (_create_delete_trigger, None),
+        (_create_update_trigger, None),
+        (_rebuild_index, None),
+    ])
+    if rows == -1:
+        return -1
+
+    datatier.connection_info(dbConn)["title_index"] = True
+    return _count_titles(dbConn)
+
+
+##################################################################
+#
+# rebuild_title_index:
+#
+# Refills the title index from the Movies table (e.g. after Movies
+# was bulk-loaded while the triggers were missing).
+#
+# Returns: the number of titles indexed, or
+#          -1 if an error occurs (with a message printed).
+#
+def rebuild_title_index(dbConn):
+    if not has_title_index(dbConn):
+        return install_title_index(dbConn)
+
+    if datatier.perform_actions(dbConn, [(_rebuild_index, None)]) == -1:
+        return -1
+    return _count_titles(dbConn)
+
+
+def _count_titles(dbConn):
+    row = datatier.select_one_row(dbConn, "SELECT COUNT(*) FROM Movies WHERE Title IS NOT NULL")
+    if not row:
+        return -1
+    return row[0]
+
+
+##################################################################
+#
+# match_expression:
+#
+# Turns the words typed by a user into an FTS5 MATCH expression.
+# Punctuation is ignored, and every word is quoted so that FTS5
+# operators (AND, OR, NOT, NEAR, *, ^, ...) in the text are taken
+# literally. mode is one of:
+#   "token"  - every word must appear in the title as a whole word
+#   "prefix" - every word must begin a word of the title
+#   "ranked" - any word may begin a word of the title (the caller
+#              orders the matches by relevance)
+#
+# Returns: the MATCH expression, or "" if the text has no words.
+#
+def match_expression(text, mode = "token"):
+    if mode not in ("token", "prefix", "ranked"):
+        raise ValueError("unknown search mode: %r" % (mode,))
+
+    words = ['"' + word.replace('"', '""') + '"' for word in _token.findall(text)]
+    if mode != "token":
+        words = [word + "*" for word in words]
+    if mode == "ranked":
+        return " OR ".join(words)
+    return " ".join(words)
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Install (and fill) or rebuild the full-text index over movie titles.")
+    parser.add_argument("database", help="path to the MovieLens sqlite database")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="refill the index of an existing installation")
+    args = parser.parse_args()
+
+    dbConn = sqlite3.connect(args.database)
+    if args.rebuild:
+        count = rebuild_title_index(dbConn)
+    else:
+        count = install_title_index(dbConn)
+    dbConn.close()
+
+    if count == -1:
+        sys.exit(1)
+    print(f"Title index ready for {count:,} movies.")
@@ -0,0 +1,352 @@
+#
+# snapshot.py
+# Keeps a denormalized copy of every movie's details, so that the
+# object tier's get_movie_details reads one row by primary key
+# instead of joining Movies, Ratings (or the aggregates from
+# aggregates.py), Movie_Taglines, Genres / Movie_Genres and
+# Companies / Movie_Production_Companies on every call.
+#
+# The copy lives in the Movie_Detail_Snapshot table, one row per
+# movie with the columns of the details query (see details_query),
+# the genres and companies already joined into one string each.
+#
+# Triggers on every table the details are made of record the movies
+# whose details changed -- through add_review, set_tagline or any
+# other writer -- in the Movie_Detail_Changes table (the change
+# log), in the same transaction as the change. The snapshot of a
+# movie in the change log is out of date: objecttier reads those
+# movies with the details query, until refresh_snapshot rebuilds
+# their rows and empties the log. Run it as often as suits the
+# write load, e.g. from a scheduled job:
+#   python snapshot.py movielens.db --refresh
+#
+# Functions:
+# - details_query(match, with_stats): the SQL that computes the details of movies.
+# - install_snapshot(dbConn): creates the tables and triggers and builds the snapshot.
+# - rebuild_snapshot(dbConn): rebuilds every row of the snapshot.
+# - refresh_snapshot(dbConn): rebuilds the rows of the movies in the change log.
+# - pending_changes(dbConn): the number of movies in the change log.
+# - has_snapshot(dbConn): True if the snapshot is installed in the database.
+#
+# Usage:
+#   python snapshot.py movielens.db
+#   python snapshot.py movielens.db --rebuild
+#   python snapshot.py movielens.db --refresh
+#
+import argparse
+import sqlite3
+import sys
+
+import datatier
+import aggregates
+
+
+TABLE_NAME = "Movie_Detail_Snapshot"
+
+
+##################################################################
+#
+# details_query:
+#
+# Builds the query that retrieves everything about the selected movies in one
+# round trip: the movie details (movie_id, title, release_date, runtime,
+# original_language, budget, revenue), the number of reviews and average
+# rating, the tagline, and the genres and production companies joined into
+# one string each (separated by char(31), the ASCII unit separator).
+# Every related table is aggregated per movie *before* it is joined, so
+# a movie with many ratings and several genres never multiplies into
+# ratings x genres rows. The movies are picked by match, which refers to
+# the single parameter ?1; with_stats reads the number of reviews and
+# average from the maintained aggregates (see aggregates.py) instead of
+# the Ratings table.
+#
+def details_query(match, with_stats):
+    if with_stats:
+        ratings = "Movie_Rating_Stats"
+    else:
+        ratings = f"""(
+            SELECT Movie_ID, COUNT(Rating) AS Num_Reviews, AVG(Rating) AS Avg_Rating
+            FROM Ratings
+            WHERE Movie_ID {match}
+            GROUP BY Movie_ID
+        )"""
+    return f"""
+    SELECT
+        m.Movie_ID, m.Title, DATE(m.Release_Date), m.Runtime, m.Original_Language,
+        m.Budget, m.Revenue,
+        IFNULL(r.Num_Reviews, 0) AS num_reviews,
+        IFNULL(r.Avg_Rating, 0) AS avg_rating,
+        mt.Tagline,
+        g.Genres,
+        c.Companies
+    FROM
+        Movies m
+    LEFT JOIN {ratings} r ON m.Movie_ID = r.Movie_ID
+    LEFT JOIN Movie_Taglines mt ON m.Movie_ID = mt.Movie_ID
+    LEFT JOIN (
+        SELECT mg.Movie_ID, group_concat(g.Genre_Name, char(31)) AS Genres
+        FROM Movie_Genres mg
+        JOIN Genres g ON g.Genre_ID = mg.Genre_ID
+        WHERE mg.Movie_ID {match}
+        GROUP BY mg.Movie_ID
+    ) g ON m.Movie_ID = g.Movie_ID
+    LEFT JOIN (
+        SELECT mpc.Movie_ID, group_concat(c.Company_Name, char(31)) AS Companies
+        FROM Movie_Production_Companies mpc
+        JOIN Companies c ON c.Company_ID = mpc.Company_ID
+        WHERE mpc.Movie_ID {match}
+        GROUP BY mpc.Movie_ID
+    ) c ON m.Movie_ID = c.Movie_ID
+    WHERE
+        m.Movie_ID {match}
+    """
+
+
+# the columns have no type, so sqlite stores every value exactly as the
+# details query returned it (an average of 0 stays the integer 0)
+_create_table = """
+CREATE TABLE IF NOT EXISTS Movie_Detail_Snapshot (
+    Movie_ID  INTEGER PRIMARY KEY,
+    Title,
+    Release_Date,
+    Runtime,
+    Original_Language,
+    Budget,
+    Revenue,
+    Num_Reviews,
+    Avg_Rating,
+    Tagline,
+    Genres,
+    Companies
+)
+"""
+
+# the movies whose snapshot is out of date (each at most once)
+_create_changes_table = """
+CREATE TABLE IF NOT EXISTS Movie_Detail_Changes (
+    Movie_ID  INTEGER PRIMARY KEY
+)
+"""
+
+# records a movie in the change log (a NOT EXISTS instead of INSERT OR
+# IGNORE: an OR clause in a trigger is replaced by the one of the
+# statement that fired it)
+_log_change = """
+    INSERT INTO Movie_Detail_Changes (Movie_ID)
+    SELECT {movie_id}
+    WHERE NOT EXISTS (SELECT 1 FROM Movie_Detail_Changes WHERE Movie_ID = {movie_id});
+"""
+
+# the tables with a Movie_ID column that the details are made of
+_MOVIE_TABLES = ("Movies", "Ratings", "Movie_Taglines", "Movie_Genres", "Movie_Production_Companies")
+
+# renaming a genre or company changes the details of all its movies
+_log_renamed = """
+CREATE TRIGGER IF NOT EXISTS {table}_Snapshot_Update
+AFTER UPDATE ON {table}
+BEGIN
+    INSERT INTO Movie_Detail_Changes (Movie_ID)
+    SELECT DISTINCT l.Movie_ID FROM {link} l
+    WHERE l.{key} IN (OLD.{key}, NEW.{key})
+      AND NOT EXISTS (SELECT 1 FROM Movie_Detail_Changes c WHERE c.Movie_ID = l.Movie_ID);
+END
+"""
+
+_NAME_TABLES = (("Genres", "Movie_Genres", "Genre_ID"),
+                ("Companies", "Movie_Production_Companies", "Company_ID"))
+
+
+def _create_triggers():
+    triggers = []
+    for table in _MOVIE_TABLES:
+        for (event, rows) in (("Insert", ["NEW"]), ("Delete", ["OLD"]), ("Update", ["OLD", "NEW"])):
+            body = "".join(_log_change.format(movie_id = f"{row}.Movie_ID") for row in rows)
+            triggers.append(f"CREATE TRIGGER IF NOT EXISTS {table}_Snapshot_{event}\n"
+                            f"AFTER {event.upper()} ON {table}\nBEGIN{body}END")
+    for (table, link, key) in _NAME_TABLES:
+        triggers.append(_log_renamed.format(table = table, link = link, key = key))
+    return triggers
+
+
+_clear_snapshot = """
+DELETE FROM Movie_Detail_Snapshot
+"""
+
+_clear_changes = """
+DELETE FROM Movie_Detail_Changes
+"""
+
+# the snapshot rows of the movies in the change log
+_clear_changed = """
+DELETE FROM Movie_Detail_Snapshot
+WHERE Movie_ID IN (SELECT Movie_ID FROM Movie_Detail_Changes)
+"""
+
+_pending_sql = "SELECT COUNT(*) FROM Movie_Detail_Changes"
+
+
+# the statement that stores the details of the movies picked by match
+def _fill_snapshot(dbConn, match):
+    with_stats = aggregates.has_rating_stats(dbConn)
+    return "INSERT INTO Movie_Detail_Snapshot\n" + details_query(match, with_stats)
+
+
+##################################################################
+#
+# has_snapshot:
+#
+# Returns True if the Movie_Detail_Snapshot table has been installed
+# in the database behind the given connection, False if not. The
+# answer is remembered per connection, so only the first call
+# touches the database.
+#
+def has_snapshot(dbConn):
+    info = datatier.connection_info(dbConn)
+    if "detail_snapshot" not in info:
+        info["detail_snapshot"] = datatier.table_exists(dbConn, TABLE_NAME)
+    return info["detail_snapshot"]
+
+
+##################################################################
+#
+# install_snapshot:
+#
+# Creates the snapshot and change log tables and the triggers that
+# feed the log, then builds the snapshot of every movie. All of this
+# happens in one transaction. Calling it on a database that already
+# has the snapshot rebuilds it.
+#
+# Returns: the number of movies in the snapshot, or
+#          -1 if an error occurs (with a message printed).
+#
+def install_snapshot(dbConn):
+    actions = [(_create_table, None), (_create_changes_table, None)]
+    actions += [(trigger, None) for trigger in _create_triggers()]
+    actions += [
+        (_clear_snapshot, None),
+        (_clear_changes, None),
+        (_fill_snapshot(dbConn, "IS NOT NULL"), None),
+    ]
+    if datatier.perform_actions(dbConn, actions) == -1:
+        return -1
+
+    datatier.connection_info(dbConn)["detail_snapshot"] = True
+    return _count_snapshot(dbConn)
+
+
+##################################################################
+#
+# rebuild_snapshot:
+#
+# Throws away the snapshot and the change log and builds the
+# snapshot of every movie again, in one transaction (e.g. after
+# tables were loaded with the triggers missing, or after
+# aggregates.py was installed).
+#
+# Returns: the number of movies in the snapshot, or
+#          -1 if an error occurs (with a message printed).
+#
+def rebuild_snapshot(dbConn):
+    if not has_snapshot(dbConn):
+        return install_snapshot(dbConn)
+
+    rows = datatier.perform_actions(dbConn, [
+        (_clear_snapshot, None),
+        (_clear_changes, None),
+        (_fill_snapshot(dbConn, "IS NOT NULL"), None),
+    ])
+    if rows == -1:
+        return -1
+
+    return _count_snapshot(dbConn)
+
+
+##################################################################
+#
+# refresh_snapshot:
+#
+# Rebuilds the snapshot rows of the movies in the change log (and
+# drops the rows of movies that no longer exist), then empties the
+# log, in one transaction.
+#
+# Returns: the number of movies refreshed, or
+#          -1 if the snapshot is not installed or an error occurs
+#          (with a message printed).
+#
+def refresh_snapshot(dbConn):
+    if not has_snapshot(dbConn):
+        print("refresh_snapshot failed: the snapshot is not installed")
+        return -1
+
+    try:
+        with datatier.transaction(dbConn):
+            pending = datatier.select_one_row(dbConn, _pending_sql)
+            if not pending:
+                raise RuntimeError("reading the change log failed")
+            if pending[0] == 0:
+                return 0
+            rows = datatier.perform_actions(dbConn, [
+                (_clear_changed, None),
+                (_fill_snapshot(dbConn, "IN (SELECT Movie_ID FROM Movie_Detail_Changes)"), None),
+                (_clear_changes, None),
+            ])
+            if rows == -1:
+                raise RuntimeError("rebuilding the changed movies failed")
+    except Exception as err:
+        print("refresh_snapshot failed:", err)
+        return -1
+
+    return pending[0]
+
+
+##################################################################
+#
+# pending_changes:
+#
+# Returns: the number of movies whose snapshot is out of date, or
+#          -1 if the snapshot is not installed or an error occurs.
+#
+def pending_changes(dbConn):
+    if not has_snapshot(dbConn):
+        return -1
+    row = datatier.select_one_row(dbConn, _pending_sql)
+    if not row:
+        return -1
+    return row[0]
+
+
+def _count_snapshot(dbConn):
+    row = datatier.select_one_row(dbConn, "SELECT COUNT(*) FROM Movie_Detail_Snapshot")
+    if not row:
+        return -1
+    return row[0]
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Install, rebuild or refresh the denormalized movie details snapshot.")
+    parser.add_argument("database", help="path to the MovieLens sqlite database")
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--rebuild", action="store_true", help="rebuild every movie of an existing installation")
+    action.add_argument("--refresh", action="store_true", help="rebuild the movies in the change log")
+    args = parser.parse_args()
+
+    dbConn = sqlite3.connect(args.database)
+    if args.refresh:
+        count = refresh_snapshot(dbConn)
+        message = "Refreshed the details of {:,} movies."
+    elif args.rebuild:
+        count = rebuild_snapshot(dbConn)
+        message = "Details snapshot ready for {:,} movies."
+    else:
+        count = install_snapshot(dbConn)
+        message = "Details snapshot ready for {:,} movies."
+    dbConn.close()
+
+    if count == -1:
+        sys.exit(1)
+    print(message.format(count))
@@ -0,0 +1,67 @@
+#
+# conftest.py
+# Shared fixtures: a small synthetic database (see gen_moviedb.py)
+# per test, and connections to it that are cleaned up afterwards.
+#
+import os
+import random
+import shutil
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datatier
+import gen_moviedb
+import objecttier
+import schema
+
+
+# generated once per session and copied for each test that needs it
+@pytest.fixture(scope = "session")
+def _template_db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("template") / "movies.db")
+    dbConn = sqlite3.connect(path)
+    gen_moviedb.create_schema(dbConn)
+    # few ratings over few movies, so many movies tie on their average
+    gen_moviedb.generate(dbConn, 400, 3000, num_companies = 50, rand = random.Random(341))
+    schema.ensure_indexes(dbConn)
+    dbConn.close()
+    return path
+
+
+##################################################################
+#
+# movie_db: the path of a fresh copy of the test database
+#
+@pytest.fixture
+def movie_db(_template_db, tmp_path):
+    path = str(tmp_path / "movies.db")
+    shutil.copyfile(_template_db, path)
+    return path
+
+
+##################################################################
+#
+# connect: opens connections to the test database (or another
+# path), closed and forgotten by the data tier at the end of the
+# test, with the object tier's in-memory caches turned off again
+#
+@pytest.fixture
+def connect(movie_db):
+    opened = []
+
+    def open_connection(path = movie_db, **options):
+        dbConn = datatier.connect(path, **options)
+        opened.append(dbConn)
+        return dbConn
+
+    yield open_connection
+
+    objecttier.disable_details_cache()
+    objecttier.disable_leaderboards()
+    for dbConn in opened:
+        datatier.forget_connection(dbConn)
+        dbConn.close()
@@ -0,0 +1,28 @@
+#
+# test_add_reviews.py
+# Bulk review ingestion (objecttier.add_reviews / read_reviews_file).
+#
+import objecttier
+
+
+def test_unreadable_jsonl_lines_are_rejected(connect, tmp_path):
+    dbConn = connect()
+    before = objecttier.num_reviews(dbConn)
+    reviews = tmp_path / "reviews.jsonl"
+    # "08" is not JSON and "\"08\"" is a JSON string: neither is movie 0 rated 8
+    reviews.write_text('[1, 7]\n08\n"08"\n{"movie_id": 2, "rating": 9}\n12\nnot json\n')
+
+    result = objecttier.add_reviews(dbConn, str(reviews))
+
+    assert (result.Num_Accepted, result.Num_Malformed) == (2, 4)
+    assert objecttier.num_reviews(dbConn) == before + 2
+
+
+def test_strings_are_not_pairs(connect):
+    dbConn = connect()
+    before = objecttier.num_reviews(dbConn)
+
+    result = objecttier.add_reviews(dbConn, ["18", b"18", (1, 8), objecttier.MALFORMED_REVIEW])
+
+    assert (result.Num_Accepted, result.Num_Malformed) == (1, 3)
+    assert objecttier.num_reviews(dbConn) == before + 1
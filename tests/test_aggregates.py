@@ -0,0 +1,78 @@
+#
+# test_aggregates.py
+# The maintained rating aggregates (aggregates.py), rebuilt with one
+# query or by several worker processes (parallel.py).
+#
+import sqlite3
+
+import pytest
+
+import aggregates
+import datatier
+import parallel
+
+
+def _stored(dbConn):
+    return datatier.select_n_rows(dbConn, """
+        SELECT Movie_ID, Num_Reviews, Sum_Rating, Sum_Squares, ROUND(Avg_Rating, 9)
+        FROM Movie_Rating_Stats ORDER BY Movie_ID""")
+
+
+def _computed(dbConn):
+    return datatier.select_n_rows(dbConn, """
+        SELECT Movie_ID, COUNT(Rating), SUM(Rating), SUM(Rating * Rating), ROUND(AVG(Rating), 9)
+        FROM Ratings WHERE Rating IS NOT NULL GROUP BY Movie_ID ORDER BY Movie_ID""")
+
+
+@pytest.fixture
+def stats_conn(connect):
+    # a page cache too small for the rebuild's writes: with a rollback
+    # journal they then lock out readers until the commit
+    dbConn = connect(pragmas = {"cache_size": 1})
+    assert aggregates.install_rating_stats(dbConn) > 0
+    # leave the aggregates wrong, for the rebuild to fix
+    datatier.perform_actions(dbConn, [("DROP TRIGGER Ratings_Stats_Insert", None)])
+    datatier.perform_action(dbConn, "INSERT INTO Ratings (Movie_ID, Rating) VALUES (3, 10)")
+    assert _stored(dbConn) != _computed(dbConn)
+    return dbConn
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_rebuild_recomputes_every_movie(stats_conn, workers):
+    assert aggregates.rebuild_rating_stats(stats_conn, workers) == len(_computed(stats_conn))
+    assert _stored(stats_conn) == _computed(stats_conn)
+
+
+def test_parallel_rebuild_does_not_lock_out_its_workers(stats_conn, monkeypatch):
+    aggregate_ratings = parallel.aggregate_ratings
+
+    def check_unlocked(dbName, workers):
+        assert not stats_conn.in_transaction, "the workers run while the rebuild holds a transaction"
+        return aggregate_ratings(dbName, workers)
+
+    monkeypatch.setattr(parallel, "aggregate_ratings", check_unlocked)
+    assert aggregates.rebuild_rating_stats(stats_conn, workers = 2) > 0
+    assert _stored(stats_conn) == _computed(stats_conn)
+
+
+def test_parallel_rebuild_sees_ratings_committed_while_it_runs(stats_conn, movie_db, monkeypatch):
+    aggregate_ratings = parallel.aggregate_ratings
+
+    def commit_meanwhile(dbName, workers):
+        stats = aggregate_ratings(dbName, workers)
+        other = sqlite3.connect(movie_db)
+        other.execute("INSERT INTO Ratings (Movie_ID, Rating) VALUES (4, 0)")
+        other.commit()
+        other.close()
+        return stats
+
+    monkeypatch.setattr(parallel, "aggregate_ratings", commit_meanwhile)
+    assert aggregates.rebuild_rating_stats(stats_conn, workers = 2) > 0
+    assert _stored(stats_conn) == _computed(stats_conn)
+
+
+def test_parallel_rebuild_inside_a_transaction_counts_its_writes(stats_conn):
+    with datatier.transaction(stats_conn):
+        datatier.perform_action(stats_conn, "INSERT INTO Ratings (Movie_ID, Rating) VALUES (5, 1)")
+        assert aggregates.rebuild_rating_stats(stats_conn, workers = 2) > 0
+    assert _stored(stats_conn) == _computed(stats_conn)
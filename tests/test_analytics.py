@@ -0,0 +1,55 @@
+#
+# test_analytics.py
+# Catalog-wide rating statistics (analytics.py).
+#
+import functools
+import runpy
+import sqlite3
+import sys
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import analytics
+import datatier
+
+
+@pytest.mark.parametrize("chunk_size", [7, 100000])
+def test_statistics_match_the_ratings_table(connect, chunk_size):
+    dbConn = connect()
+    stats = analytics.load_rating_analytics(dbConn, chunk_size)
+
+    expected = datatier.select_n_rows(dbConn, """
+        SELECT Movie_ID, COUNT(Rating), AVG(Rating) FROM Ratings
+        WHERE Rating IS NOT NULL GROUP BY Movie_ID ORDER BY Movie_ID""")
+    assert [int(movie_id) for movie_id in stats.movie_ids] == [row[0] for row in expected]
+    assert [int(count) for count in stats.num_reviews] == [row[1] for row in expected]
+    assert [round(float(average), 9) for average in stats.averages] == [round(row[2], 9) for row in expected]
+
+
+def test_a_failed_query_is_not_an_empty_catalog(connect, capsys):
+    dbConn = connect()
+    datatier.perform_actions(dbConn, [("ALTER TABLE Ratings RENAME TO Old_Ratings", None)])
+
+    assert analytics.load_rating_analytics(dbConn) is None
+    assert "load_rating_analytics failed" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("options, status", [([], 0), (["--movie", "5"], 0), (["--movie", "999999"], 1)])
+def test_command_line_closes_its_connection(movie_db, monkeypatch, capsys, options, status):
+    closed = []
+
+    class Connection(sqlite3.Connection):
+        def close(self):
+            closed.append(self)
+            super().close()
+
+    monkeypatch.setattr(sqlite3, "connect", functools.partial(sqlite3.connect, factory = Connection))
+    monkeypatch.setattr(sys, "argv", ["analytics.py", movie_db] + options)
+    with pytest.raises(SystemExit) as exit:
+        runpy.run_path(analytics.__file__, run_name = "__main__")
+    assert exit.value.code == status
+    assert len(closed) == 1
+    assert id(closed[0]) not in datatier._connection_info
+    assert id(closed[0]) not in getattr(datatier._cursors, "by_conn", {})
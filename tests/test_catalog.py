@@ -0,0 +1,54 @@
+#
+# test_catalog.py
+# objecttier.MovieCatalog, the base class of the in-memory catalogs
+# (columnar.py, memcatalog.py) the read functions accept in place of
+# a connection.
+#
+import pytest
+
+import objecttier
+
+
+class _Catalog(objecttier.MovieCatalog):
+    def __init__(self, movies):
+        self._movies = movies
+
+    def num_movies(self):
+        return len(self._movies)
+
+    def num_reviews(self):
+        return 0
+
+    def get_movies(self, pattern):
+        return [movie for movie in self._movies if pattern.strip("%") in movie.Title]
+
+    def get_movie_details(self, movie_id):
+        return None
+
+    def get_top_N_movies(self, N, min_num_reviews):
+        return []
+
+
+def test_a_subclass_missing_a_method_cannot_be_instantiated():
+    class Incomplete(objecttier.MovieCatalog):
+        def num_movies(self):
+            return 0
+
+    with pytest.raises(TypeError, match = "abstract"):
+        Incomplete()
+    with pytest.raises(TypeError):
+        objecttier.MovieCatalog()
+
+
+def test_read_functions_use_the_catalog():
+    catalog = _Catalog([objecttier.Movie(movie_id, title, "2000")
+                        for (movie_id, title) in enumerate(["Star", "Star Sea", "Moon", "Star Moon"], start = 1)])
+
+    assert objecttier.num_movies(catalog) == 4
+    assert [movie.Movie_ID for movie in objecttier.get_movies(catalog, "%Star%")] == [1, 2, 4]
+    assert objecttier.count_movies(catalog, "%Star%") == 3
+    (page, after) = objecttier.get_movies_page(catalog, "%Star%", 2)
+    assert ([movie.Movie_ID for movie in page], after) == ([1, 2], "2")
+    assert [movie.Movie_ID for movie in objecttier.get_movies_page(catalog, "%Star%", 2, after)[0]] == [4]
+    # the write functions fail on a catalog
+    assert objecttier.add_review(catalog, 1, 5) == 0
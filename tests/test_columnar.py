@@ -0,0 +1,68 @@
+#
+# test_columnar.py
+# Columnar catalog files (columnar.py) answer the objecttier read
+# functions exactly as the database they were exported from.
+#
+import subprocess
+import sys
+
+import pytest
+
+import aggregates
+import columnar
+import datatier
+import objecttier
+
+
+def _plain(value):
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, (objecttier.Movie, objecttier.MovieRating, objecttier.MovieDetails)):
+        return {name[1:]: getattr(value, name) for name in type(value).__slots__}
+    return value
+
+
+@pytest.fixture(params = [False, True], ids = ["ratings", "aggregates"])
+def exported(request, connect, tmp_path):
+    dbConn = connect()
+    if request.param:
+        assert aggregates.install_rating_stats(dbConn) > 0
+    filename = str(tmp_path / "catalog.mcol")
+    assert columnar.export_catalog(dbConn, filename) == objecttier.num_movies(dbConn)
+    catalog = columnar.load_catalog(filename)
+    yield (dbConn, catalog)
+    catalog.close()
+
+
+def test_catalog_answers_like_the_database(exported):
+    (dbConn, catalog) = exported
+    ids = [movie.Movie_ID for movie in objecttier.get_movies(dbConn, "%")]
+    calls = [("num_movies", ()), ("num_reviews", ())]
+    for pattern in ["%", "", "%a%", "the%", "%S", "_o%", "%e_", "%ghost%city%", "No Such Title"]:
+        calls += [("get_movies", (pattern,)), ("count_movies", (pattern,)), ("get_movies_page", (pattern, 9, None))]
+    calls += [("get_movie_details", (movie_id,)) for movie_id in ids[::7] + [0, -3, 10 ** 9, "abc", str(ids[3])]]
+    calls.append(("get_movie_details_many", (ids[::5] + [0],)))
+    calls += [("get_top_N_movies", (N, min_num_reviews)) for N in (1, 10, 100) for min_num_reviews in (0, 1, 5, 20)]
+
+    for (name, args) in calls:
+        function = getattr(objecttier, name)
+        assert _plain(function(catalog, *args)) == _plain(function(dbConn, *args)), (name, args)
+
+
+def test_export_fails_when_the_query_fails(connect, movie_db, tmp_path, capsys):
+    dbConn = connect()
+    datatier.perform_actions(dbConn, [("DROP TABLE Movie_Genres", None)])
+    filename = str(tmp_path / "catalog.mcol")
+
+    assert columnar.export_catalog(dbConn, filename) == -1
+    assert "export_catalog failed" in capsys.readouterr().out
+
+    command = [sys.executable, columnar.__file__, "export", movie_db, filename]
+    assert subprocess.run(command, capture_output = True).returncode != 0
+
+
+def test_load_rejects_other_files(tmp_path, capsys):
+    filename = tmp_path / "not-a-catalog"
+    filename.write_bytes(b"SQLite format 3\0" + bytes(100))
+    assert columnar.load_catalog(str(filename)) is None
+    assert "load_catalog failed" in capsys.readouterr().out
@@ -0,0 +1,82 @@
+#
+# test_counters.py
+# The row counters (counters.py) and the approximate counts of
+# num_movies / num_reviews (main.py --approximate-counts) agree with
+# COUNT(*) through add_review, add_reviews and rollbacks.
+#
+import pytest
+
+import counters
+import datatier
+import main
+import objecttier
+
+
+def _count(dbConn, table):
+    return datatier.select_one_row(dbConn, f"SELECT COUNT(*) FROM {table}")[0]
+
+
+def _assert_counts_match(dbConn):
+    for approximate in (False, True):
+        assert objecttier.num_movies(dbConn, approximate) == _count(dbConn, "Movies")
+        assert objecttier.num_reviews(dbConn, approximate) == _count(dbConn, "Ratings")
+
+
+# the writes to count: single reviews, a bulk import with rejected
+# rows, and writes that are rolled back
+def _write_and_roll_back(dbConn):
+    assert objecttier.add_review(dbConn, 3, 7) == 1
+    assert objecttier.add_review(dbConn, 999999, 7) == 0
+    _assert_counts_match(dbConn)
+
+    result = objecttier.add_reviews(dbConn, [(4, 1), (5, 2), (999999, 3), (6, 42)])
+    assert (result.Num_Accepted, result.Num_Rejected) == (2, 2)
+    _assert_counts_match(dbConn)
+
+    with pytest.raises(RuntimeError):
+        with datatier.transaction(dbConn):
+            assert objecttier.add_review(dbConn, 7, 8) == 1
+            assert objecttier.add_reviews(dbConn, [(8, 9), (9, 10)]).Num_Accepted == 2
+            _assert_counts_match(dbConn)
+            raise RuntimeError("roll back")
+    _assert_counts_match(dbConn)
+
+
+def test_counters_match_count_star(connect):
+    dbConn = connect()
+    assert counters.install_counters(dbConn) == len(counters.COUNTED_TABLES)
+    _assert_counts_match(dbConn)
+    _write_and_roll_back(dbConn)
+
+    # writes from outside the object tier are counted by the triggers
+    datatier.perform_action(dbConn, "DELETE FROM Ratings WHERE Movie_ID = 3")
+    _assert_counts_match(dbConn)
+
+
+def test_approximate_counts_without_counters(connect):
+    dbConn = connect()
+    assert not counters.has_counters(dbConn)
+    # the test database's IDs are consecutive and nothing is deleted,
+    # so the largest rowid is the exact count
+    _write_and_roll_back(dbConn)
+
+    # once analyzed, the estimate is the count at the time of ANALYZE
+    datatier.perform_action(dbConn, "ANALYZE")
+    analyzed = _count(dbConn, "Ratings")
+    assert objecttier.add_review(dbConn, 3, 7) == 1
+    assert objecttier.num_reviews(dbConn, True) == analyzed
+    assert objecttier.num_reviews(dbConn) == analyzed + 1
+
+
+@pytest.mark.parametrize("installed", [False, True])
+def test_command_one_with_approximate_counts(connect, monkeypatch, capsys, installed):
+    dbConn = connect()
+    if installed:
+        assert counters.install_counters(dbConn) == len(counters.COUNTED_TABLES)
+    assert objecttier.add_reviews(dbConn, [(10, 5), (11, 6)]).Num_Accepted == 2
+
+    main.command_one(dbConn)
+    exact = capsys.readouterr().out
+    monkeypatch.setattr(main, "APPROXIMATE_COUNTS", True)
+    main.command_one(dbConn)
+    assert capsys.readouterr().out == exact
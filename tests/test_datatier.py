@@ -0,0 +1,138 @@
+#
+# test_datatier.py
+# The data tier's query functions and transactions.
+#
+import sqlite3
+
+import pytest
+
+import datatier
+import objecttier
+
+
+def test_iter_rows_streams_every_row(connect):
+    dbConn = connect()
+    rows = list(datatier.iter_rows(dbConn, "SELECT Movie_ID FROM Movies ORDER BY Movie_ID", None, 7))
+    assert rows == datatier.select_n_rows(dbConn, "SELECT Movie_ID FROM Movies ORDER BY Movie_ID")
+
+
+def test_iter_rows_failure_is_visible_with_raise_errors(connect, capsys):
+    dbConn = connect()
+    sql = "SELECT * FROM No_Such_Table"
+
+    assert list(datatier.iter_rows(dbConn, sql)) == []
+    assert "iter_rows failed" in capsys.readouterr().out
+
+    with pytest.raises(sqlite3.Error):
+        list(datatier.iter_rows(dbConn, sql, raise_errors = True))
+    assert capsys.readouterr().out == ""
+
+
+def _insert_review(dbConn, movie_id):
+    return datatier.perform_action(dbConn, "INSERT INTO Ratings (Movie_ID, Rating) VALUES (?, 5)", [movie_id])
+
+
+def _count_reviews(dbConn):
+    return datatier.select_one_row(dbConn, "SELECT COUNT(*) FROM Ratings")[0]
+
+
+def test_nested_rollback_keeps_the_outer_writes(connect):
+    dbConn = connect()
+    before = _count_reviews(dbConn)
+    with datatier.transaction(dbConn):
+        _insert_review(dbConn, 1)
+        with pytest.raises(RuntimeError):
+            with datatier.transaction(dbConn):
+                _insert_review(dbConn, 2)
+                raise RuntimeError("roll back the inner block")
+    assert _count_reviews(dbConn) == before + 1
+
+
+def test_group_commit_counts_only_the_writes_committed(connect):
+    dbConn = connect()
+    before = _count_reviews(dbConn)
+    datatier.enable_group_commit(dbConn, max_writes = 100, max_delay_ms = 60000)
+
+    assert _insert_review(dbConn, 1) == 1
+    with pytest.raises(RuntimeError):
+        with datatier.transaction(dbConn):
+            _insert_review(dbConn, 2)
+            raise RuntimeError("roll back")
+    assert datatier.flush(dbConn) == 1
+
+    with datatier.transaction(dbConn):
+        _insert_review(dbConn, 3)
+        with pytest.raises(RuntimeError):
+            with datatier.transaction(dbConn):
+                _insert_review(dbConn, 4)
+                _insert_review(dbConn, 5)
+                raise RuntimeError("roll back the inner block")
+    assert datatier.disable_group_commit(dbConn) == 1
+
+    assert _count_reviews(dbConn) == before + 2
+
+
+def test_commit_and_rollback_callbacks(connect):
+    dbConn = connect()
+    called = []
+
+    with datatier.transaction(dbConn):
+        _insert_review(dbConn, 1)
+        datatier.on_commit(dbConn, lambda: called.append("commit 1"))
+        datatier.on_rollback(dbConn, lambda: called.append("rollback 1"))
+        with pytest.raises(RuntimeError):
+            with datatier.transaction(dbConn):
+                _insert_review(dbConn, 2)
+                datatier.on_commit(dbConn, lambda: called.append("commit 2"))
+                datatier.on_rollback(dbConn, lambda: called.append("rollback 2"))
+                raise RuntimeError("roll back the inner block")
+        assert called == ["rollback 2"]
+    assert called == ["rollback 2", "commit 1"]
+
+    with pytest.raises(RuntimeError):
+        with datatier.transaction(dbConn):
+            _insert_review(dbConn, 3)
+            datatier.on_commit(dbConn, lambda: called.append("commit 3"))
+            datatier.on_rollback(dbConn, lambda: called.append("rollback 3"))
+            raise RuntimeError("roll back")
+    assert called == ["rollback 2", "commit 1", "rollback 3"]
+
+
+def test_rollback_keeps_the_callbacks_of_an_earlier_block_at_the_same_depth(connect):
+    (dbConn, reader) = (connect(), connect())
+    objecttier.enable_details_cache()
+
+    with datatier.transaction(dbConn):
+        with datatier.transaction(dbConn):
+            assert objecttier.add_review(dbConn, 9, 4) == 1
+        with pytest.raises(RuntimeError):
+            with datatier.transaction(dbConn):
+                assert objecttier.add_review(dbConn, 10, 4) == 1
+                raise RuntimeError("roll back the second inner block")
+        # another connection caches the details without the review
+        # (not committed yet): the commit must invalidate them
+        objecttier.get_movie_details(reader, 9)
+
+    cached = objecttier.get_movie_details(dbConn, 9)
+    objecttier.disable_details_cache()
+    fresh = objecttier.get_movie_details(dbConn, 9)
+    assert (cached.Num_Reviews, cached.Avg_Rating) == (fresh.Num_Reviews, fresh.Avg_Rating)
+
+
+def test_rollback_runs_only_the_callbacks_of_the_undone_block(connect):
+    dbConn = connect()
+    called = []
+
+    with datatier.transaction(dbConn):
+        with datatier.transaction(dbConn):
+            _insert_review(dbConn, 1)
+            datatier.on_commit(dbConn, lambda: called.append("commit 1"))
+            datatier.on_rollback(dbConn, lambda: called.append("rollback 1"))
+        with pytest.raises(RuntimeError):
+            with datatier.transaction(dbConn):
+                _insert_review(dbConn, 2)
+                datatier.on_commit(dbConn, lambda: called.append("commit 2"))
+                datatier.on_rollback(dbConn, lambda: called.append("rollback 2"))
+                raise RuntimeError("roll back the second inner block")
+        assert called == ["rollback 2"]
+    assert called == ["rollback 2", "commit 1"]
@@ -0,0 +1,88 @@
+#
+# test_details_cache.py
+# The MovieDetails cache (objecttier.enable_details_cache) never
+# serves details that differ from what the database holds.
+#
+import pytest
+
+import datatier
+import objecttier
+from cache import LRUCache, MISSING
+
+
+def _fields(details):
+    return (details.Movie_ID, details.Num_Reviews, details.Avg_Rating, details.Tagline,
+            details.Genres, details.Production_Companies)
+
+
+# the details as the database has them, bypassing the cache
+def _fresh(dbConn, movie_id):
+    objecttier.disable_details_cache()
+    try:
+        return _fields(objecttier.get_movie_details(dbConn, movie_id))
+    finally:
+        objecttier.enable_details_cache()
+
+
+@pytest.fixture
+def cached(connect):
+    dbConn = connect()
+    objecttier.enable_details_cache()
+    return dbConn
+
+
+def test_writes_update_cached_details(cached):
+    objecttier.get_movie_details(cached, 5)
+    objecttier.get_movie_details(cached, 6)
+
+    assert objecttier.add_review(cached, 5, 10) == 1
+    assert _fields(objecttier.get_movie_details(cached, 5)) == _fresh(cached, 5)
+
+    assert objecttier.add_reviews(cached, [(5, 0), (6, 3)]).Num_Accepted == 2
+    assert _fields(objecttier.get_movie_details(cached, 5)) == _fresh(cached, 5)
+    assert _fields(objecttier.get_movie_details(cached, 6)) == _fresh(cached, 6)
+
+    assert objecttier.set_tagline(cached, 6, "A new tagline") == 1
+    assert objecttier.get_movie_details(cached, 6).Tagline == "A new tagline"
+
+
+def test_details_read_in_a_transaction_are_not_kept_after_rollback(cached):
+    before = _fields(objecttier.get_movie_details(cached, 7))
+
+    with pytest.raises(RuntimeError):
+        with datatier.transaction(cached):
+            objecttier.add_review(cached, 7, 1)
+            # sees (and may cache) the uncommitted review
+            objecttier.get_movie_details(cached, 7)
+            raise RuntimeError("roll back")
+
+    assert _fields(objecttier.get_movie_details(cached, 7)) == before
+
+
+def test_details_read_in_a_transaction_are_current_after_commit(cached):
+    with datatier.transaction(cached):
+        objecttier.add_review(cached, 8, 2)
+        objecttier.get_movie_details(cached, 8)
+
+    assert _fields(objecttier.get_movie_details(cached, 8)) == _fresh(cached, 8)
+
+
+def test_lru_eviction_and_ttl():
+    now = [0.0]
+    cache = LRUCache(2, ttl = 10, clock = lambda: now[0])
+    for key in "abc":
+        cache.put(key, key.upper(), cache.token())
+    assert cache.get("a") is MISSING
+    assert cache.get("c") == "C"
+
+    now[0] = 11.0
+    assert cache.get("c") is MISSING
+    assert (cache.evictions, cache.expirations) == (1, 1)
+
+
+def test_put_after_invalidation_is_dropped():
+    cache = LRUCache(4)
+    token = cache.token()
+    cache.invalidate("a")
+    cache.put("a", "stale", token)
+    assert cache.get("a") is MISSING
@@ -0,0 +1,91 @@
+#
+# test_leaderboard.py
+# Materialized top-N leaderboards (leaderboard.py, and
+# objecttier.enable_leaderboards) give the same rankings as a fresh
+# query while reviews are added.
+#
+import random
+import shutil
+
+import pytest
+
+import aggregates
+import datatier
+import objecttier
+from leaderboard import Leaderboard
+
+
+class _Entry:
+    def __init__(self, Movie_ID, Num_Reviews, Avg_Rating):
+        self.Movie_ID = Movie_ID
+        self.Num_Reviews = Num_Reviews
+        self.Avg_Rating = Avg_Rating
+
+
+def _ids(entries):
+    return [entry.Movie_ID for entry in entries]
+
+
+def test_load_sorts_entries_into_rank_order():
+    board = Leaderboard(3, 1, headroom = 1)
+    # out of order, ties in descending Movie_ID order
+    board.load([_Entry(4, 5, 7.0), _Entry(3, 5, 8.0), _Entry(2, 5, 8.0), _Entry(1, 5, 8.0)], 0.0)
+    assert _ids(board.top(3)) == [1, 2, 3]
+
+    board.update(_Entry(2, 6, 7.5))
+    assert _ids(board.top(3)) == [1, 3, 2]
+
+
+def _key(movie):
+    return (movie.Movie_ID, movie.Num_Reviews, round(movie.Avg_Rating, 9))
+
+
+# the ranking as a query computes it, bypassing the leaderboards
+def _fresh(monkeypatch, dbConn, N, min_num_reviews):
+    with monkeypatch.context() as patch:
+        patch.setattr(objecttier, "_leaderboards", None)
+        return [_key(movie) for movie in objecttier.get_top_N_movies(dbConn, N, min_num_reviews)]
+
+
+@pytest.mark.parametrize("with_stats", [False, True])
+def test_boards_match_a_fresh_query_after_reviews(connect, movie_db, tmp_path, monkeypatch, with_stats):
+    path = str(tmp_path / "board.db")
+    shutil.copyfile(movie_db, path)
+    dbConn = connect(path)
+    if with_stats:
+        assert aggregates.install_rating_stats(dbConn) > 0
+    boards = [(10, 1), (10, 3), (25, 1)]
+    objecttier.enable_leaderboards(boards, headroom = 5)
+
+    rand = random.Random(7)
+    # reviews for the movies near the top (many of them tied) as well as random ones
+    near_top = [movie.Movie_ID for movie in objecttier.get_top_N_movies(dbConn, 40, 1)]
+    for step in range(60):
+        for (N, min_num_reviews) in boards:
+            found = [_key(movie) for movie in objecttier.get_top_N_movies(dbConn, N, min_num_reviews)]
+            assert found == _fresh(monkeypatch, dbConn, N, min_num_reviews), (step, N, min_num_reviews)
+        movie_id = rand.choice(near_top) if step % 2 else rand.randint(1, 400)
+        assert objecttier.add_review(dbConn, movie_id, rand.choice([0, 5, 10, rand.randint(0, 10)])) == 1
+
+    assert objecttier.leaderboard_stats()["hits"] > 0
+
+
+def test_boards_drop_ratings_that_are_rolled_back(connect, monkeypatch):
+    dbConn = connect()
+    objecttier.enable_leaderboards([(10, 1)], headroom = 5)
+    objecttier.get_top_N_movies(dbConn, 10, 1)
+    low = objecttier.get_top_N_movies(dbConn, 10, 1)[-1].Movie_ID
+
+    with pytest.raises(RuntimeError):
+        with datatier.transaction(dbConn):
+            for _ in range(20):
+                objecttier.add_review(dbConn, low, 10)
+            # the board is reloaded while the reviews are uncommitted
+            objecttier.disable_leaderboards()
+            objecttier.enable_leaderboards([(10, 1)], headroom = 5)
+            objecttier.get_top_N_movies(dbConn, 10, 1)
+            objecttier.add_review(dbConn, low, 10)
+            raise RuntimeError("roll back")
+
+    found = [_key(movie) for movie in objecttier.get_top_N_movies(dbConn, 10, 1)]
+    assert found == _fresh(monkeypatch, dbConn, 10, 1)
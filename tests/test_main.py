@@ -0,0 +1,99 @@
+#
+# test_main.py
+# main.py's batch mode prints exactly what interactive mode prints
+# for the same commands.
+#
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import datatier
+import main
+
+
+_MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+# commands with their answers, including bad input and writes that
+# later commands read back
+_COMMANDS = [
+    ["1"],
+    ["2", "%a%"],
+    ["2", "zzzz%"],
+    ["3", "5"],
+    ["3", "123456"],
+    ["4", "10", "1"],
+    ["4", "0"],
+    ["4", "5", "-1"],
+    ["5", "7", "5"],
+    ["5", "11"],
+    ["5", "3", "123456"],
+    ["6", "A tagline from the test", "5"],
+    ["3", "5"],
+    ["9"],
+    ["1"],
+]
+
+
+def _run(args, stdin):
+    return subprocess.run([sys.executable, _MAIN] + args, input = stdin, capture_output = True,
+                          encoding = "utf-8", timeout = 60)
+
+
+# the output of each command in an interactive session: what follows
+# the answer to "Your choice --> ", up to the next menu
+def _interactive_outputs(stdout):
+    chunks = stdout.split("Your choice --> \n")[1:]
+    outputs = [chunk.split("\nSelect a menu option: ")[0] for chunk in chunks[:-1]]
+    assert chunks[-1].startswith("Exiting program.")
+    return outputs
+
+
+def _interactive(dbName, commands):
+    answers = [dbName] + [answer for command in commands for answer in command] + ["x"]
+    done = _run([], "\n".join(answers) + "\n")
+    assert done.returncode == 0, done.stderr
+    outputs = _interactive_outputs(done.stdout)
+    assert len(outputs) == len(commands)
+    return "".join(outputs)
+
+
+def _batch(dbName, commands, script, options = ()):
+    script.write_text("".join(json.dumps({"command": command[0], "args": command[1:]}) + "\n"
+                              for command in commands), encoding = "utf-8")
+    done = _run([dbName, "--batch", str(script)] + list(options), "")
+    # bad input and unknown commands are not failures: they print
+    # their messages, as in interactive mode
+    assert done.returncode == 0, done.stderr
+    return done.stdout
+
+
+def test_batch_output_matches_interactive(movie_db, tmp_path):
+    batch_db = str(tmp_path / "batch.db")
+    shutil.copyfile(movie_db, batch_db)
+
+    expected = _interactive(movie_db, _COMMANDS)
+    assert _batch(batch_db, _COMMANDS, tmp_path / "session.jsonl") == expected
+
+
+def test_parallel_batch_output_matches_interactive(movie_db, tmp_path):
+    queries = [command for command in _COMMANDS if command[0] in "1234"]
+    expected = _interactive(movie_db, queries)
+    assert _batch(movie_db, queries, tmp_path / "queries.jsonl", ["--workers", "2", "--read-only"]) == expected
+
+
+def test_run_batch_forgets_its_connection(movie_db, tmp_path, monkeypatch, capsys):
+    opened = []
+    open_database = main.open_database
+
+    def tracked(dbName, open_mode = "rw"):
+        dbConn = open_database(dbName, open_mode)
+        datatier.connection_info(dbConn)["test"] = True
+        opened.append(id(dbConn))
+        return dbConn
+
+    monkeypatch.setattr(main, "open_database", tracked)
+    assert main.run_batch(movie_db, [(1, "1", [])]) == 0
+    assert "Number of Movies" in capsys.readouterr().out
+    assert opened and opened[0] not in datatier._connection_info
@@ -0,0 +1,77 @@
+#
+# test_memcatalog.py
+# In-memory catalogs (memcatalog.py, and the columnar files of
+# columnar.py) answer the objecttier read functions exactly as the
+# database they were loaded from (see memcatalog.check_parity).
+#
+import random
+
+import pytest
+
+import aggregates
+import columnar
+import datatier
+import memcatalog
+import objecttier
+
+
+# titles that exercise LIKE's rules: % and _ inside titles, case
+# folding of ASCII letters only, and repeated substrings
+_TITLES = ["Amélie", "AMÉLIE", "École", "ÉCOLE", "100% Love", "a_b", "aXb", "Star Wars",
+           "star wars: the star", "Ärger", "ärger", "Nana Nana Na", "Ba", "b"]
+
+
+@pytest.fixture(params = [False, True], ids = ["ratings", "aggregates"])
+def dbConn(request, connect):
+    dbConn = connect()
+    datatier.perform_many(dbConn, "INSERT INTO Movies (Movie_ID, Title, Release_Date) VALUES (?, ?, ?)",
+                          [[(1000 + i, title, "2001-02-03") for (i, title) in enumerate(_TITLES)]])
+    datatier.perform_many(dbConn, "INSERT INTO Ratings (Movie_ID, Rating) VALUES (?, ?)",
+                          [[(1000 + i, i % 11) for i in range(len(_TITLES))]])
+    if request.param:
+        assert aggregates.install_rating_stats(dbConn) > 0
+    return dbConn
+
+
+@pytest.fixture(params = ["memory", "columnar"])
+def catalog(request, dbConn, tmp_path):
+    if request.param == "memory":
+        yield memcatalog.load_catalog(dbConn)
+    else:
+        filename = str(tmp_path / "catalog.mcol")
+        assert columnar.export_catalog(dbConn, filename) > 0
+        catalog = columnar.load_catalog(filename)
+        yield catalog
+        catalog.close()
+
+
+def test_catalog_matches_the_database(dbConn, catalog):
+    random.seed(341)
+    (checked, differences) = memcatalog.check_parity(dbConn, catalog, samples = 200)
+    assert checked > 500
+    assert differences == 0
+
+
+@pytest.mark.parametrize("pattern", [
+    "amélie", "AMÉLIE", "%é%", "%É%", "école", "%100%%", "100_%", "a_b", "a%b", "%_", "_",
+    "__", "b", "%star%", "star%star", "%wars%", "% %", "ärger", "%NA%NA%", "nana%na", "%na na%",
+    "", "%", "%%%", "xyz%"])
+def test_patterns_match_like(dbConn, catalog, pattern):
+    expected = [movie.Movie_ID for movie in objecttier.get_movies(dbConn, pattern)]
+    assert [movie.Movie_ID for movie in objecttier.get_movies(catalog, pattern)] == expected
+
+
+def test_load_fails_when_the_query_fails(connect, capsys):
+    dbConn = connect()
+    datatier.perform_actions(dbConn, [("DROP TABLE Movie_Genres", None)])
+    assert memcatalog.load_catalog(dbConn) is None
+    assert "load_catalog failed" in capsys.readouterr().out
+
+
+def test_catalog_is_a_copy(connect):
+    dbConn = connect()
+    catalog = memcatalog.load_catalog(dbConn)
+    before = objecttier.get_movie_details(catalog, 1).Num_Reviews
+    assert objecttier.add_review(dbConn, 1, 7) == 1
+    assert objecttier.get_movie_details(catalog, 1).Num_Reviews == before
+    assert memcatalog.load_catalog(dbConn).get_movie_details(1).Num_Reviews == before + 1
@@ -0,0 +1,40 @@
+#
+# test_parallel.py
+# The parallel aggregation of the Ratings table (parallel.py).
+#
+import pytest
+
+import datatier
+import parallel
+
+
+_stats_sql = """
+    SELECT Movie_ID, COUNT(Rating), SUM(Rating), SUM(Rating * Rating) FROM Ratings
+    WHERE Rating IS NOT NULL GROUP BY Movie_ID ORDER BY Movie_ID
+"""
+
+
+@pytest.mark.parametrize("split", ["movie", "rowid"])
+def test_aggregates_match_one_query(connect, movie_db, split):
+    dbConn = connect()
+    expected = [tuple(row) for row in datatier.select_n_rows(dbConn, _stats_sql)]
+    found = parallel.aggregate_ratings(movie_db, workers = 1, num_ranges = 7, split = split)
+    assert [tuple(row) for row in found] == expected
+
+
+def test_connections_are_forgotten_when_closed(movie_db, monkeypatch):
+    opened = []
+    connect = datatier.connect
+
+    def tracked(*args, **options):
+        dbConn = connect(*args, **options)
+        opened.append(dbConn)
+        return dbConn
+
+    monkeypatch.setattr(datatier, "connect", tracked)
+    assert parallel.aggregate_ratings(movie_db, workers = 1, num_ranges = 3)
+    assert opened
+    cursors = getattr(datatier._cursors, "by_conn", {})
+    for dbConn in opened:
+        assert id(dbConn) not in datatier._connection_info
+        assert id(dbConn) not in cursors
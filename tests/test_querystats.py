@@ -0,0 +1,46 @@
+#
+# test_querystats.py
+# The query statistics collector and slow-query log (querystats.py).
+#
+import io
+import logging
+import threading
+
+import querystats
+
+
+def test_dump_while_a_query_is_being_counted(monkeypatch):
+    # what main.py's SIGUSR1 handler does when the signal arrives
+    # while this thread is inside QueryStats.__call__
+    stats = querystats.QueryStats()
+    stats(None, "SELECT 1", [], 0.001, 1, None)
+    monkeypatch.setattr(querystats, "_stats", stats)
+    out = io.StringIO()
+
+    def dump_in_the_middle():
+        with stats._lock:
+            querystats.dump("text", out)
+
+    worker = threading.Thread(target = dump_in_the_middle, daemon = True)
+    worker.start()
+    worker.join(5)
+    assert not worker.is_alive(), "dump deadlocked"
+    assert "SELECT 1" in out.getvalue()
+
+
+def test_slow_query_count_is_exact_across_threads():
+    logger = logging.getLogger("test_querystats.slow")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    log = querystats.SlowQueryLog(0, logger, explain = False)
+
+    def log_queries():
+        for _ in range(2000):
+            log(None, "SELECT 1", [], 0.001, 1, None)
+
+    threads = [threading.Thread(target = log_queries) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert log.count == 8 * 2000
@@ -0,0 +1,130 @@
+#
+# test_reviewqueue.py
+# The write-behind review queue (reviewqueue.py): queued reviews are
+# written by flush and close, a journal is replayed after a crash
+# without writing any review twice, and closing while a batch is
+# being written leaves the writer its database.
+#
+import sqlite3
+import threading
+
+import pytest
+
+import datatier
+from reviewqueue import ReviewQueue
+
+
+def _count_reviews(dbConn, movie_id = None):
+    if movie_id is None:
+        return datatier.select_one_row(dbConn, "SELECT COUNT(*) FROM Ratings")[0]
+    return datatier.select_one_row(dbConn, "SELECT COUNT(*) FROM Ratings WHERE Movie_ID = ?", [movie_id])[0]
+
+
+@pytest.fixture
+def queues(movie_db):
+    opened = []
+
+    def open_queue(**options):
+        # reviews wait for a flush unless a test asks otherwise
+        options.setdefault("max_delay_ms", 60000)
+        queue = ReviewQueue(movie_db, **options)
+        opened.append(queue)
+        return queue
+
+    yield open_queue
+
+    for queue in opened:
+        queue.close(5)
+
+
+def test_queued_reviews_are_written_by_flush(connect, queues):
+    dbConn = connect()
+    before = _count_reviews(dbConn)
+    queue = queues()
+
+    assert [queue.add_review(5, rating) for rating in (3, 7, 10)] == [1, 1, 1]
+    assert queue.add_review(5, 11) == 0
+    assert queue.add_review(999999, 5) == 0
+    assert queue.pending() == 3
+    assert _count_reviews(dbConn) == before
+    assert queue.num_reviews(include_pending = True) == before + 3
+
+    assert queue.flush(5)
+    assert queue.pending() == 0
+    assert _count_reviews(dbConn) == before + 3
+    assert queue.num_reviews() == before + 3
+    assert queue.stats()["written"] == 3
+
+
+def test_close_writes_what_is_queued(connect, queues):
+    dbConn = connect()
+    before = _count_reviews(dbConn)
+    queue = queues()
+    for rating in range(5):
+        assert queue.add_review(6, rating) == 1
+
+    assert queue.close(5) is True
+    assert _count_reviews(dbConn) == before + 5
+    assert queue.add_review(6, 5) == -1
+
+
+def test_journal_is_replayed_after_a_crash(connect, queues, tmp_path):
+    dbConn = connect()
+    journal = str(tmp_path / "reviews.journal")
+    before = _count_reviews(dbConn, 7)
+
+    queue = queues(journal = journal)
+    assert queue.add_review(7, 4) == 1
+    assert queue.flush(5)
+    # the next reviews are journaled but never reach the database
+    queue._write = lambda batch: None
+    assert queue.add_review(7, 5) == 1
+    assert queue.add_review(7, 6) == 1
+    assert queue.close(5) is True
+    assert _count_reviews(dbConn, 7) == before + 1
+    # the crash cut the last line short
+    with open(journal, "a", encoding = "utf-8") as outfile:
+        outfile.write("[4, 7,")
+
+    replayed = queues(journal = journal)
+    assert replayed.pending() == 2
+    assert replayed.flush(5)
+    assert _count_reviews(dbConn, 7) == before + 3
+
+    # written entries are not replayed again
+    again = queues(journal = journal)
+    assert again.pending() == 0
+    assert _count_reviews(dbConn, 7) == before + 3
+
+
+def test_close_during_a_flush_leaves_the_writer_its_database(connect, queues):
+    dbConn = connect()
+    before = _count_reviews(dbConn)
+    queue = queues()
+
+    writing = threading.Event()
+    release = threading.Event()
+    write = queue._write
+
+    def slow_write(batch):
+        writing.set()
+        release.wait(5)
+        return write(batch)
+
+    queue._write = slow_write
+    assert queue.add_review(8, 9) == 1
+    flushed = threading.Thread(target = queue.flush, args = [5])
+    flushed.start()
+    assert writing.wait(5)
+
+    assert queue.close(0.05) is False
+    release.set()
+    flushed.join(5)
+    queue._thread.join(5)
+    assert not queue._thread.is_alive()
+    assert queue.stats()["written"] == 1
+    assert _count_reviews(dbConn) == before + 1
+    # the writer closed the pool once it was done with it
+    with pytest.raises(sqlite3.ProgrammingError):
+        with queue.pool.writer():
+            pass
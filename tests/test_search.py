@@ -0,0 +1,128 @@
+#
+# test_search.py
+# The full-text title index (search.py) and objecttier.search_movies:
+# the index stays in sync with Movies, and the token, prefix and
+# ranked modes and the limit find what they should.
+#
+import re
+import unicodedata
+
+import pytest
+
+import datatier
+import objecttier
+import search
+
+
+# the words of a title as FTS5's unicode61 tokenizer sees them
+def _words(title):
+    folded = "".join(ch for ch in unicodedata.normalize("NFKD", title.lower()) if not unicodedata.combining(ch))
+    return re.findall(r"\w+", folded)
+
+
+# the IDs search_movies should find, by reading every title
+def _expected(dbConn, text, prefix):
+    wanted = _words(text)
+    found = []
+    for (movie_id, title) in datatier.select_n_rows(dbConn, "SELECT Movie_ID, Title FROM Movies ORDER BY Movie_ID"):
+        words = _words(title or "")
+        if prefix:
+            ok = all(any(word.startswith(w) for word in words) for w in wanted)
+        else:
+            ok = all(w in words for w in wanted)
+        if ok:
+            found.append(movie_id)
+    return found
+
+
+def _ids(movies):
+    return [movie.Movie_ID for movie in movies]
+
+
+def _assert_in_sync(dbConn):
+    # with rank 1, checks the index against its content table, Movies
+    assert datatier.perform_action(dbConn,
+        "INSERT INTO Movies_Title_FTS (Movies_Title_FTS, rank) VALUES ('integrity-check', 1)") != -1
+
+
+@pytest.fixture
+def indexed(connect):
+    dbConn = connect()
+    assert search.install_title_index(dbConn) == objecttier.num_movies(dbConn)
+    return dbConn
+
+
+@pytest.mark.parametrize("text", ["star", "Blue Moon", "cafe", "CAFÉ sky", "the", "knight's", "nothing"])
+def test_token_mode_finds_whole_words(indexed, text):
+    assert _ids(objecttier.search_movies(indexed, text)) == _expected(indexed, text, prefix = False)
+
+
+@pytest.mark.parametrize("text", ["st", "bl mo", "caf", "kni", "s"])
+def test_prefix_mode_finds_word_beginnings(indexed, text):
+    assert _ids(objecttier.search_movies(indexed, text, "prefix")) == _expected(indexed, text, prefix = True)
+
+
+def test_ranked_mode_finds_any_word(indexed):
+    found = _ids(objecttier.search_movies(indexed, "blue moon", "ranked"))
+    expected = set(_expected(indexed, "blue", prefix = True)) | set(_expected(indexed, "moon", prefix = True))
+    assert sorted(found) == sorted(expected)
+    # titles with both words rank ahead of the others
+    both = set(_expected(indexed, "blue moon", prefix = True))
+    assert set(found[:len(both)]) == both
+
+
+@pytest.mark.parametrize("mode", ["token", "prefix", "ranked", "like"])
+def test_limit_cuts_the_results(indexed, mode):
+    everything = _ids(objecttier.search_movies(indexed, "sea", mode))
+    assert len(everything) > 5
+    assert _ids(objecttier.search_movies(indexed, "sea", mode, limit = 5)) == everything[:5]
+    assert objecttier.search_movies(indexed, "sea", mode, limit = 0) == []
+
+
+def test_operators_in_the_text_are_words(indexed):
+    assert objecttier.search_movies(indexed, "") == []
+    assert objecttier.search_movies(indexed, "*") == []
+    assert _ids(objecttier.search_movies(indexed, 'star OR "moon')) == _expected(indexed, "star or moon", prefix = False)
+
+
+def test_index_follows_inserts_updates_and_deletes(indexed):
+    assert datatier.perform_action(indexed, "INSERT INTO Movies (Movie_ID, Title) VALUES (5001, 'Zebra Crossing')") == 1
+    assert _ids(objecttier.search_movies(indexed, "zebra")) == [5001]
+
+    assert datatier.perform_action(indexed, "UPDATE Movies SET Title = 'Okapi Crossing' WHERE Movie_ID = 5001") == 1
+    assert objecttier.search_movies(indexed, "zebra") == []
+    assert _ids(objecttier.search_movies(indexed, "okapi")) == [5001]
+
+    # taglines are not titles: setting one leaves the index as it was
+    assert objecttier.set_tagline(indexed, 5001, "Zebra tagline") == 1
+    assert objecttier.search_movies(indexed, "tagline") == []
+    _assert_in_sync(indexed)
+
+    assert datatier.perform_action(indexed, "DELETE FROM Movies WHERE Movie_ID = 5001") == 1
+    assert objecttier.search_movies(indexed, "okapi") == []
+    _assert_in_sync(indexed)
+
+    # rolled-back inserts leave no trace in the index either
+    with pytest.raises(RuntimeError):
+        with datatier.transaction(indexed):
+            datatier.perform_action(indexed, "INSERT INTO Movies (Movie_ID, Title) VALUES (5002, 'Gnu')")
+            assert _ids(objecttier.search_movies(indexed, "gnu")) == [5002]
+            raise RuntimeError("roll back")
+    assert objecttier.search_movies(indexed, "gnu") == []
+    _assert_in_sync(indexed)
+
+
+def test_rebuild_after_loading_without_triggers(indexed):
+    datatier.perform_action(indexed, "DROP TRIGGER Movies_Title_FTS_Insert")
+    datatier.perform_action(indexed, "INSERT INTO Movies (Movie_ID, Title) VALUES (5003, 'Quokka')")
+    assert objecttier.search_movies(indexed, "quokka") == []
+
+    assert search.rebuild_title_index(indexed) == objecttier.num_movies(indexed)
+    assert _ids(objecttier.search_movies(indexed, "quokka")) == [5003]
+    _assert_in_sync(indexed)
+
+
+def test_without_the_index_searches_like_get_movies(connect):
+    dbConn = connect()
+    assert not search.has_title_index(dbConn)
+    assert _ids(objecttier.search_movies(dbConn, "sea")) == _ids(objecttier.get_movies(dbConn, "%sea%"))
@@ -0,0 +1,71 @@
+#
+# test_snapshot.py
+# The denormalized details snapshot (snapshot.py): its rows stay as
+# they were built while later writes only log the movies they
+# change, get_movie_details answers with the current details
+# meanwhile, and read-only / immutable connections read the
+# snapshot but cannot write to it.
+#
+import shutil
+
+import pytest
+
+import datatier
+import objecttier
+import snapshot
+
+
+_row_sql = "SELECT * FROM Movie_Detail_Snapshot WHERE Movie_ID = ?"
+
+
+def _fields(details):
+    return (details.Movie_ID, details.Title, details.Release_Date, details.Num_Reviews,
+            details.Avg_Rating, details.Tagline, details.Genres, details.Production_Companies)
+
+
+@pytest.fixture
+def snapshot_db(connect, movie_db, tmp_path):
+    # the same data without the snapshot, to compare with
+    plain = str(tmp_path / "plain.db")
+    shutil.copyfile(movie_db, plain)
+    dbConn = connect()
+    assert snapshot.install_snapshot(dbConn) == objecttier.num_movies(dbConn)
+    return (dbConn, connect(plain))
+
+
+def test_snapshot_is_unchanged_by_later_writes(snapshot_db):
+    (dbConn, plain) = snapshot_db
+    before = datatier.select_one_row(dbConn, _row_sql, [11])
+    assert snapshot.pending_changes(dbConn) == 0
+
+    for conn in (dbConn, plain):
+        assert objecttier.add_review(conn, 11, 9) == 1
+        assert objecttier.set_tagline(conn, 11, "Changed after the snapshot") == 1
+
+    assert datatier.select_one_row(dbConn, _row_sql, [11]) == before
+    assert snapshot.pending_changes(dbConn) == 1
+    # the movie is read with the details query until it is refreshed
+    assert _fields(objecttier.get_movie_details(dbConn, 11)) == _fields(objecttier.get_movie_details(plain, 11))
+
+    assert snapshot.refresh_snapshot(dbConn) == 1
+    assert snapshot.pending_changes(dbConn) == 0
+    assert datatier.select_one_row(dbConn, _row_sql, [11]) != before
+    assert _fields(objecttier.get_movie_details(dbConn, 11)) == _fields(objecttier.get_movie_details(plain, 11))
+
+
+@pytest.mark.parametrize("immutable", [False, True])
+def test_read_only_connections_read_the_snapshot_and_reject_writes(snapshot_db, connect, movie_db, immutable, capsys):
+    (dbConn, plain) = snapshot_db
+    reader = connect(movie_db, read_only = True, immutable = immutable)
+    row = datatier.select_one_row(dbConn, _row_sql, [12])
+
+    assert snapshot.has_snapshot(reader)
+    assert _fields(objecttier.get_movie_details(reader, 12)) == _fields(objecttier.get_movie_details(plain, 12))
+
+    assert objecttier.add_review(reader, 12, 5) == 0
+    assert objecttier.set_tagline(reader, 12, "Not written") == 0
+    assert snapshot.rebuild_snapshot(reader) == -1
+    assert "attempt to write a readonly database" in capsys.readouterr().out
+
+    assert datatier.select_one_row(dbConn, _row_sql, [12]) == row
+    assert snapshot.pending_changes(dbConn) == 0
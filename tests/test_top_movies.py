@@ -0,0 +1,51 @@
+#
+# test_top_movies.py
+# get_top_N_movies ranks the same way whether or not the rating
+# aggregates (aggregates.py) are installed, ties included.
+#
+import shutil
+
+import aggregates
+import datatier
+import objecttier
+
+
+def _key(movie):
+    return (movie.Movie_ID, movie.Title, movie.Release_Year, movie.Num_Reviews, round(movie.Avg_Rating, 9))
+
+
+def test_ties_are_ordered_by_movie_id_ascending(connect):
+    dbConn = connect()
+    top = objecttier.get_top_N_movies(dbConn, 400, 1)
+    assert len({movie.Avg_Rating for movie in top}) < len(top), "the test database has no ties"
+    ranks = [(-movie.Avg_Rating, movie.Movie_ID) for movie in top]
+    assert ranks == sorted(ranks)
+
+
+def test_aggregates_rank_without_sorting(connect):
+    dbConn = connect()
+    # an index left by an earlier install is replaced
+    datatier.perform_action(dbConn, "CREATE TABLE Movie_Rating_Stats (Movie_ID INTEGER PRIMARY KEY, "
+                            "Num_Reviews INTEGER, Sum_Rating NUMERIC, Sum_Squares NUMERIC, Avg_Rating REAL)")
+    datatier.perform_action(dbConn, "CREATE INDEX Movie_Rating_Stats_By_Avg "
+                            "ON Movie_Rating_Stats (Avg_Rating DESC, Movie_ID DESC)")
+    assert aggregates.install_rating_stats(dbConn) > 0
+
+    sql = "EXPLAIN QUERY PLAN " + objecttier._top_movies_stats_sql
+    plan = " ".join(row[-1] for row in datatier.select_n_rows(dbConn, sql, [1, 10]))
+    assert "Movie_Rating_Stats_By_Rank" in plan
+    assert "TEMP B-TREE" not in plan
+    assert not datatier.select_n_rows(dbConn, "SELECT name FROM sqlite_master WHERE name = 'Movie_Rating_Stats_By_Avg'")
+
+
+def test_aggregates_rank_like_the_ratings_table(connect, movie_db, tmp_path):
+    with_stats = str(tmp_path / "stats.db")
+    shutil.copyfile(movie_db, with_stats)
+    plain = connect()
+    stats = connect(with_stats)
+    assert aggregates.install_rating_stats(stats) > 0
+
+    for (N, min_num_reviews) in [(10, 1), (25, 3), (100, 1), (400, 0), (5, 20)]:
+        expected = [_key(movie) for movie in objecttier.get_top_N_movies(plain, N, min_num_reviews)]
+        found = [_key(movie) for movie in objecttier.get_top_N_movies(stats, N, min_num_reviews)]
+        assert found == expected, (N, min_num_reviews)